@@ -1,5 +1,5 @@
 # Módulo de autenticación 
-from app.auth.auth import verify_token, verify_permission, require_admin
+from app.auth.auth import verify_token, verify_permission, require_admin, enforce_rate_limit
 from app.auth.role_manager import Role, role_manager
 
-__all__ = ['verify_token', 'verify_permission', 'require_admin', 'Role', 'role_manager'] 
\ No newline at end of file
+__all__ = ['verify_token', 'verify_permission', 'require_admin', 'enforce_rate_limit', 'Role', 'role_manager'] 
\ No newline at end of file
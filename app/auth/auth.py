@@ -1,17 +1,32 @@
 import os
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from dotenv import load_dotenv
-from typing import Optional
+from typing import Callable, List, Optional
 
 from app.auth.role_manager import Role, role_manager
+from app.auth.rate_limiter import rate_limiter, RateLimitExceeded, retry_after_header
+from app.auth.key_store import ApiKey, ApiKeyStore, default_key_source
+from app.services.profiling import phase, current_timer, authorize_timing
+from app.services.overload import overload_guard, Overloaded
+from app.config.settings import load_environment, env_flag
 
 # Cargar variables de entorno
-load_dotenv()
+load_environment()
 
 # Obtener API Key desde variables de entorno
 API_KEY = os.getenv("MONGO_API_KEY")
 
+# Usar X-Forwarded-For para identificar al cliente (solo detrás de un proxy de confianza)
+TRUST_PROXY_HEADERS = env_flag("MONGO_API_TRUST_PROXY_HEADERS")
+
+# Almacén de claves de API (archivo config/api_keys.yaml o colección indicada en MONGO_API_KEYS_SOURCE)
+api_key_store = ApiKeyStore(
+    source=default_key_source(),
+    refresh_seconds=float(os.getenv("MONGO_API_KEYS_REFRESH_SECONDS", "5")),
+    cache_size=int(os.getenv("MONGO_API_KEYS_CACHE_SIZE", "1024")),
+    legacy_key=API_KEY,
+)
+
 # Configurar esquema de seguridad de Bearer token
 security = HTTPBearer(auto_error=False)
 
@@ -23,19 +38,48 @@ async def verify_token(
     """
     Verifica el Bearer token y devuelve el rol correspondiente según la configuración.
     Si no hay token o es inválido, devuelve el rol predeterminado (normalmente READER).
-    Si el token es válido (coincide con MONGO_API_KEY), devuelve el rol de administrador.
-    """
-    if credentials is None:
-        # No hay token, asignar rol predeterminado
-        return Role(role_manager.default_role)
-        
-    # Verificar si el token coincide con la API Key
-    if credentials.scheme.lower() == "bearer" and credentials.credentials == API_KEY:
-        # Token válido, asignar rol de administrador
-        return Role(role_manager.admin_role)
-    
-    # Token inválido, asignar rol predeterminado
-    return Role(role_manager.default_role)
+    Si el token corresponde a una clave registrada, devuelve el rol de esa clave; la
+    clave heredada MONGO_API_KEY recibe el rol de administrador.
+    El rol y la clave resuelta quedan en request.state para las comprobaciones de ámbito.
+    """
+    with phase("auth"):
+        request.state.api_key = None
+        request.state.role = Role(role_manager.default_role)
+        if credentials is not None and credentials.scheme.lower() == "bearer":
+            # Resolver el token contra las claves registradas; si no es válido, rol predeterminado
+            api_key = await api_key_store.resolve(credentials.credentials)
+            if api_key is not None:
+                request.state.api_key = api_key
+                request.state.role = Role(api_key.role or role_manager.admin_role)
+
+    # La instrumentación de tiempos solo se expone a administradores
+    if current_timer() is not None:
+        authorize_timing(role_manager.has_permission(request.state.role, role_manager.admin_role))
+    return request.state.role
+
+# Comprobación de ámbito (bases de datos y colecciones permitidas)
+def namespace_allowed(request: Request, database: str, collection: Optional[str] = None) -> bool:
+    """
+    Indica si la petición puede operar sobre la base de datos y la colección indicadas,
+    según los permisos del rol ('namespace_permissions' en roles.yaml) y el ámbito de la clave.
+    """
+    role = getattr(request.state, "role", None)
+    if role is not None and not role_manager.namespace_allowed(role.value, database, collection):
+        return False
+    api_key: Optional[ApiKey] = getattr(request.state, "api_key", None)
+    return api_key is None or api_key.allows(database, collection)
+
+def enforce_namespace(request: Request, database: str, collection: Optional[str] = None):
+    """
+    Verifica que la petición pueda operar sobre la base de datos y la colección
+    indicadas. Si no es así, lanza una excepción 403 Forbidden.
+    """
+    if not namespace_allowed(request, database, collection):
+        target = f"{database}.{collection}" if collection else database
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"No tienes acceso a '{target}'",
+        )
 
 # Middleware para verificar permisos basados en roles
 async def verify_permission(request: Request, role: Role = Depends(verify_token)):
@@ -58,4 +102,86 @@ async def require_admin(role: Role = Depends(verify_token)):
             detail=f"Se requiere rol '{Role.ADMIN}' o superior para esta operación",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return True 
\ No newline at end of file
+    return True
+
+# Identificación del cliente para los límites de tasa
+def get_client_id(request: Request) -> str:
+    """
+    Identifica al cliente que realiza la petición: por su clave si el token es
+    válido o por su dirección IP. Un token no reconocido no da identidad propia;
+    si no, bastaría con cambiarlo en cada petición para estrenar límites.
+    """
+    api_key = getattr(request.state, "api_key", None)
+    if api_key is not None:
+        return "key:" + api_key.name
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return "ip:" + forwarded.split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "desconocido")
+
+# Reservas de las dependencias que se mantienen hasta terminar de enviar la respuesta
+def hold_reservations(request: Request) -> Callable[[], None]:
+    """
+    Hace que las dependencias de la petición (límite de operaciones simultáneas y
+    admisión frente a MongoDB) no liberen sus reservas al terminar la ruta sino al
+    llamar a la función devuelta. Para respuestas en streaming: FastAPI cierra las
+    dependencias antes de enviar el cuerpo, que es donde se hace el trabajo.
+    """
+    held: List[Callable[[], None]] = []
+    request.state.held_reservations = held
+
+    def release():
+        while held:
+            held.pop()()
+    return release
+
+def _release(request: Request, release: Callable[[], None]):
+    held = getattr(request.state, "held_reservations", None)
+    if held is None:
+        release()
+    else:
+        held.append(release)
+
+# Dependencia para aplicar los límites de tasa y concurrencia
+async def enforce_rate_limit(request: Request, role: Role = Depends(verify_token)):
+    """
+    Dependencia que aplica los límites configurados en 'rate_limits' de roles.yaml
+    para el rol y la categoría del endpoint. Si se superan, lanza 429 con Retry-After.
+    La reserva de concurrencia se libera al terminar la petición.
+    """
+    route = request.scope.get("route")
+    path = route.path if route is not None else request.url.path
+    category = role_manager.get_endpoint_category(path, request.method)
+    try:
+        lease = await rate_limiter.acquire_async(role.value, category, get_client_id(request))
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.reason,
+            headers={"Retry-After": retry_after_header(e.retry_after)},
+        )
+    try:
+        yield
+    finally:
+        _release(request, lease.release)
+
+# Dependencia para no enviar más trabajo a MongoDB cuando está saturado o caído
+async def enforce_mongo_capacity(request: Request):
+    """
+    Dependencia que admite la petición según el límite de concurrencia adaptativo
+    y el circuit breaker de MongoDB. Si no hay capacidad, lanza 503 con Retry-After
+    en lugar de encolar la petición. La reserva se libera al terminar la petición.
+    """
+    try:
+        admission = overload_guard.admit()
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=e.reason,
+            headers={"Retry-After": retry_after_header(e.retry_after)},
+        )
+    try:
+        yield
+    finally:
+        _release(request, admission.release)
@@ -0,0 +1,268 @@
+import os
+import sys
+import asyncio
+import hmac
+import time
+import yaml
+import secrets
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app.auth.role_manager import Role
+from app.auth.namespaces import PatternSet
+
+logger = logging.getLogger(__name__)
+
+# Iteraciones por defecto al generar hashes PBKDF2
+PBKDF2_ITERATIONS = 200000
+
+# Hilos dedicados a verificar PBKDF2, fuera del bucle de eventos y del executor por defecto
+PBKDF2_WORKERS = 2
+
+
+class ApiKey:
+    """
+    Clave de API registrada: nombre, rol asignado y, opcionalmente, las bases de
+    datos y colecciones a las que queda restringida.
+    """
+    __slots__ = ("name", "role", "databases", "collections", "key_hash")
+
+    def __init__(self, name: str, role: str, key_hash: str,
+                 databases: Optional[List[str]] = None,
+                 collections: Optional[List[str]] = None):
+        self.name = name
+        self.role = role
+        self.key_hash = key_hash
+        self.databases = PatternSet(databases) if databases else None
+        self.collections = PatternSet(collections) if collections else None
+
+    def allows(self, database: str, collection: Optional[str] = None) -> bool:
+        """
+        Indica si la clave puede operar sobre la base de datos y colección indicadas.
+        Las colecciones pueden darse como 'coleccion' o como 'base.coleccion' y admiten globs.
+        """
+        if self.databases is not None and not self.databases.matches(database):
+            return False
+        if collection is not None and self.collections is not None:
+            return self.collections.matches(collection) or self.collections.matches(f"{database}.{collection}")
+        return True
+
+
+def hash_key(token: str, scheme: str = "sha256") -> str:
+    """
+    Genera el hash almacenable de una clave.
+
+    Formatos:
+        sha256:<hex>
+        pbkdf2_sha256:<iteraciones>:<sal hex>:<hash hex>
+    """
+    if scheme == "pbkdf2_sha256":
+        salt = secrets.token_bytes(16)
+        digest = hashlib.pbkdf2_hmac("sha256", token.encode("utf-8"), salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256:{PBKDF2_ITERATIONS}:{salt.hex()}:{digest.hex()}"
+    return "sha256:" + hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _verify_pbkdf2(token: str, key_hash: str) -> bool:
+    try:
+        _, iterations, salt, expected = key_hash.split(":")
+        digest = hashlib.pbkdf2_hmac("sha256", token.encode("utf-8"), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def key_id(token: str) -> Optional[str]:
+    """Identificador de una clave PBKDF2: la parte del token anterior al primer punto ('<id>.<secreto>')."""
+    prefix, separator, _ = token.partition(".")
+    return prefix if separator and prefix else None
+
+
+class ApiKeyStore:
+    """
+    Almacén de claves de API con hash, cargadas desde un archivo YAML o desde una
+    colección de MongoDB y recargadas periódicamente.
+
+    Los tokens verificados se guardan en una caché LRU (indexada por el SHA-256
+    del token, nunca por el token en claro) para que la autenticación no repita
+    la verificación en cada petición. Los tokens rechazados van a otra caché,
+    pequeña y de vida corta, que nunca desplaza a las claves válidas. Cada recarga
+    con cambios invalida ambas, de modo que una revocación se propaga en
+    'refresh_seconds' como máximo.
+
+    Las claves PBKDF2 se buscan por el identificador del token ('<id>.<secreto>'),
+    así que cada token verifica como mucho un hash, y la verificación y la recarga
+    se ejecutan en hilos aparte para no bloquear el bucle de eventos.
+    """
+
+    def __init__(self, source: str, refresh_seconds: float = 5.0, cache_size: int = 1024,
+                 legacy_key: Optional[str] = None, rejected_cache_size: int = 256,
+                 rejected_ttl: float = 10.0):
+        self.source = source
+        self.refresh_seconds = refresh_seconds
+        self.cache_size = cache_size
+        self.rejected_cache_size = rejected_cache_size
+        self.rejected_ttl = rejected_ttl
+        self.legacy_key = legacy_key
+        self.generation = 0
+        self._by_sha256: Dict[str, ApiKey] = {}
+        self._pbkdf2_by_id: Dict[str, ApiKey] = {}
+        self._signature = None
+        self._last_check = 0.0
+        self._cache: "OrderedDict[bytes, Tuple[int, ApiKey]]" = OrderedDict()
+        self._rejected: "OrderedDict[bytes, Tuple[int, float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # Carga de claves
+    def _read_entries(self) -> Tuple[object, List[Dict]]:
+        """Lee las entradas de la fuente. Devuelve una firma para detectar cambios y las entradas."""
+        if self.source.startswith("mongodb:"):
+            from app.config.database import get_collection
+            database, _, collection = self.source[len("mongodb:"):].partition(".")
+            entries = list(get_collection(database, collection).find({}, {"_id": 0}))
+            return entries, entries
+
+        path = self.source[len("file:"):] if self.source.startswith("file:") else self.source
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None, []
+        if mtime == self._signature:
+            return mtime, None
+        with open(path, "r") as f:
+            data = yaml.safe_load(f) or {}
+        return mtime, data.get("keys") or []
+
+    def refresh(self, force: bool = False, strict: bool = False):
+        """
+        Recarga las claves si ha pasado el intervalo de refresco o si se fuerza.
+        Los errores se registran y se siguen usando las claves actuales; con strict,
+        además se propagan (para las comprobaciones de arranque).
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.refresh_seconds:
+            return
+        # Solo una petición recarga; el resto sigue con las claves actuales
+        # (salvo en la primera carga, en la que todas esperan)
+        if not self._refresh_lock.acquire(blocking=force or self.generation == 0):
+            return
+        try:
+            self._last_check = now
+            signature, entries = self._read_entries()
+            if entries is None or signature == self._signature:
+                return
+            by_sha256, pbkdf2_by_id = {}, {}
+            for entry in entries:
+                if entry.get("revoked") or not entry.get("hash"):
+                    continue
+                if entry.get("role") not in Role.__members__:
+                    logger.warning("Rol inválido para la clave '%s': %s", entry.get("name"), entry.get("role"))
+                    continue
+                key = ApiKey(entry.get("name", "sin-nombre"), entry["role"], entry["hash"],
+                             entry.get("databases"), entry.get("collections"))
+                if key.key_hash.startswith("sha256:"):
+                    by_sha256[key.key_hash[len("sha256:"):]] = key
+                elif key.key_hash.startswith("pbkdf2_sha256:"):
+                    identifier = str(entry.get("id") or key.name)
+                    if identifier in pbkdf2_by_id:
+                        logger.warning("Identificador de clave duplicado '%s': se ignora '%s'", identifier, key.name)
+                        continue
+                    pbkdf2_by_id[identifier] = key
+                else:
+                    logger.warning("Formato de hash no soportado para la clave '%s'", key.name)
+            self._by_sha256, self._pbkdf2_by_id = by_sha256, pbkdf2_by_id
+            self._signature = signature
+            self.generation += 1
+            with self._cache_lock:
+                self._cache.clear()
+                self._rejected.clear()
+        except Exception as e:
+            logger.error("Error al cargar las claves de API desde %s: %s", self.source, e)
+            if strict:
+                raise
+        finally:
+            self._refresh_lock.release()
+
+    async def refresh_async(self):
+        """Recarga las claves en un hilo aparte si ha pasado el intervalo de refresco."""
+        if time.monotonic() - self._last_check < self.refresh_seconds:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self.refresh)
+
+    # Resolución de tokens
+    def _verify_fast(self, token: str, digest: bytes) -> Optional[ApiKey]:
+        hex_digest = digest.hex()
+        key = self._by_sha256.get(hex_digest)
+        if key is not None and hmac.compare_digest(key.key_hash[len("sha256:"):], hex_digest):
+            return key
+        if self.legacy_key and hmac.compare_digest(token.encode("utf-8"), self.legacy_key.encode("utf-8")):
+            # La clave única heredada no fija rol: recibe el 'admin_role' de roles.yaml
+            return ApiKey("MONGO_API_KEY", None, "")
+        return None
+
+    async def _verify(self, token: str, digest: bytes) -> Optional[ApiKey]:
+        key = self._verify_fast(token, digest)
+        if key is not None:
+            return key
+        identifier = key_id(token)
+        key = self._pbkdf2_by_id.get(identifier) if identifier else None
+        if key is None:
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=PBKDF2_WORKERS, thread_name_prefix="pbkdf2")
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(self._executor, _verify_pbkdf2, token, key.key_hash):
+            return key
+        return None
+
+    async def resolve(self, token: str) -> Optional[ApiKey]:
+        """Devuelve la clave asociada al token, o None si no es válido o está revocado."""
+        await self.refresh_async()
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        generation = self.generation
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(digest)
+            if cached is not None and cached[0] == generation:
+                self._cache.move_to_end(digest)
+                return cached[1]
+            rejected = self._rejected.get(digest)
+            if rejected is not None and rejected[0] == generation and rejected[1] > now:
+                return None
+
+        key = await self._verify(token, digest)
+        with self._cache_lock:
+            if key is not None:
+                self._cache[digest] = (generation, key)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                # Los tokens inválidos se recuerdan poco tiempo y aparte, sin desplazar claves válidas
+                self._rejected[digest] = (generation, now + self.rejected_ttl)
+                self._rejected.move_to_end(digest)
+                if len(self._rejected) > self.rejected_cache_size:
+                    self._rejected.popitem(last=False)
+        return key
+
+
+def default_key_source() -> str:
+    return os.getenv("MONGO_API_KEYS_SOURCE") or "file:" + os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config", "api_keys.yaml")
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.auth.key_store <token> [sha256|pbkdf2_sha256]
+    if len(sys.argv) < 2:
+        print("Uso: python -m app.auth.key_store <token> [sha256|pbkdf2_sha256]")
+        sys.exit(1)
+    scheme = sys.argv[2] if len(sys.argv) > 2 else "sha256"
+    if scheme == "pbkdf2_sha256" and key_id(sys.argv[1]) is None:
+        print("Las claves pbkdf2_sha256 deben tener la forma <id>.<secreto> (el id se indica en 'id' o 'name')")
+        sys.exit(1)
+    print(hash_key(sys.argv[1], scheme))
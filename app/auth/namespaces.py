@@ -0,0 +1,63 @@
+import re
+import fnmatch
+from typing import Dict, Iterable, Optional
+
+
+class PatternSet:
+    """
+    Conjunto de patrones de nombres (exactos o glob con '*', '?' y '[...]')
+    compilado una sola vez: los nombres exactos van a un frozenset y los globs
+    a una única expresión regular.
+    """
+    __slots__ = ("exact", "regex", "match_all")
+
+    def __init__(self, patterns: Optional[Iterable[str]]):
+        patterns = list(patterns or [])
+        self.match_all = "*" in patterns
+        self.exact = frozenset(p for p in patterns if not any(c in p for c in "*?["))
+        globs = [p for p in patterns if p not in self.exact]
+        self.regex = re.compile("|".join(fnmatch.translate(p) for p in globs)) if globs else None
+
+    def __bool__(self) -> bool:
+        return self.match_all or bool(self.exact) or self.regex is not None
+
+    def matches(self, name: str) -> bool:
+        """Indica si el nombre coincide con algún patrón del conjunto."""
+        if self.match_all or name in self.exact:
+            return True
+        return self.regex is not None and self.regex.match(name) is not None
+
+
+class NamespaceRule:
+    """Reglas allow/deny compiladas para un nivel (bases de datos o colecciones)."""
+    __slots__ = ("allow", "deny")
+
+    def __init__(self, config: Optional[Dict]):
+        config = config or {}
+        # Sin lista 'allow' se permite todo lo que no esté denegado
+        self.allow = PatternSet(config.get("allow", ["*"]))
+        self.deny = PatternSet(config.get("deny"))
+
+    def permits(self, name: str) -> bool:
+        """La denegación tiene prioridad sobre la autorización."""
+        if self.deny and self.deny.matches(name):
+            return False
+        return self.allow.matches(name)
+
+
+class NamespacePolicy:
+    """
+    Permisos de un rol sobre bases de datos y colecciones.
+    Los patrones de colecciones se comparan con el espacio de nombres completo 'base.coleccion'.
+    """
+    __slots__ = ("databases", "collections")
+
+    def __init__(self, config: Optional[Dict]):
+        config = config or {}
+        self.databases = NamespaceRule(config.get("databases"))
+        self.collections = NamespaceRule(config.get("collections"))
+
+    def permits(self, database: str, collection: Optional[str] = None) -> bool:
+        if not self.databases.permits(database):
+            return False
+        return collection is None or self.collections.permits(f"{database}.{collection}")
@@ -0,0 +1,312 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from app.auth.role_manager import role_manager
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Se lanza cuando un cliente supera su límite de tasa o de concurrencia."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LimitRule:
+    """Límites configurados para un rol y una categoría de endpoints."""
+    __slots__ = ("rate", "burst", "max_concurrent")
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None,
+                 max_concurrent: Optional[int] = None):
+        self.rate = float(rate) if rate else None
+        self.burst = float(burst) if burst else (self.rate if self.rate else None)
+        self.max_concurrent = int(max_concurrent) if max_concurrent else None
+
+
+class InMemoryBackend:
+    """Contadores en memoria del proceso (un bucket y un contador por clave)."""
+
+    blocking = False
+
+    # Número de claves a partir del cual se purgan los buckets llenos
+    PRUNE_THRESHOLD = 10000
+
+    def __init__(self):
+        # clave -> (tokens, última actualización, momento en que el bucket vuelve a estar lleno)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._inflight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """Consume un token. Devuelve 0 si se permitió o los segundos hasta el siguiente token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / rate
+            # Cada bucket guarda cuándo se llena con su propia regla: la purga no
+            # puede juzgarlo con la tasa de otra regla
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if wait == 0.0 and len(self._buckets) > self.PRUNE_THRESHOLD:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now: float):
+        # Un bucket que ya estaría lleno equivale a no tener entrada
+        for key, (_, _, full_at) in list(self._buckets.items()):
+            if full_at <= now:
+                del self._buckets[key]
+
+    def acquire(self, key: str, limit: int) -> bool:
+        """Reserva una operación en curso si no se ha alcanzado el límite."""
+        with self._lock:
+            current = self._inflight.get(key, 0)
+            if current >= limit:
+                return False
+            self._inflight[key] = current + 1
+            return True
+
+    def release(self, key: str):
+        """Libera una operación en curso."""
+        with self._lock:
+            current = self._inflight.get(key, 0) - 1
+            if current > 0:
+                self._inflight[key] = current
+            else:
+                self._inflight.pop(key, None)
+
+
+class SQLiteBackend:
+    """
+    Contadores compartidos entre workers de la misma máquina mediante un archivo SQLite.
+    Las operaciones en curso se registran por PID para poder descartar las de
+    procesos que ya no existen.
+
+    Las consultas pueden esperar al bloqueo del archivo (hasta 'timeout' segundos),
+    así que se ejecutan en un hilo propio y no en el bucle de eventos. Si el bloqueo
+    no llega a tiempo, el límite no se aplica a esa petición (se registra un aviso)
+    en lugar de fallar; las liberaciones pendientes se reintentan en la siguiente
+    operación.
+    """
+
+    blocking = True
+
+    # Segundos entre limpiezas de las operaciones en curso de procesos que ya no existen
+    CLEANUP_INTERVAL = 30.0
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # Un único hilo: serializa las consultas del proceso y solo usa una conexión
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limit")
+        # Liberaciones que no se pudieron escribir; solo se usa desde el hilo del executor
+        self._pending_releases: Dict[str, int] = {}
+        conn = self._connection()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS inflight (key TEXT, pid INTEGER, count INTEGER, "
+                         "PRIMARY KEY (key, pid))")
+        self._cleanup_dead_workers(conn, at_start=True)
+        self._last_cleanup = time.monotonic()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def _cleanup_dead_workers(self, conn: sqlite3.Connection, at_start: bool = False):
+        # Al arrancar, las filas con el PID propio son de un proceso anterior que lo tuvo
+        pids = [row[0] for row in conn.execute("SELECT DISTINCT pid FROM inflight")]
+        for pid in pids:
+            if pid == os.getpid():
+                alive = not at_start
+            else:
+                alive = True
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    alive = False
+                except PermissionError:
+                    pass
+            if not alive:
+                conn.execute("DELETE FROM inflight WHERE pid = ?", (pid,))
+
+    def _begin(self) -> sqlite3.Connection:
+        """Abre una transacción de escritura y aplica las liberaciones pendientes."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        for key, count in self._pending_releases.items():
+            conn.execute("UPDATE inflight SET count = MAX(count - ?, 0) WHERE key = ? AND pid = ?",
+                         (count, key, os.getpid()))
+        return conn
+
+    def _commit(self, conn: sqlite3.Connection):
+        conn.execute("COMMIT")
+        self._pending_releases.clear()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        # El reloj de pared es común a todos los procesos, a diferencia de monotonic()
+        now = time.time()
+        try:
+            conn = self._begin()
+        except sqlite3.OperationalError as e:
+            logger.warning("Límite de tasa no aplicado para %s: %s", key, e)
+            return 0.0
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            self._commit(conn)
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, key: str, limit: int) -> Optional[bool]:
+        """Reserva una operación en curso. Devuelve None si no se pudo registrar (bloqueo del archivo)."""
+        try:
+            conn = self._begin()
+        except sqlite3.OperationalError as e:
+            logger.warning("Límite de concurrencia no aplicado para %s: %s", key, e)
+            return None
+        try:
+            if time.monotonic() - self._last_cleanup >= self.CLEANUP_INTERVAL:
+                self._cleanup_dead_workers(conn)
+                self._last_cleanup = time.monotonic()
+            current = conn.execute("SELECT COALESCE(SUM(count), 0) FROM inflight WHERE key = ?",
+                                   (key,)).fetchone()[0]
+            if current >= limit:
+                self._commit(conn)
+                return False
+            conn.execute("INSERT INTO inflight (key, pid, count) VALUES (?, ?, 1) "
+                         "ON CONFLICT (key, pid) DO UPDATE SET count = count + 1", (key, os.getpid()))
+            self._commit(conn)
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, key: str):
+        # Se encola en el hilo del backend: no bloquea el bucle de eventos
+        self.executor.submit(self._release, key)
+
+    def _release(self, key: str):
+        self._pending_releases[key] = self._pending_releases.get(key, 0) + 1
+        try:
+            self._commit(self._begin())
+        except sqlite3.OperationalError as e:
+            logger.warning("Liberación de %s aplazada: %s", key, e)
+
+
+class RateLimitLease:
+    """Reserva de concurrencia que debe liberarse al terminar la petición."""
+    __slots__ = ("_backend", "_key")
+
+    def __init__(self, backend=None, key: Optional[str] = None):
+        self._backend = backend
+        self._key = key
+
+    def release(self):
+        if self._backend is not None:
+            self._backend.release(self._key)
+            self._backend = None
+
+
+class RateLimiter:
+    """
+    Aplica límites de tasa (token bucket) y de operaciones concurrentes por cliente,
+    configurados por rol y categoría de endpoints en la sección 'rate_limits' de roles.yaml.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or self._backend_from_env()
+        self._rules: Dict[Tuple[str, str], Optional[LimitRule]] = {}
+        self._config_ref = None
+
+    @staticmethod
+    def _backend_from_env():
+        """Selecciona el backend según MONGO_API_RATE_LIMIT_BACKEND ('memory' o 'sqlite:<ruta>')."""
+        setting = os.getenv("MONGO_API_RATE_LIMIT_BACKEND", "memory")
+        if setting.startswith("sqlite:"):
+            return SQLiteBackend(setting[len("sqlite:"):])
+        return InMemoryBackend()
+
+    def get_rule(self, role: str, category: str) -> Optional[LimitRule]:
+        """Obtiene la regla aplicable. Las reglas se recalculan si cambia la configuración de roles."""
+        if self._config_ref is not role_manager.config:
+            self._rules = {}
+            self._config_ref = role_manager.config
+        key = (role, category)
+        if key not in self._rules:
+            role_limits = (role_manager.config.get("rate_limits") or {}).get(role) or {}
+            rule_config = role_limits.get(category) or role_limits.get("default")
+            self._rules[key] = LimitRule(**rule_config) if rule_config else None
+        return self._rules[key]
+
+    def acquire(self, role: str, category: str, client_id: str) -> RateLimitLease:
+        """
+        Comprueba los límites del cliente y reserva una operación en curso.
+
+        Raises:
+            RateLimitExceeded: Si se supera la tasa o el número de operaciones concurrentes
+        """
+        rule = self.get_rule(role, category)
+        if rule is None:
+            return RateLimitLease()
+
+        key = f"{role}:{category}:{client_id}"
+        if rule.rate:
+            wait = self.backend.take(key, rule.rate, rule.burst)
+            if wait > 0:
+                raise RateLimitExceeded("Límite de peticiones por segundo superado", wait)
+
+        if rule.max_concurrent:
+            acquired = self.backend.acquire(key, rule.max_concurrent)
+            if acquired is False:
+                raise RateLimitExceeded("Demasiadas operaciones simultáneas en curso", 1.0)
+            if acquired:
+                return RateLimitLease(self.backend, key)
+        return RateLimitLease()
+
+    async def acquire_async(self, role: str, category: str, client_id: str) -> RateLimitLease:
+        """acquire() desde el bucle de eventos: con un backend bloqueante se ejecuta en su hilo."""
+        if not self.backend.blocking:
+            return self.acquire(role, category, client_id)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.backend.executor, self.acquire, role, category, client_id
+        )
+
+
+def retry_after_header(seconds: float) -> str:
+    """Formatea el valor de la cabecera Retry-After (segundos enteros, mínimo 1)."""
+    return str(max(1, math.ceil(seconds)))
+
+
+# Instancia global del limitador
+rate_limiter = RateLimiter()
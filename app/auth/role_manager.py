@@ -4,6 +4,8 @@ from enum import Enum
 from typing import Dict, List, Optional, Any
 from fastapi import Request, HTTPException, status
 
+from app.auth.namespaces import NamespacePolicy
+
 # Definición de roles como Enum
 class Role(str, Enum):
     PUBLIC = "PUBLIC"
@@ -20,39 +22,66 @@ class RoleManager:
     """
     _instance = None
     
+    # Máximo de decisiones de espacio de nombres memorizadas
+    NAMESPACE_CACHE_SIZE = 65536
+    
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(RoleManager, cls).__new__(cls)
             cls._instance._initialized = False
         return cls._instance
     
+    # Atributos derivados de roles.yaml: se cargan en el primer acceso (o en load())
+    _CONFIG_ATTRIBUTES = frozenset({
+        "config", "endpoints_config", "default_role", "admin_role", "roles_hierarchy",
+        "endpoint_categories", "namespace_policies", "_namespace_cache",
+    })
+    
     def __init__(self):
-        """Inicializa el administrador de roles cargando la configuración."""
+        """Inicializa el administrador de roles. La configuración se carga de forma diferida."""
         if self._initialized:
             return
             
         self.config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 
                                        "config", "roles.yaml")
-        self.config = self._load_config()
-        self.endpoints_config = self.config.get("endpoints", {})
-        self.default_role = self.config.get("default_role", "READER")
-        self.admin_role = self.config.get("admin_role", "ADMIN")
-        self.roles_hierarchy = self.config.get("roles_hierarchy", {
-            "PUBLIC": 0,
-            "READER": 10,
-            "EDITOR": 20,
-            "ADMIN": 30,
-            "SUPERADMIN": 40
-        })
+        self._loaded = False
+        # Error de la última lectura de roles.yaml (None si se leyó bien)
+        self.load_error: Optional[str] = None
         self._initialized = True
     
+    def __getattr__(self, name: str):
+        # Solo se invoca si el atributo aún no existe, es decir, antes de la primera carga
+        if name in RoleManager._CONFIG_ATTRIBUTES and not self.__dict__.get("_loaded", True):
+            self.load()
+            return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+    
+    @property
+    def loaded(self) -> bool:
+        """Indica si la configuración de roles ya se ha cargado."""
+        return self._loaded
+    
+    def load(self, strict: bool = False):
+        """
+        Carga la configuración si aún no se ha cargado (en el arranque de la API o en el primer uso).
+        Con strict, lanza una excepción si no se pudo leer roles.yaml (aunque se aplique
+        la configuración por defecto), para que el arranque lo notifique.
+        """
+        if not self._loaded:
+            self.reload_config()
+        if strict and self.load_error is not None:
+            raise RuntimeError(f"Error al cargar la configuración de roles: {self.load_error}")
+    
     def _load_config(self) -> Dict:
         """Carga la configuración desde el archivo YAML."""
         try:
             with open(self.config_path, "r") as f:
-                return yaml.safe_load(f)
+                config = yaml.safe_load(f)
+            self.load_error = None
+            return config
         except Exception as e:
             print(f"Error al cargar la configuración de roles: {e}")
+            self.load_error = str(e)
             # Configuración por defecto si no se puede cargar el archivo
             return {
                 "default_role": "READER",
@@ -70,6 +99,11 @@ class RoleManager:
     def reload_config(self):
         """Recarga la configuración desde el archivo YAML."""
         self.config = self._load_config()
+        self._apply_config()
+        self._loaded = True
+
+    def _apply_config(self):
+        """Aplica la configuración cargada a los atributos del administrador."""
         self.endpoints_config = self.config.get("endpoints", {})
         self.default_role = self.config.get("default_role", "READER")
         self.admin_role = self.config.get("admin_role", "ADMIN")
@@ -80,7 +114,19 @@ class RoleManager:
             "ADMIN": 30,
             "SUPERADMIN": 40
         })
-    
+        # Índice (ruta, método) -> categoría para resolver endpoints sin recorrer la configuración
+        self.endpoint_categories = {}
+        for category, endpoints in self.endpoints_config.items():
+            for endpoint_config in endpoints.values():
+                key = (endpoint_config.get("path"), endpoint_config.get("method"))
+                self.endpoint_categories.setdefault(key, category)
+        # Permisos por base de datos y colección, compilados a patrones una sola vez
+        self.namespace_policies = {
+            role: NamespacePolicy(policy_config)
+            for role, policy_config in (self.config.get("namespace_permissions") or {}).items()
+        }
+        self._namespace_cache = {}
+
     def get_required_role(self, path: str, method: str) -> str:
         """
         Determina el rol requerido para un endpoint específico.
@@ -104,6 +150,19 @@ class RoleManager:
         # Si no se encuentra, devolver el rol predeterminado
         return self.default_role
     
+    def get_endpoint_category(self, path: str, method: str) -> str:
+        """
+        Determina la categoría de configuración (documents, aggregation...) de un endpoint.
+        
+        Args:
+            path: Plantilla de ruta del endpoint (por ejemplo, /api/documents/{id})
+            method: Método HTTP (GET, POST, etc.)
+            
+        Returns:
+            El nombre de la categoría, o "default" si el endpoint no está configurado
+        """
+        return self.endpoint_categories.get((path, method.upper()), "default")
+    
     def has_permission(self, user_role: str, required_role: str) -> bool:
         """
         Verifica si un rol tiene permiso para acceder a un recurso.
@@ -120,6 +179,29 @@ class RoleManager:
         
         return user_level >= required_level
     
+    def namespace_allowed(self, user_role: str, database: str, collection: Optional[str] = None) -> bool:
+        """
+        Verifica si un rol puede operar sobre una base de datos y, opcionalmente, una colección,
+        según la sección 'namespace_permissions' de la configuración.
+        
+        Args:
+            user_role: Rol del usuario
+            database: Nombre de la base de datos
+            collection: Nombre de la colección (opcional)
+            
+        Returns:
+            True si tiene permiso, False en caso contrario
+        """
+        key = (user_role, database, collection)
+        allowed = self._namespace_cache.get(key)
+        if allowed is None:
+            policy = self.namespace_policies.get(user_role)
+            allowed = policy is None or policy.permits(database, collection)
+            if len(self._namespace_cache) >= self.NAMESPACE_CACHE_SIZE:
+                self._namespace_cache.clear()
+            self._namespace_cache[key] = allowed
+        return allowed
+    
     def check_permission(self, request: Request, user_role: str) -> bool:
         """
         Verifica si un usuario tiene permiso para acceder a un endpoint.
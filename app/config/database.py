@@ -1,11 +1,14 @@
 import os
-from dotenv import load_dotenv
+import threading
+from typing import Any, Dict, Optional
 from pymongo import MongoClient
 from pymongo.database import Database
 from pymongo.collection import Collection
 
+from app.config.settings import load_environment
+
 # Cargar variables de entorno
-load_dotenv()
+load_environment()
 
 # Configuración de MongoDB
 MONGO_USERNAME = os.getenv("MONGO_USERNAME")
@@ -16,15 +19,69 @@ MONGO_PORT = os.getenv("MONGO_PORT", "27017")
 # Crear URL de conexión
 MONGO_URL = f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}"
 
-# Cliente MongoDB
-client = MongoClient(MONGO_URL)
+# Compresión del protocolo entre la API y MongoDB (p. ej. "zstd,snappy,zlib").
+# zstd requiere el paquete 'zstandard' y snappy el paquete 'python-snappy'.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+MONGO_ZLIB_COMPRESSION_LEVEL = os.getenv("MONGO_ZLIB_COMPRESSION_LEVEL")
+
+# Conexiones que el pool mantiene abiertas desde el arranque
+MONGO_MIN_POOL_SIZE = os.getenv("MONGO_MIN_POOL_SIZE")
+
+# Tiempo máximo de cada operación, incluida la espera por una conexión libre del pool
+MONGO_TIMEOUT_MS = os.getenv("MONGO_TIMEOUT_MS")
+
+# Cliente MongoDB del proceso; se crea en el primer uso o en el arranque de la API
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+
+def client_options() -> Dict[str, Any]:
+    """Opciones adicionales del cliente según las variables de entorno."""
+    options: Dict[str, Any] = {}
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    if MONGO_ZLIB_COMPRESSION_LEVEL is not None:
+        options["zlibCompressionLevel"] = int(MONGO_ZLIB_COMPRESSION_LEVEL)
+    if MONGO_MIN_POOL_SIZE is not None:
+        options["minPoolSize"] = int(MONGO_MIN_POOL_SIZE)
+    if MONGO_TIMEOUT_MS is not None:
+        options["timeoutMS"] = int(MONGO_TIMEOUT_MS)
+    return options
+
+
+def get_client() -> MongoClient:
+    """
+    Obtiene el cliente MongoDB del proceso, creándolo la primera vez.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(MONGO_URL, **client_options())
+    return _client
+
+
+def close_client():
+    """Cierra el cliente MongoDB si se llegó a crear (al detener la API)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def __getattr__(name: str):
+    # Compatibilidad con 'from app.config.database import client'
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Función para obtener la base de datos
 def get_database(db_name: str) -> Database:
     """
     Obtiene una instancia de la base de datos MongoDB.
     """
-    return client[db_name]
+    return get_client()[db_name]
 
 # Función para obtener una colección
 def get_collection(db_name: str, collection_name: str) -> Collection:
@@ -32,4 +89,4 @@ def get_collection(db_name: str, collection_name: str) -> Collection:
     Obtiene una instancia de una colección MongoDB.
     """
     db = get_database(db_name)
-    return db[collection_name] 
\ No newline at end of file
+    return db[collection_name]
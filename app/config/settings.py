@@ -0,0 +1,30 @@
+import os
+from typing import List
+
+from dotenv import load_dotenv
+
+_environment_loaded = False
+
+
+def load_environment():
+    """
+    Carga el archivo .env una sola vez por proceso. Las variables ya definidas
+    en el entorno tienen prioridad sobre las del archivo.
+    """
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        _environment_loaded = True
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """Lee una variable de entorno booleana (1/true/yes)."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes")
+
+
+def env_list(name: str) -> List[str]:
+    """Lee una variable de entorno con valores separados por comas."""
+    return [item.strip() for item in os.getenv(name, "").split(",") if item.strip()]
@@ -6,6 +6,14 @@ from pydantic import BaseModel
 import json
 from typing import Callable
 import logging
+from app.config.settings import load_environment
+
+# Cargar variables de entorno una sola vez, antes de importar el resto de módulos
+load_environment()
+
+from app.services.profiling import TimingMiddleware, phase
+from app.services.compression import CompressionMiddleware
+from app.services.lifecycle import lifespan
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -15,7 +23,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="MongoDB API Ultra-rápida",
     description="API para interactuar con MongoDB con todas las funcionalidades nativas",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -25,11 +34,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Dump"],
 )
 
+# Instrumentación opcional de tiempos por fase (Server-Timing)
+app.add_middleware(TimingMiddleware)
+
+# Compresión de respuestas y descompresión de cuerpos de petición
+app.add_middleware(CompressionMiddleware)
+
 # Convertidor para convertir objetos BSON a JSON
 def parse_json(data):
-    return json.loads(json_util.dumps(data))
+    with phase("parse"):
+        return json.loads(json_util.dumps(data))
 
 # Clase para manejar la solicitud de base de datos y colección
 class MongoRequest(BaseModel):
@@ -47,12 +64,31 @@ from app.routes.collection_routes import router as collection_router
 from app.routes.document_routes import router as document_router
 from app.routes.aggregation_routes import router as aggregation_router
 from app.routes.index_routes import router as index_router
+from app.routes.metrics_routes import router as metrics_router
+from app.routes.cursor_routes import router as cursor_router
+from app.routes.export_routes import router as export_router
+from app.routes.rollup_routes import router as rollup_router
+from app.routes.search_routes import router as search_router
+from app.routes.health_routes import router as health_router
+from app.auth.auth import enforce_rate_limit, enforce_mongo_capacity
+
+# Límites de tasa y concurrencia aplicados a todos los endpoints de la API
+rate_limit_dependencies = [Depends(enforce_rate_limit)]
+
+# Endpoints que trabajan con MongoDB: además, control de carga (503 si MongoDB está saturado o caído)
+mongo_dependencies = rate_limit_dependencies + [Depends(enforce_mongo_capacity)]
 
 # Incluir routers
-app.include_router(collection_router, prefix="/api", tags=["Colecciones"])
-app.include_router(document_router, prefix="/api", tags=["Documentos"])
-app.include_router(aggregation_router, prefix="/api", tags=["Agregaciones"])
-app.include_router(index_router, prefix="/api", tags=["Índices"])
+app.include_router(collection_router, prefix="/api", tags=["Colecciones"], dependencies=mongo_dependencies)
+app.include_router(document_router, prefix="/api", tags=["Documentos"], dependencies=mongo_dependencies)
+app.include_router(aggregation_router, prefix="/api", tags=["Agregaciones"], dependencies=mongo_dependencies)
+app.include_router(index_router, prefix="/api", tags=["Índices"], dependencies=mongo_dependencies)
+app.include_router(search_router, prefix="/api", tags=["Búsqueda"], dependencies=mongo_dependencies)
+app.include_router(cursor_router, prefix="/api", tags=["Cursores"], dependencies=mongo_dependencies)
+app.include_router(export_router, prefix="/api", tags=["Exportación"], dependencies=mongo_dependencies)
+app.include_router(rollup_router, prefix="/api", tags=["Rollups"], dependencies=mongo_dependencies)
+app.include_router(metrics_router, prefix="/api", tags=["Métricas"], dependencies=rate_limit_dependencies)
+app.include_router(health_router, tags=["Estado"])
 
 @app.get("/")
 async def root():
@@ -1,36 +1,67 @@
-from fastapi import APIRouter, HTTPException, Body, Query, Depends
+from fastapi import APIRouter, HTTPException, Body, Query, Depends, Request
 from typing import List, Dict, Any, Optional
+from pymongo.errors import ExecutionTimeout
 from app.config.database import get_collection
 from app.main import MongoRequest, parse_json
 from app.services.mongo_service import MongoService
-from app.auth.auth import verify_token, require_admin, Role
+from app.services.query_shape import query_plan_cache, QueryShapeError
+from app.services.metrics import query_metrics
+from app.services.document_cache import document_cache
+from app.services.pipeline_guard import pipeline_guard, PipelineRejected
+from app.services.request_body import (
+    BodyError, BULK_SCHEMA, openapi_body, read_json_object, strict_mode,
+    get_namespace, get_objects, build_bulk_operations,
+)
+from app.services.profiling import TimedRoute
+from app.auth.auth import verify_token, require_admin, enforce_namespace, namespace_allowed, Role
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Operaciones de lectura para agregaciones (disponibles para todos)
 @router.post("/aggregate")
 async def aggregate(
+    http_request: Request,
     request: MongoRequest,
     pipeline: List[Dict[str, Any]] = Body(...),
     role: Role = Depends(verify_token)
 ):
-    """Ejecuta una operación de agregación en una colección."""
+    """
+    Ejecuta una operación de agregación en una colección. El pipeline se valida
+    antes contra la política de agregación del rol (etapas permitidas, coste,
+    tiempo máximo y número máximo de resultados).
+    """
+    enforce_namespace(http_request, request.database, request.collection)
+    try:
+        plan = query_plan_cache.plan_aggregate(pipeline)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         collection = get_collection(request.database, request.collection)
         service = MongoService(collection)
-        result = await service.aggregate(pipeline)
+        pipeline, options = await pipeline_guard.prepare(
+            plan, pipeline, collection, role.value,
+            allowed=lambda database, name: namespace_allowed(http_request, database, name)
+        )
+        with query_metrics.track(plan, request.database, request.collection):
+            result = await service.aggregate(pipeline, **options)
         return parse_json(result)
+    except PipelineRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=400, detail="La agregación superó el tiempo máximo permitido para el rol")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/distinct")
 async def distinct(
+    http_request: Request,
     request: MongoRequest,
     field: str = Body(...),
     filter: Dict[str, Any] = Body(default=None),
     role: Role = Depends(verify_token)
 ):
     """Encuentra valores únicos para un campo específico."""
+    enforce_namespace(http_request, request.database, request.collection)
     try:
         collection = get_collection(request.database, request.collection)
         service = MongoService(collection)
@@ -42,6 +73,7 @@ async def distinct(
 # Operaciones de modificación para agregaciones (requieren rol de administrador)
 @router.post("/group", dependencies=[Depends(require_admin)])
 async def group(
+    http_request: Request,
     request: MongoRequest,
     key: Dict[str, Any] = Body(...),
     condition: Dict[str, Any] = Body(default={}),
@@ -50,6 +82,7 @@ async def group(
     finalize: str = Body(default=None)
 ):
     """Realiza una operación de group (agrupación) en una colección. Requiere rol de administrador."""
+    enforce_namespace(http_request, request.database, request.collection)
     try:
         collection = get_collection(request.database, request.collection)
         
@@ -64,6 +97,7 @@ async def group(
 
 @router.post("/map-reduce", dependencies=[Depends(require_admin)])
 async def map_reduce(
+    http_request: Request,
     request: MongoRequest,
     map_function: str = Body(...),
     reduce_function: str = Body(...),
@@ -74,6 +108,10 @@ async def map_reduce(
     finalize: str = Body(default=None)
 ):
     """Realiza una operación de map-reduce en una colección. Requiere rol de administrador."""
+    enforce_namespace(http_request, request.database, request.collection)
+    for action in ("replace", "merge", "reduce"):
+        if isinstance(out.get(action), str):
+            enforce_namespace(http_request, out.get("db") or request.database, out[action])
     try:
         collection = get_collection(request.database, request.collection)
         
@@ -90,6 +128,7 @@ async def map_reduce(
         # Si el resultado es una colección, devolver los documentos
         if isinstance(result, dict) and "result" in result:
             out_collection_name = result["result"]
+            document_cache.invalidate(request.database, out_collection_name)
             out_collection = get_collection(request.database, out_collection_name)
             documents = list(out_collection.find())
             return parse_json(documents)
@@ -98,39 +137,32 @@ async def map_reduce(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/bulk", dependencies=[Depends(require_admin)])
+@router.post("/bulk", dependencies=[Depends(require_admin)], openapi_extra=openapi_body(BULK_SCHEMA))
 async def bulk_operations(
-    request: MongoRequest,
-    operations: List[Dict[str, Any]] = Body(...),
-    ordered: bool = Body(default=True)
+    http_request: Request,
+    strict: Optional[bool] = Query(default=None, description="Valida también el contenido de cada operación")
 ):
-    """Ejecuta operaciones de escritura masiva en una colección. Requiere rol de administrador."""
+    """
+    Ejecuta operaciones de escritura masiva en una colección. Requiere rol de administrador.
+    El cuerpo ({"request": {...}, "operations": [...], "ordered": true}) se lee en crudo
+    y solo se comprueban el tipo y los campos requeridos de cada operación; con
+    'strict' se valida además su contenido.
+    """
+    try:
+        body = await read_json_object(http_request)
+        request = get_namespace(body, "request")
+        ordered = body.get("ordered", True)
+        if not isinstance(ordered, bool):
+            raise BodyError("'ordered' debe ser booleano")
+        operations = build_bulk_operations(get_objects(body, "operations"), strict_mode(strict))
+        del body
+    except BodyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    enforce_namespace(http_request, request.database, request.collection)
     try:
-        from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
-        
         collection = get_collection(request.database, request.collection)
         service = MongoService(collection)
-        
-        # Convertir operaciones JSON a operaciones pymongo
-        bulk_operations = []
-        for op in operations:
-            op_type = op["type"]
-            if op_type == "insert":
-                bulk_operations.append(InsertOne(op["document"]))
-            elif op_type == "update_one":
-                bulk_operations.append(UpdateOne(op["filter"], op["update"], upsert=op.get("upsert", False)))
-            elif op_type == "update_many":
-                bulk_operations.append(UpdateMany(op["filter"], op["update"], upsert=op.get("upsert", False)))
-            elif op_type == "replace_one":
-                bulk_operations.append(ReplaceOne(op["filter"], op["replacement"], upsert=op.get("upsert", False)))
-            elif op_type == "delete_one":
-                bulk_operations.append(DeleteOne(op["filter"]))
-            elif op_type == "delete_many":
-                bulk_operations.append(DeleteMany(op["filter"]))
-            else:
-                raise HTTPException(status_code=400, detail=f"Tipo de operación desconocido: {op_type}")
-        
-        result = await service.bulk_write(bulk_operations, ordered)
+        result = await service.bulk_write(operations, ordered)
         
         # Convertir resultado a un formato JSON serializable
         return {
@@ -1,71 +1,136 @@
-from fastapi import APIRouter, HTTPException, Body, Query, Depends
-from typing import List, Dict, Any, Optional
-from app.config.database import client
+from fastapi import APIRouter, HTTPException, Body, Query, Depends, Request
+from typing import List, Dict, Any, Optional, Literal
+from pydantic import BaseModel
+from app.config.database import get_client
 from app.main import MongoRequest, parse_json
-from app.auth.auth import verify_token, require_admin, Role
+from app.services.metadata_cache import metadata_cache, collection_stats
+from app.services.document_cache import document_cache
+from app.services.profiling import TimedRoute
+from app.auth.auth import verify_token, require_admin, enforce_namespace, namespace_allowed, Role
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+
+class TimeSeriesOptions(BaseModel):
+    """Opciones de una colección time-series de MongoDB."""
+    timeField: str
+    metaField: Optional[str] = None
+    granularity: Optional[Literal["seconds", "minutes", "hours"]] = None
+    bucketMaxSpanSeconds: Optional[int] = None
+    bucketRoundingSeconds: Optional[int] = None
+
+
+class CreateCollectionRequest(MongoRequest):
+    """Colección a crear, opcionalmente time-series y con caducidad de documentos."""
+    timeseries: Optional[TimeSeriesOptions] = None
+    expireAfterSeconds: Optional[int] = None
 
 # Operaciones de lectura (disponibles para todos)
 @router.get("/databases")
-async def get_databases(role: Role = Depends(verify_token)):
+async def get_databases(http_request: Request, role: Role = Depends(verify_token)):
     """Obtiene la lista de todas las bases de datos."""
     try:
-        databases = client.list_database_names()
+        names = await metadata_cache.get(("databases",), get_client().list_database_names)
+        databases = [name for name in names if namespace_allowed(http_request, name)]
         return {"databases": databases}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/collections")
-async def get_collections(database: str, role: Role = Depends(verify_token)):
+async def get_collections(http_request: Request, database: str, role: Role = Depends(verify_token)):
     """Obtiene la lista de todas las colecciones en una base de datos."""
+    enforce_namespace(http_request, database)
     try:
-        db = client[database]
-        collections = db.list_collection_names()
+        db = get_client()[database]
+        names = await metadata_cache.get(("collections", database), db.list_collection_names)
+        collections = [name for name in names if namespace_allowed(http_request, database, name)]
         return {"database": database, "collections": collections}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/stats")
-async def get_collection_stats(request: MongoRequest = Depends(), role: Role = Depends(verify_token)):
-    """Obtiene estadísticas de una colección."""
+async def get_collection_stats(
+    http_request: Request,
+    request: MongoRequest = Depends(),
+    collections: Optional[str] = Query(None, description="Colecciones adicionales separadas por comas"),
+    role: Role = Depends(verify_token)
+):
+    """
+    Obtiene estadísticas de una colección. Con 'collections' se obtienen las de
+    varias colecciones de la misma base de datos en una sola llamada.
+    """
+    names = [request.collection]
+    if collections:
+        names += [name.strip() for name in collections.split(",") if name.strip() and name.strip() != request.collection]
+    for name in names:
+        enforce_namespace(http_request, request.database, name)
     try:
-        db = client[request.database]
-        stats = db.command("collstats", request.collection)
-        return parse_json(stats)
+        db = get_client()[request.database]
+        key = ("stats", request.database) + tuple(sorted(names))
+        stats = await metadata_cache.get(key, lambda: parse_json(collection_stats(db, names)))
+        if len(names) == 1:
+            if request.collection not in stats:
+                raise HTTPException(status_code=404, detail="Colección no encontrada")
+            return stats[request.collection]
+        return {"database": request.database, "stats": stats}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Operaciones de modificación (requieren rol de administrador)
 @router.post("/collections", dependencies=[Depends(require_admin)])
-async def create_collection(request: MongoRequest):
-    """Crea una nueva colección en una base de datos. Requiere rol de administrador."""
+async def create_collection(http_request: Request, request: CreateCollectionRequest):
+    """
+    Crea una nueva colección en una base de datos. Requiere rol de administrador.
+    Con 'timeseries' se crea una colección time-series; 'expireAfterSeconds'
+    elimina automáticamente los documentos más antiguos.
+    """
+    enforce_namespace(http_request, request.database, request.collection)
+    options: Dict[str, Any] = {}
+    if request.timeseries is not None:
+        options["timeseries"] = request.timeseries.model_dump(exclude_none=True)
+    if request.expireAfterSeconds is not None:
+        if request.timeseries is None:
+            raise HTTPException(status_code=400, detail="'expireAfterSeconds' solo se admite en colecciones time-series")
+        options["expireAfterSeconds"] = request.expireAfterSeconds
     try:
-        db = client[request.database]
-        db.create_collection(request.collection)
+        db = get_client()[request.database]
+        db.create_collection(request.collection, **options)
+        metadata_cache.invalidate(request.database, request.collection)
         return {"message": f"Colección '{request.collection}' creada con éxito en la base de datos '{request.database}'"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/collections", dependencies=[Depends(require_admin)])
-async def drop_collection(request: MongoRequest):
+async def drop_collection(http_request: Request, request: MongoRequest):
     """Elimina una colección de una base de datos. Requiere rol de administrador."""
+    enforce_namespace(http_request, request.database, request.collection)
     try:
-        db = client[request.database]
+        db = get_client()[request.database]
         db[request.collection].drop()
+        metadata_cache.invalidate(request.database, request.collection)
+        document_cache.invalidate(request.database, request.collection)
         return {"message": f"Colección '{request.collection}' eliminada con éxito de la base de datos '{request.database}'"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/rename", dependencies=[Depends(require_admin)])
 async def rename_collection(
+    http_request: Request,
     request: MongoRequest,
     new_name: str = Body(..., embed=True)
 ):
     """Renombra una colección. Requiere rol de administrador."""
+    enforce_namespace(http_request, request.database, request.collection)
+    enforce_namespace(http_request, request.database, new_name)
     try:
-        db = client[request.database]
+        db = get_client()[request.database]
         db[request.collection].rename(new_name)
+        metadata_cache.invalidate(request.database, request.collection)
+        metadata_cache.invalidate(request.database, new_name)
+        document_cache.invalidate(request.database, request.collection)
+        document_cache.invalidate(request.database, new_name)
         return {"message": f"Colección '{request.collection}' renombrada a '{new_name}' con éxito"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
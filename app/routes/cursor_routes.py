@@ -0,0 +1,147 @@
+from fastapi import APIRouter, HTTPException, Body, Query, Path, Depends, Request
+from typing import List, Dict, Any, Optional
+from pymongo.errors import ExecutionTimeout
+from app.config.database import get_collection
+from app.main import MongoRequest, parse_json
+from app.services.mongo_service import MongoService
+from app.services.query_shape import query_plan_cache, QueryShapeError
+from app.services.metrics import query_metrics
+from app.services.cursor_sessions import cursor_registry, CursorSession, CursorLimitExceeded
+from app.services.pipeline_guard import pipeline_guard, PipelineRejected
+from app.services.profiling import TimedRoute
+from app.auth.auth import verify_permission, enforce_namespace, namespace_allowed, get_client_id, Role
+from app.auth.rate_limiter import retry_after_header
+
+router = APIRouter(route_class=TimedRoute)
+
+
+async def _first_batch(session: CursorSession) -> Dict[str, Any]:
+    documents, has_more = await cursor_registry.fetch(session)
+    return _batch_response(session, documents, has_more)
+
+
+def _batch_response(session: CursorSession, documents: List[Dict[str, Any]], has_more: bool) -> Dict[str, Any]:
+    return {
+        "cursor_id": session.id if has_more else None,
+        "count": len(documents),
+        "returned": session.returned,
+        "has_more": has_more,
+        "documents": parse_json(documents),
+    }
+
+
+def _owned_session(request: Request, cursor_id: str) -> CursorSession:
+    session = cursor_registry.get(cursor_id, get_client_id(request))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Cursor no encontrado o expirado")
+    return session
+
+
+def _register(request: Request, role: Role, mongo_request: MongoRequest, cursor, batch_size: int) -> CursorSession:
+    try:
+        return cursor_registry.register(get_client_id(request), role.value, mongo_request.database,
+                                        mongo_request.collection, cursor, batch_size)
+    except CursorLimitExceeded as e:
+        cursor.close()
+        # Los cursores inactivos se liberan en la siguiente revisión del registro
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": retry_after_header(cursor_registry.reap_interval)})
+
+
+# Apertura de cursores (devuelven el primer lote y el id para pedir los siguientes)
+@router.post("/cursors/find")
+async def open_find_cursor(
+    request: Request,
+    mongo_request: MongoRequest,
+    filter: Dict[str, Any] = Body(default={}),
+    projection: Dict[str, Any] = Body(default=None),
+    sort: List[Dict[str, Any]] = Body(default=None),
+    skip: int = Body(default=0),
+    limit: int = Body(default=0),
+    batch_size: int = Body(default=None),
+    role: Role = Depends(verify_permission)
+):
+    """
+    Abre un cursor de búsqueda. Devuelve el primer lote y un 'cursor_id' con el que
+    obtener los siguientes sin repetir la consulta (null si no hay más documentos).
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        plan = query_plan_cache.plan_find(filter, projection, sort)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    size = cursor_registry.batch_size_for(role.value, batch_size)
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        service = MongoService(collection)
+        cursor = await service.open_find_cursor(filter, projection, plan.sort, skip, limit, size)
+        session = _register(request, role, mongo_request, cursor, size)
+        with query_metrics.track(plan, mongo_request.database, mongo_request.collection):
+            return await _first_batch(session)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/cursors/aggregate")
+async def open_aggregate_cursor(
+    request: Request,
+    mongo_request: MongoRequest,
+    pipeline: List[Dict[str, Any]] = Body(...),
+    batch_size: int = Body(default=None),
+    role: Role = Depends(verify_permission)
+):
+    """Ejecuta una agregación y devuelve su primer lote y el 'cursor_id' para los siguientes."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        plan = query_plan_cache.plan_aggregate(pipeline)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    size = cursor_registry.batch_size_for(role.value, batch_size)
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        service = MongoService(collection)
+        pipeline, options = await pipeline_guard.prepare(
+            plan, pipeline, collection, role.value,
+            allowed=lambda database, name: namespace_allowed(request, database, name)
+        )
+        with query_metrics.track(plan, mongo_request.database, mongo_request.collection):
+            cursor = await service.open_aggregate_cursor(pipeline, size, **options)
+            session = _register(request, role, mongo_request, cursor, size)
+            return await _first_batch(session)
+    except HTTPException:
+        raise
+    except PipelineRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=400, detail="La agregación superó el tiempo máximo permitido para el rol")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Lectura incremental y cierre
+@router.get("/cursors/{cursor_id}")
+async def next_batch(
+    request: Request,
+    cursor_id: str = Path(...),
+    batch_size: Optional[int] = Query(None, description="Documentos del lote (por defecto, el del cursor)"),
+    role: Role = Depends(verify_permission)
+):
+    """Obtiene el siguiente lote de un cursor abierto. El cursor se cierra al agotarse."""
+    session = _owned_session(request, cursor_id)
+    size = cursor_registry.batch_size_for(role.value, batch_size or session.batch_size)
+    try:
+        documents, has_more = await cursor_registry.fetch(session, size)
+        return _batch_response(session, documents, has_more)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/cursors/{cursor_id}")
+async def close_cursor(
+    request: Request,
+    cursor_id: str = Path(...),
+    role: Role = Depends(verify_permission)
+):
+    """Cierra un cursor abierto y libera sus recursos en el servidor."""
+    session = _owned_session(request, cursor_id)
+    await cursor_registry.close(session)
+    return {"message": "Cursor cerrado", "returned": session.returned}
@@ -1,12 +1,22 @@
 from fastapi import APIRouter, HTTPException, Body, Query, Path, Depends, Request
+from fastapi.responses import Response
 from typing import List, Dict, Any, Optional
 from bson import ObjectId
 from app.config.database import get_collection
 from app.main import MongoRequest, parse_json, validate_object_id
 from app.services.mongo_service import MongoService
-from app.auth.auth import verify_permission, Role
+from app.services.query_shape import query_plan_cache, QueryShapeError
+from app.services.metrics import query_metrics
+from app.services.write_batcher import insert_batcher, build_write_concern
+from app.services.document_cache import document_cache, encode_json
+from app.services.request_body import (
+    BodyError, INSERT_MANY_SCHEMA, openapi_body, read_json_object, strict_mode,
+    get_namespace, get_objects, check_documents,
+)
+from app.services.profiling import TimedRoute
+from app.auth.auth import verify_permission, enforce_namespace, Role
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # READ (Operaciones de lectura disponibles según configuración)
 @router.get("/documents/{id}")
@@ -16,14 +26,30 @@ async def get_document_by_id(
     id: str = Depends(validate_object_id),
     role: Role = Depends(verify_permission)
 ):
-    """Obtiene un documento por su ID."""
+    """
+    Obtiene un documento por su ID. En las colecciones configuradas en
+    MONGO_API_DOC_CACHE_COLLECTIONS la respuesta se sirve desde la caché de
+    documentos (cabecera X-Cache: HIT o MISS).
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    cached = document_cache.enabled_for(mongo_request.database, mongo_request.collection)
+    if cached:
+        key = str(ObjectId(id))
+        body = document_cache.get(mongo_request.database, mongo_request.collection, key)
+        if body is not None:
+            return Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+        token = document_cache.read_token(mongo_request.database, mongo_request.collection)
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
         document = await service.find_by_id(id)
         if not document:
             raise HTTPException(status_code=404, detail="Documento no encontrado")
-        return parse_json(document)
+        if not cached:
+            return parse_json(document)
+        body = encode_json(parse_json(document))
+        document_cache.put(mongo_request.database, mongo_request.collection, key, body, token)
+        return Response(body, media_type="application/json", headers={"X-Cache": "MISS"})
     except HTTPException:
         raise
     except Exception as e:
@@ -35,22 +61,23 @@ async def find_documents(
     mongo_request: MongoRequest,
     filter: Dict[str, Any] = Body(default={}),
     projection: Dict[str, Any] = Body(default=None),
-    sort: List[Dict[str, int]] = Body(default=None),
+    sort: List[Dict[str, Any]] = Body(default=None),
     skip: int = Body(default=0),
     limit: int = Body(default=0),
     role: Role = Depends(verify_permission)
 ):
     """Encuentra documentos que coincidan con el filtro."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        # El plan de la forma ya incluye el orden convertido a tuplas
+        plan = query_plan_cache.plan_find(filter, projection, sort)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
-        
-        # Convertir sort a formato de tuplas si existe
-        sort_tuples = None
-        if sort:
-            sort_tuples = [(item["field"], item["order"]) for item in sort]
-            
-        documents = await service.find_many(filter, projection, sort_tuples, skip, limit)
+        with query_metrics.track(plan, mongo_request.database, mongo_request.collection):
+            documents = await service.find_many(filter, projection, plan.sort, skip, limit)
         return {"count": len(documents), "documents": parse_json(documents)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -63,10 +90,16 @@ async def count_documents(
     role: Role = Depends(verify_permission)
 ):
     """Cuenta el número de documentos que coinciden con el filtro."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        plan = query_plan_cache.plan_count(filter)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
-        count = await service.count_documents(filter)
+        with query_metrics.track(plan, mongo_request.database, mongo_request.collection):
+            count = await service.count_documents(filter)
         return {"count": count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -77,25 +110,53 @@ async def insert_document(
     request: Request,
     mongo_request: MongoRequest,
     document: Dict[str, Any] = Body(...),
+    write_concern: Dict[str, Any] = Body(default=None),
     role: Role = Depends(verify_permission)
 ):
-    """Inserta un documento en una colección."""
+    """
+    Inserta un documento en una colección. Admite un write concern propio
+    ({"w": ..., "j": ..., "wtimeout": ...}). En las colecciones configuradas en
+    MONGO_API_INSERT_BATCH_COLLECTIONS la inserción se agrupa con otras concurrentes.
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        concern = build_write_concern(write_concern)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
-        result = await service.insert_one(document)
-        return {"inserted_id": str(result.inserted_id)}
+        if insert_batcher.enabled_for(mongo_request.database, mongo_request.collection):
+            inserted_id = await service.insert_one_batched(document, concern)
+        else:
+            result = await service.insert_one(document, concern)
+            inserted_id = result.inserted_id
+        return {"inserted_id": str(inserted_id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/documents/many")
+@router.post("/documents/many", openapi_extra=openapi_body(INSERT_MANY_SCHEMA))
 async def insert_many_documents(
     request: Request,
-    mongo_request: MongoRequest,
-    documents: List[Dict[str, Any]] = Body(...),
+    strict: Optional[bool] = Query(default=None, description="Valida también el contenido de cada documento"),
     role: Role = Depends(verify_permission)
 ):
-    """Inserta múltiples documentos en una colección."""
+    """
+    Inserta múltiples documentos en una colección. El cuerpo
+    ({"mongo_request": {...}, "documents": [...]}) se lee en crudo y solo se
+    comprueba su estructura; con 'strict' se valida además cada documento
+    (campos con '$', anidamiento, _id).
+    """
+    try:
+        body = await read_json_object(request)
+        mongo_request = get_namespace(body, "mongo_request")
+        documents = get_objects(body, "documents")
+        del body
+        if strict_mode(strict):
+            check_documents(documents, "documents")
+    except BodyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
@@ -114,15 +175,20 @@ async def update_document_by_id(
     role: Role = Depends(verify_permission)
 ):
     """Actualiza un documento por su ID."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        plan = query_plan_cache.plan_update({"_id": id}, update)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
         
         # Asegurarse de que update esté en formato de actualización de MongoDB
-        if not any(key.startswith('$') for key in update.keys()):
-            update = {'$set': update}
+        update = query_plan_cache.prepare_update(plan, update)
             
-        result = await service.update_by_id(id, update, upsert)
+        with query_metrics.track(plan, mongo_request.database, mongo_request.collection):
+            result = await service.update_by_id(id, update, upsert)
         if result.matched_count == 0 and not upsert:
             raise HTTPException(status_code=404, detail="Documento no encontrado")
             
@@ -147,18 +213,23 @@ async def update_documents(
     role: Role = Depends(verify_permission)
 ):
     """Actualiza uno o varios documentos según el filtro."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        plan = query_plan_cache.plan_update(filter, update)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
         
         # Asegurarse de que update esté en formato de actualización de MongoDB
-        if not any(key.startswith('$') for key in update.keys()):
-            update = {'$set': update}
+        update = query_plan_cache.prepare_update(plan, update)
             
-        if many:
-            result = await service.update_many(filter, update, upsert)
-        else:
-            result = await service.update_one(filter, update, upsert)
+        with query_metrics.track(plan, mongo_request.database, mongo_request.collection):
+            if many:
+                result = await service.update_many(filter, update, upsert)
+            else:
+                result = await service.update_one(filter, update, upsert)
             
         return {
             "matched_count": result.matched_count,
@@ -176,6 +247,7 @@ async def delete_document_by_id(
     role: Role = Depends(verify_permission)
 ):
     """Elimina un documento por su ID."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
@@ -197,6 +269,7 @@ async def delete_documents(
     role: Role = Depends(verify_permission)
 ):
     """Elimina uno o varios documentos según el filtro."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
@@ -223,6 +296,7 @@ async def find_and_modify(
     role: Role = Depends(verify_permission)
 ):
     """Encuentra un documento y lo modifica, reemplaza o elimina según los parámetros."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
     try:
         collection = get_collection(mongo_request.database, mongo_request.collection)
         service = MongoService(collection)
@@ -231,8 +305,7 @@ async def find_and_modify(
             result = await service.find_one_and_delete(filter)
         elif update:
             # Asegurarse de que update esté en formato de actualización de MongoDB
-            if not any(key.startswith('$') for key in update.keys()):
-                update = {'$set': update}
+            update = query_plan_cache.prepare_update(query_plan_cache.plan_update(filter, update), update)
                 
             result = await service.find_one_and_update(
                 filter, update, return_document, upsert=upsert
@@ -253,5 +326,7 @@ async def find_and_modify(
         return parse_json(result) if result else None
     except HTTPException:
         raise
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
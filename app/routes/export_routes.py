@@ -0,0 +1,130 @@
+from fastapi import APIRouter, HTTPException, Body, Query, Depends, Request
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, Callable, Optional
+from app.config.database import get_collection
+from app.main import MongoRequest, parse_json
+from app.services.query_shape import query_plan_cache, QueryShapeError
+from app.services.parallel_export import (
+    PARTITION_METHODS, EXPORT_WORKERS, EXPORT_MAX_WORKERS,
+    compute_boundaries, partition_filters, combine_filters,
+    encode_partition, decode_partition, stream_ndjson,
+)
+from app.services.profiling import TimedRoute, phase
+from app.services.overload import overload_guard
+from app.auth.auth import verify_permission, enforce_namespace, hold_reservations, Role
+
+router = APIRouter(route_class=TimedRoute)
+
+# Máximo de particiones por exportación
+MAX_PARTITIONS = 1024
+
+
+class _ExportResponse(StreamingResponse):
+    """
+    Flujo NDJSON que, al terminar de enviarse o si el cliente se desconecta, detiene
+    la exportación y libera las reservas de la petición (límites del cliente y
+    admisión frente a MongoDB), que se mantienen mientras se recorre la colección.
+    """
+
+    def __init__(self, stream, partitions: int, release: Callable[[], None]):
+        super().__init__(stream, media_type="application/x-ndjson",
+                         headers={"X-Export-Partitions": str(partitions)})
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                self._release()
+
+
+def _ndjson_response(request: Request, stream, partitions: int) -> StreamingResponse:
+    return _ExportResponse(stream, partitions, hold_reservations(request))
+
+
+@router.post("/export")
+async def export_collection(
+    request: Request,
+    mongo_request: MongoRequest,
+    filter: Dict[str, Any] = Body(default={}),
+    projection: Dict[str, Any] = Body(default=None),
+    workers: int = Body(default=None),
+    partitions: int = Body(default=None),
+    method: str = Body(default="sample"),
+    mode: str = Body(default="stream"),
+    batch_size: int = Body(default=1000),
+    role: Role = Depends(verify_permission)
+):
+    """
+    Exporta una colección completa (o los documentos del filtro) dividiéndola en
+    rangos de _id que se recorren en paralelo.
+
+    - mode "stream": devuelve un único flujo NDJSON con los documentos de todos los
+      rangos, recorridos por 'workers' hilos (sin orden entre rangos).
+    - mode "partitions": devuelve una URL por rango para descargarlos por separado.
+
+    Los límites de los rangos se calculan con $sample ("sample") o $bucketAuto ("bucketAuto").
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    if method not in PARTITION_METHODS:
+        raise HTTPException(status_code=400, detail=f"Método de partición desconocido: {method}")
+    if mode not in ("stream", "partitions"):
+        raise HTTPException(status_code=400, detail=f"Modo de exportación desconocido: {mode}")
+    try:
+        query_plan_cache.plan_find(filter, projection, None)
+    except QueryShapeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    workers = max(1, min(workers or EXPORT_WORKERS, EXPORT_MAX_WORKERS))
+    partitions = max(1, min(partitions or workers * 4, MAX_PARTITIONS))
+    batch_size = max(1, min(batch_size, 10000))
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        with phase("mongo"):
+            boundaries = await overload_guard.run("export_boundaries", compute_boundaries,
+                                                  collection, partitions, method)
+        filters = [combine_filters(filter, range_filter) for range_filter in partition_filters(boundaries)]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if mode == "partitions":
+        path = request.app.url_path_for("export_partition")
+        return {
+            "count": len(filters),
+            "partitions": [
+                {
+                    "index": index,
+                    "filter": parse_json(partition_filter),
+                    "url": f"{path}?spec=" + encode_partition({
+                        "database": mongo_request.database,
+                        "collection": mongo_request.collection,
+                        "filter": partition_filter,
+                        "projection": projection,
+                        "batch_size": batch_size,
+                    }),
+                }
+                for index, partition_filter in enumerate(filters)
+            ],
+        }
+    return _ndjson_response(request, stream_ndjson(collection, filters, projection, workers, batch_size), len(filters))
+
+@router.get("/export/partition", name="export_partition")
+async def export_partition(
+    request: Request,
+    spec: str = Query(..., description="Partición devuelta por POST /api/export con mode 'partitions'"),
+    role: Role = Depends(verify_permission)
+):
+    """Descarga una partición de una exportación como flujo NDJSON."""
+    try:
+        partition = decode_partition(spec)
+        database, collection_name = partition["database"], partition["collection"]
+        partition_filter, projection = partition.get("filter") or {}, partition.get("projection")
+        batch_size = max(1, min(int(partition.get("batch_size") or 1000), 10000))
+        query_plan_cache.plan_find(partition_filter, projection, None)
+    except (ValueError, KeyError, TypeError, QueryShapeError) as e:
+        raise HTTPException(status_code=400, detail=str(e) or "Partición inválida")
+    enforce_namespace(request, database, collection_name)
+    collection = get_collection(database, collection_name)
+    return _ndjson_response(request, stream_ndjson(collection, [partition_filter], projection, 1, batch_size), 1)
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services.lifecycle import service_state
+
+router = APIRouter()
+
+# Sondas de estado (sin autenticación, para balanceadores y orquestadores)
+@router.get("/healthz")
+async def healthz():
+    """Indica que el proceso está en marcha (liveness)."""
+    return service_state.health()
+
+@router.get("/readyz")
+async def readyz():
+    """
+    Indica si el proceso está listo para atender peticiones (readiness): configuración
+    de roles y claves cargada, MongoDB accesible y precalentamiento terminado.
+    """
+    readiness = await service_state.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["status"] == "ready" else 503)
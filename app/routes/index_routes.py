@@ -1,29 +1,37 @@
-from fastapi import APIRouter, HTTPException, Body, Query, Path, Depends
+from fastapi import APIRouter, HTTPException, Body, Query, Path, Depends, Request
 from typing import List, Dict, Any, Optional, Union
-from app.config.database import get_collection, client
+from app.config.database import get_collection, get_client
 from app.main import MongoRequest, parse_json
 from app.services.mongo_service import MongoService
-from app.auth.auth import verify_token, require_admin, Role
+from app.services.metadata_cache import metadata_cache
+from app.services.profiling import TimedRoute
+from app.auth.auth import verify_token, require_admin, enforce_namespace, Role
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Tipos de clave de índice admitidos
+INDEX_KEY_TYPES = (1, -1, "text", "hashed", "2d", "2dsphere")
 
 # Operaciones de lectura para índices (disponibles para todos)
 @router.get("/indexes")
-async def list_indexes(request: MongoRequest = Depends(), role: Role = Depends(verify_token)):
+async def list_indexes(http_request: Request, request: MongoRequest = Depends(), role: Role = Depends(verify_token)):
     """Lista todos los índices de una colección."""
+    enforce_namespace(http_request, request.database, request.collection)
     try:
         collection = get_collection(request.database, request.collection)
-        service = MongoService(collection)
-        indexes = await service.list_indexes()
-        return parse_json(indexes)
+        return await metadata_cache.get(
+            ("indexes", request.database, request.collection),
+            lambda: parse_json(list(collection.list_indexes()))
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/indexes/analyze")
-async def analyze_index_usage(request: MongoRequest = Depends(), role: Role = Depends(verify_token)):
+async def analyze_index_usage(http_request: Request, request: MongoRequest = Depends(), role: Role = Depends(verify_token)):
     """Analiza el uso de índices en una colección."""
+    enforce_namespace(http_request, request.database, request.collection)
     try:
-        db = client[request.database]
+        db = get_client()[request.database]
         result = db.command("indexStats", request.collection)
         return parse_json(result)
     except Exception as e:
@@ -38,26 +46,44 @@ async def analyze_index_usage(request: MongoRequest = Depends(), role: Role = De
 # Operaciones de modificación para índices (requieren rol de administrador)
 @router.post("/indexes", dependencies=[Depends(require_admin)])
 async def create_index(
+    http_request: Request,
     request: MongoRequest,
-    keys: Union[str, List[Dict[str, int]]] = Body(...),
+    keys: Union[str, List[Dict[str, Any]]] = Body(...),
     unique: bool = Body(False),
     name: str = Body(None),
     background: bool = Body(True),
     sparse: bool = Body(False),
     expireAfterSeconds: int = Body(None),
-    partialFilterExpression: Dict[str, Any] = Body(None)
+    partialFilterExpression: Dict[str, Any] = Body(None),
+    collation: Dict[str, Any] = Body(None),
+    weights: Dict[str, int] = Body(None),
+    default_language: str = Body(None),
+    language_override: str = Body(None)
 ):
-    """Crea un índice en una colección. Requiere rol de administrador."""
+    """
+    Crea un índice en una colección. Requiere rol de administrador.
+
+    'order' admite 1, -1, "text", "hashed", "2d" y "2dsphere". Los índices de texto
+    aceptan 'weights', 'default_language' y 'language_override', y 'collation'
+    permite índices que no distinguen mayúsculas ni acentos (búsqueda por prefijo).
+    """
+    enforce_namespace(http_request, request.database, request.collection)
+    # Convertir keys a formato de tuplas si es una lista de diccionarios
+    if isinstance(keys, list):
+        keys_tuples = []
+        for index, item in enumerate(keys):
+            if "field" not in item or item.get("order") not in INDEX_KEY_TYPES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"'keys[{index}]' debe tener 'field' y un 'order' entre {', '.join(map(str, INDEX_KEY_TYPES))}"
+                )
+            keys_tuples.append((item["field"], item["order"]))
+    else:
+        keys_tuples = keys
     try:
         collection = get_collection(request.database, request.collection)
         service = MongoService(collection)
-        
-        # Convertir keys a formato de tuplas si es una lista de diccionarios
-        if isinstance(keys, list):
-            keys_tuples = [(item["field"], item["order"]) for item in keys]
-        else:
-            keys_tuples = keys
-            
+
         kwargs = {}
         if name:
             kwargs["name"] = name
@@ -69,32 +95,46 @@ async def create_index(
             kwargs["expireAfterSeconds"] = expireAfterSeconds
         if partialFilterExpression:
             kwargs["partialFilterExpression"] = partialFilterExpression
+        if collation:
+            kwargs["collation"] = collation
+        if weights:
+            kwargs["weights"] = weights
+        if default_language:
+            kwargs["default_language"] = default_language
+        if language_override:
+            kwargs["language_override"] = language_override
             
         result = await service.create_index(keys_tuples, unique, **kwargs)
+        metadata_cache.invalidate(request.database, request.collection)
         return {"index_name": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/indexes/{index_name}", dependencies=[Depends(require_admin)])
 async def drop_index(
+    http_request: Request,
     request: MongoRequest = Depends(),
     index_name: str = Path(...)
 ):
     """Elimina un índice de una colección. Requiere rol de administrador."""
+    enforce_namespace(http_request, request.database, request.collection)
     try:
         collection = get_collection(request.database, request.collection)
         service = MongoService(collection)
         result = await service.drop_index(index_name)
+        metadata_cache.invalidate(request.database, request.collection)
         return parse_json(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/indexes", dependencies=[Depends(require_admin)])
-async def drop_all_indexes(request: MongoRequest = Depends()):
+async def drop_all_indexes(http_request: Request, request: MongoRequest = Depends()):
     """Elimina todos los índices de una colección, excepto el índice _id. Requiere rol de administrador."""
+    enforce_namespace(http_request, request.database, request.collection)
     try:
         collection = get_collection(request.database, request.collection)
         collection.drop_indexes()
+        metadata_cache.invalidate(request.database, request.collection)
         return {"message": "Todos los índices han sido eliminados"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
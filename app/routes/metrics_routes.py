@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Optional
+from app.services.query_shape import query_plan_cache
+from app.services.metrics import query_metrics
+from app.services.write_batcher import insert_batcher
+from app.services.cursor_sessions import cursor_registry
+from app.services.document_cache import document_cache
+from app.services.pipeline_guard import pipeline_guard
+from app.services.rollups import rollup_registry
+from app.services.overload import overload_guard
+from app.services.profiling import TimedRoute
+from app.auth.auth import require_admin
+
+router = APIRouter(route_class=TimedRoute)
+
+# Operaciones de monitorización (requieren rol de administrador)
+@router.get("/metrics", dependencies=[Depends(require_admin)])
+async def get_metrics(shape_id: Optional[str] = Query(None)):
+    """Obtiene la latencia por forma de consulta y el estado de la caché de planes. Requiere rol de administrador."""
+    return {
+        "plan_cache": query_plan_cache.stats(),
+        "insert_batching": insert_batcher.stats(),
+        "cursors": cursor_registry.stats(),
+        "document_cache": document_cache.stats(),
+        "pipeline_guard": pipeline_guard.stats(),
+        "rollups": rollup_registry.stats(),
+        "overload": overload_guard.stats(),
+        "slow_query_ms": query_metrics.slow_query_ms,
+        "shapes": query_metrics.snapshot(shape_id),
+    }
@@ -0,0 +1,159 @@
+from fastapi import APIRouter, HTTPException, Body, Query, Depends, Request
+from typing import List, Dict, Any, Optional
+from app.config.database import get_collection
+from app.main import MongoRequest, parse_json
+from app.services.rollups import rollup_registry, RollupDefinition
+from app.services.timeseries import INTERVALS, to_datetime
+from app.services.profiling import TimedRoute, phase
+from app.services.overload import overload_guard
+from app.auth.auth import verify_permission, enforce_namespace, Role
+
+router = APIRouter(route_class=TimedRoute)
+
+
+async def _definition(collection, name: str) -> RollupDefinition:
+    definition = await rollup_registry.get(collection, name)
+    if definition is None:
+        raise HTTPException(status_code=404, detail=f"No existe el rollup '{name}' en la colección '{collection.name}'")
+    return definition
+
+
+async def _rebuild(collection, definition: RollupDefinition) -> Dict[str, int]:
+    with phase("mongo"):
+        return await overload_guard.run("rollup_rebuild", rollup_registry.rebuild, collection, definition)
+
+
+# Definición de rollups
+@router.post("/rollups")
+async def define_rollup(
+    request: Request,
+    mongo_request: MongoRequest,
+    name: str = Body(...),
+    time_field: str = Body(...),
+    intervals: List[str] = Body(default=["minute", "hour"]),
+    group_by: List[str] = Body(default=[]),
+    fields: List[str] = Body(default=[]),
+    rebuild: bool = Body(default=False),
+    role: Role = Depends(verify_permission)
+):
+    """
+    Define (o redefine) un rollup de la colección: pre-agregados por intervalo
+    (count, y sum/min/max de cada campo de 'fields') agrupados por 'group_by', que
+    se actualizan al insertar documentos a través de la API. Con 'rebuild' se
+    calculan además a partir de los documentos existentes.
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    definition = RollupDefinition(name, mongo_request.collection, time_field, intervals, group_by, fields)
+    try:
+        definition.validate()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        rollup_registry.define(collection, definition)
+        response = {"message": f"Rollup '{name}' definido", "target": definition.target}
+        if rebuild:
+            # Recalcular cuando todos los workers ya aplican la definición: así incluye
+            # también lo insertado por los que aún no la conocían
+            await rollup_registry.wait_propagation()
+            response.update(await _rebuild(collection, definition))
+        return response
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/rollups")
+async def list_rollups(
+    request: Request,
+    mongo_request: MongoRequest = Depends(),
+    role: Role = Depends(verify_permission)
+):
+    """Lista los rollups definidos sobre una colección."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        definitions = await rollup_registry.definitions(collection)
+        return [{**definition.to_document(), "target": definition.target} for definition in definitions]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/rollups")
+async def delete_rollup(
+    request: Request,
+    mongo_request: MongoRequest = Depends(),
+    name: str = Query(...),
+    role: Role = Depends(verify_permission)
+):
+    """Elimina un rollup y sus pre-agregados."""
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        definition = await _definition(collection, name)
+        rollup_registry.remove(collection, definition)
+        return {"message": f"Rollup '{name}' eliminado"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/rollups/rebuild")
+async def rebuild_rollup(
+    request: Request,
+    mongo_request: MongoRequest,
+    name: str = Body(..., embed=True),
+    role: Role = Depends(verify_permission)
+):
+    """
+    Recalcula un rollup desde los documentos de la colección. Las inserciones
+    simultáneas al recálculo pueden no quedar reflejadas.
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        definition = await _definition(collection, name)
+        return await _rebuild(collection, definition)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Consulta de rollups
+@router.post("/rollups/query")
+async def query_rollup(
+    request: Request,
+    mongo_request: MongoRequest,
+    name: str = Body(...),
+    interval: str = Body(...),
+    start: Any = Body(default=None),
+    end: Any = Body(default=None),
+    group: Dict[str, Any] = Body(default=None),
+    limit: int = Body(default=0),
+    role: Role = Depends(verify_permission)
+):
+    """
+    Devuelve la serie de pre-agregados de un intervalo entre 'start' (incluido) y
+    'end' (excluido), ordenada por inicio. 'group' filtra por los valores de los
+    campos de agrupación. Cada punto incluye count y, por campo, count, sum, min, max y avg.
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Intervalo no soportado: {interval} (admitidos: {', '.join(INTERVALS)})")
+    bounds = {}
+    for label, value in (("start", start), ("end", end)):
+        if value is not None:
+            bounds[label] = to_datetime(value)
+            if bounds[label] is None:
+                raise HTTPException(status_code=400, detail=f"'{label}' no es una fecha válida")
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        definition = await _definition(collection, name)
+        if interval not in definition.intervals:
+            raise HTTPException(status_code=400, detail=f"El rollup '{name}' no tiene el intervalo '{interval}'")
+        with phase("mongo"):
+            series = await overload_guard.run("rollup_query", lambda: rollup_registry.query(
+                collection, definition, interval, bounds.get("start"), bounds.get("end"), group, max(0, limit)
+            ))
+        return {"count": len(series), "series": parse_json(series)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,110 @@
+from fastapi import APIRouter, HTTPException, Body, Depends, Request
+from typing import List, Dict, Any, Optional
+from pymongo.errors import ExecutionTimeout
+from app.config.database import get_collection
+from app.main import MongoRequest, parse_json
+from app.services.mongo_service import MongoService
+from app.services.metadata_cache import metadata_cache
+from app.services.pipeline_guard import pipeline_guard
+from app.services.query_shape import query_plan_cache, QueryShapeError
+from app.services.metrics import query_metrics
+from app.services.search import (
+    SEARCH_MODES, SORT_KEY, SCORE_FIELD, SearchIndexMissing,
+    select_index, query_collation, text_pipeline, prefix_pipeline, decode_cursor, page,
+)
+from app.services.profiling import TimedRoute
+from app.auth.auth import verify_permission, enforce_namespace, Role
+
+router = APIRouter(route_class=TimedRoute)
+
+# Resultados máximos por página
+MAX_SEARCH_LIMIT = 1000
+
+
+@router.post("/search")
+async def search_documents(
+    request: Request,
+    mongo_request: MongoRequest,
+    query: str = Body(...),
+    mode: str = Body(default="text"),
+    field: str = Body(default=None),
+    filter: Dict[str, Any] = Body(default=None),
+    projection: Dict[str, Any] = Body(default=None),
+    language: str = Body(default=None),
+    limit: int = Body(default=20),
+    after: str = Body(default=None),
+    role: Role = Depends(verify_permission)
+):
+    """
+    Busca documentos usando siempre un índice, con paginación por clave ('after'
+    recibe el 'next' de la página anterior).
+
+    - mode "text": búsqueda con el índice de texto ($text), ordenada por relevancia
+      (campo '_score' de cada documento).
+    - mode "prefix": documentos cuyo 'field' empieza por 'query', ordenados por el
+      campo. Con un índice con collation no distingue mayúsculas (ni acentos con
+      strength 1); sin collation distingue ambos y la respuesta incluye un aviso.
+
+    Si la colección no tiene un índice adecuado la búsqueda se rechaza.
+    """
+    enforce_namespace(request, mongo_request.database, mongo_request.collection)
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo de búsqueda desconocido: {mode}")
+    if not query.strip():
+        raise HTTPException(status_code=400, detail="'query' no puede estar vacío")
+    if mode == "prefix" and not field:
+        raise HTTPException(status_code=400, detail="La búsqueda por prefijo necesita 'field'")
+    if filter and "$text" in filter:
+        raise HTTPException(status_code=400, detail="'filter' no puede incluir $text")
+    try:
+        query_plan_cache.plan_find(filter, projection, None)
+        cursor = decode_cursor(after) if after else None
+    except (QueryShapeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+    try:
+        collection = get_collection(mongo_request.database, mongo_request.collection)
+        indexes = await metadata_cache.get(
+            ("indexes", mongo_request.database, mongo_request.collection),
+            lambda: parse_json(list(collection.list_indexes()))
+        )
+        index = select_index(mode, indexes, field)
+        options: Dict[str, Any] = {}
+        max_time_ms = pipeline_guard.policy_for(role.value).max_time_ms
+        if max_time_ms:
+            options["maxTimeMS"] = max_time_ms
+        warning = None
+        if mode == "text":
+            pipeline = text_pipeline(query, filter, language, projection, cursor, limit)
+            key_field = SCORE_FIELD
+        else:
+            collation = query_collation(index)
+            if collation is not None:
+                options["collation"] = collation
+            else:
+                warning = (f"El índice '{index.get('name')}' no tiene collation: la búsqueda "
+                           f"distingue mayúsculas y acentos")
+            pipeline = prefix_pipeline(field, query, index, filter, projection, cursor, limit)
+            key_field = SORT_KEY
+
+        service = MongoService(collection)
+        plan = query_plan_cache.plan_aggregate(pipeline)
+        with query_metrics.track(plan, mongo_request.database, mongo_request.collection):
+            documents = await service.aggregate(pipeline, **options)
+        documents, next_cursor = page(documents, limit, key_field, remove_key=(mode == "prefix"))
+        response = {
+            "count": len(documents),
+            "documents": parse_json(documents),
+            "next": next_cursor,
+            "index": index.get("name"),
+        }
+        if warning:
+            response["warning"] = warning
+        return response
+    except SearchIndexMissing as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=400, detail="La búsqueda superó el tiempo máximo permitido para el rol")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,306 @@
+import os
+import json
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.exceptions import HTTPException
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Tipos de contenido que merece la pena comprimir
+COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/x-ndjson", b"application/javascript")
+
+
+# Compresores de respuesta
+class _GzipCompressor:
+    def __init__(self, level: int):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, level: int):
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self, level: int):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Codificación -> (fábrica del compresor, nivel por defecto)
+COMPRESSORS: Dict[str, Tuple[Callable, int]] = {"gzip": (_GzipCompressor, 6)}
+if brotli is not None:
+    COMPRESSORS["br"] = (_BrotliCompressor, 4)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = (_ZstdCompressor, 3)
+
+
+# Descompresores de peticiones
+class _ZlibDecompressor:
+    def __init__(self, wbits: int):
+        self._obj = zlib.decompressobj(wbits)
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        # max_length evita expandir de golpe un bloque malicioso más allá del límite
+        output = self._obj.decompress(data, max_length + 1)
+        if self._obj.unconsumed_tail:
+            raise _TooLarge()
+        return output
+
+
+class _BrotliDecompressor:
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        # Con output_buffer_limit la salida deja de crecer al alcanzar el límite
+        output = self._obj.process(data, output_buffer_limit=max_length + 1)
+        if len(output) > max_length or not self._obj.can_accept_more_data():
+            raise _TooLarge()
+        return output
+
+
+class _LimitedSink:
+    """Destino de zstd que acumula la salida y corta en cuanto supera el límite."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.limit = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.limit:
+            raise _TooLarge()
+        self.chunks.append(bytes(data))
+        return len(data)
+
+
+class _ZstdDecompressor:
+    def __init__(self):
+        # El stream_writer entrega la salida en bloques de write_size, así que un
+        # cuerpo malicioso se corta sin expandirlo entero en memoria
+        self._sink = _LimitedSink()
+        self._obj = zstandard.ZstdDecompressor().stream_writer(self._sink, write_size=65536)
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        self._sink.chunks, self._sink.size, self._sink.limit = [], 0, max_length
+        self._obj.write(data)
+        return b"".join(self._sink.chunks)
+
+
+class _TooLarge(Exception):
+    pass
+
+
+def _decompressor(encoding: str):
+    if encoding in ("gzip", "x-gzip"):
+        return _ZlibDecompressor(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _ZlibDecompressor(zlib.MAX_WBITS)
+    if encoding == "br" and brotli is not None:
+        return _BrotliDecompressor()
+    if encoding == "zstd" and zstandard is not None:
+        return _ZstdDecompressor()
+    return None
+
+
+def negotiate_encoding(accept_encoding: str, preferred: List[str]) -> Optional[str]:
+    """
+    Elige la codificación de respuesta según Accept-Encoding (con valores q) y el
+    orden de preferencia del servidor. Devuelve None si no hay ninguna aceptable.
+    """
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in preferred:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI de compresión:
+
+    - Comprime las respuestas con zstd, brotli o gzip según Accept-Encoding, solo
+      si superan 'min_size' bytes. Funciona también con respuestas en streaming:
+      se acumula hasta 'min_size' y, a partir de ahí, se comprime cada fragmento.
+    - Descomprime de forma incremental los cuerpos de petición enviados con
+      Content-Encoding (gzip, deflate, br, zstd), limitando el tamaño descomprimido.
+
+    brotli y zstd solo están disponibles si están instalados los paquetes
+    'brotli' y 'zstandard'.
+    """
+
+    def __init__(self, app, min_size: Optional[int] = None, encodings: Optional[List[str]] = None,
+                 max_request_size: Optional[int] = None):
+        self.app = app
+        self.min_size = min_size if min_size is not None else int(os.getenv("MONGO_API_COMPRESSION_MIN_SIZE", "1024"))
+        configured = encodings or [e.strip() for e in os.getenv("MONGO_API_COMPRESSION", "zstd,br,gzip").split(",")]
+        self.encodings = [e for e in configured if e in COMPRESSORS]
+        self.max_request_size = (max_request_size if max_request_size is not None
+                                 else int(os.getenv("MONGO_API_MAX_DECOMPRESSED_BYTES", str(64 * 1024 * 1024))))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept_encoding = content_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+            elif name == b"content-encoding":
+                content_encoding = value.decode("latin-1").strip().lower()
+
+        if content_encoding and content_encoding != "identity":
+            decompressor = _decompressor(content_encoding)
+            if decompressor is None:
+                return await self._reject(send, 415, f"Content-Encoding no soportado: {content_encoding}")
+            scope = dict(scope, headers=[(n, v) for n, v in scope["headers"]
+                                         if n not in (b"content-encoding", b"content-length")])
+            receive = self._decompressing_receive(receive, decompressor)
+
+        encoding = negotiate_encoding(accept_encoding, self.encodings) if accept_encoding and self.encodings else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        responder = _CompressingResponder(send, encoding, self.min_size)
+        await self.app(scope, receive, responder.send)
+
+    def _decompressing_receive(self, receive, decompressor):
+        total = 0
+        limit = self.max_request_size
+
+        async def wrapped():
+            nonlocal total
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            try:
+                body = decompressor.decompress(message.get("body", b""), limit - total)
+            except _TooLarge:
+                body = None
+            except Exception:
+                raise HTTPException(status_code=400, detail="Cuerpo comprimido inválido")
+            if body is None or total + len(body) > limit:
+                raise HTTPException(status_code=413, detail="El cuerpo descomprimido supera el tamaño máximo")
+            total += len(body)
+            return {"type": "http.request", "body": body, "more_body": message.get("more_body", False)}
+
+        return wrapped
+
+    async def _reject(self, send, status: int, detail: str):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+class _CompressingResponder:
+    """Envoltorio de 'send' que decide y aplica la compresión de una respuesta."""
+
+    def __init__(self, send, encoding: str, min_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.min_size = min_size
+        self.start_message = None
+        self.buffer: List[bytes] = []
+        self.buffered = 0
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message):
+        kind = message["type"]
+        if kind == "http.response.start":
+            headers = message.get("headers", [])
+            content_type = next((v for n, v in headers if n == b"content-type"), b"")
+            already_encoded = any(n == b"content-encoding" for n, _ in headers)
+            if already_encoded or not content_type.startswith(COMPRESSIBLE_TYPES):
+                self.passthrough = True
+                await self._send(message)
+            else:
+                self.start_message = message
+            return
+        if kind != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            self.buffer.append(body)
+            self.buffered += len(body)
+            if self.buffered < self.min_size:
+                if more_body:
+                    return
+                # Respuesta pequeña: se envía sin comprimir
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": b"".join(self.buffer)})
+                return
+            await self._start_compression()
+            body = b"".join(self.buffer)
+            self.buffer = []
+
+        data = self.compressor.compress(body)
+        data += self.compressor.flush() if more_body else self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def _start_compression(self):
+        factory, level = COMPRESSORS[self.encoding]
+        self.compressor = factory(level)
+        headers = [(n, v) for n, v in self.start_message.get("headers", []) if n != b"content-length"]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        vary = [v for n, v in headers if n == b"vary"]
+        if not any(b"accept-encoding" in v.lower() for v in vary):
+            headers.append((b"vary", b"Accept-Encoding"))
+        await self._send(dict(self.start_message, headers=headers))
@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import logging
+import secrets
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.auth.role_manager import role_manager
+from app.services.profiling import phase
+from app.services.overload import overload_guard
+
+logger = logging.getLogger(__name__)
+
+
+class CursorLimitExceeded(Exception):
+    """Se ha alcanzado el máximo de cursores abiertos del rol o del cliente."""
+
+
+class CursorLimits:
+    """Límites de cursores de un rol (sección 'cursor_limits' de roles.yaml)."""
+    __slots__ = ("max_open", "max_per_client", "idle_timeout", "max_batch_size")
+
+    def __init__(self, max_open: Optional[int] = None, max_per_client: Optional[int] = None,
+                 idle_timeout: Optional[float] = None, max_batch_size: Optional[int] = None):
+        self.max_open = max_open
+        self.max_per_client = max_per_client
+        self.idle_timeout = idle_timeout
+        self.max_batch_size = max_batch_size
+
+
+class CursorSession:
+    """Cursor de MongoDB abierto entre peticiones, ligado al cliente que lo creó."""
+    __slots__ = ("id", "owner", "role", "database", "collection", "cursor", "batch_size",
+                 "idle_timeout", "created_at", "last_used", "returned", "lock")
+
+    def __init__(self, owner: str, role: str, database: str, collection: str, cursor: Any,
+                 batch_size: int, idle_timeout: float):
+        # El prefijo identifica el proceso: los cursores solo existen en el worker que los abrió
+        self.id = f"{os.getpid():x}-{secrets.token_urlsafe(16)}"
+        self.owner = owner
+        self.role = role
+        self.database = database
+        self.collection = collection
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.created_at = self.last_used = time.monotonic()
+        self.returned = 0
+        self.lock = asyncio.Lock()
+
+    def expired(self, now: float) -> bool:
+        return now - self.last_used > self.idle_timeout
+
+
+class CursorRegistry:
+    """
+    Registro de cursores abiertos para la paginación incremental (semántica getMore).
+
+    Cada cursor se identifica con un id aleatorio y solo puede usarlo el cliente
+    que lo abrió. El número de cursores abiertos se limita por rol y por cliente, y
+    una tarea en segundo plano cierra los que llevan más de 'idle_timeout' segundos
+    sin usarse, liberando el cursor en el servidor.
+    """
+
+    def __init__(self, idle_timeout: float = 300.0, max_batch_size: int = 1000, reap_interval: float = 10.0):
+        self.idle_timeout = idle_timeout
+        self.max_batch_size = max_batch_size
+        self.reap_interval = reap_interval
+        self._sessions: Dict[str, CursorSession] = {}
+        self._limits: Dict[str, CursorLimits] = {}
+        self._config_ref = None
+        self.opened = 0
+        self.closed = 0
+        self.reaped = 0
+
+    # Configuración
+    def limits_for(self, role: str) -> CursorLimits:
+        """Límites del rol. Se recalculan si cambia la configuración de roles."""
+        if self._config_ref is not role_manager.config:
+            self._limits = {}
+            self._config_ref = role_manager.config
+        limits = self._limits.get(role)
+        if limits is None:
+            limits_config = (role_manager.config.get("cursor_limits") or {}).get(role) or {}
+            limits = CursorLimits(**limits_config)
+            self._limits[role] = limits
+        return limits
+
+    def batch_size_for(self, role: str, requested: Optional[int]) -> int:
+        """Tamaño de lote efectivo: el pedido, acotado por el máximo del rol."""
+        maximum = self.limits_for(role).max_batch_size or self.max_batch_size
+        return max(1, min(requested or 100, maximum))
+
+    # Ciclo de vida de los cursores
+    def register(self, owner: str, role: str, database: str, collection: str, cursor: Any,
+                 batch_size: int) -> CursorSession:
+        """
+        Registra un cursor recién abierto.
+
+        Raises:
+            CursorLimitExceeded: Si el rol o el cliente tienen ya el máximo de cursores abiertos
+        """
+        limits = self.limits_for(role)
+        if limits.max_open is not None or limits.max_per_client is not None:
+            by_role = by_client = 0
+            for session in self._sessions.values():
+                if session.role == role:
+                    by_role += 1
+                    by_client += session.owner == owner
+            if limits.max_open is not None and by_role >= limits.max_open:
+                raise CursorLimitExceeded(f"Se ha alcanzado el máximo de {limits.max_open} cursores abiertos para el rol {role}")
+            if limits.max_per_client is not None and by_client >= limits.max_per_client:
+                raise CursorLimitExceeded(f"Se ha alcanzado el máximo de {limits.max_per_client} cursores abiertos por cliente")
+        session = CursorSession(owner, role, database, collection, cursor, batch_size,
+                                limits.idle_timeout or self.idle_timeout)
+        self._sessions[session.id] = session
+        self.opened += 1
+        return session
+
+    def get(self, cursor_id: str, owner: str) -> Optional[CursorSession]:
+        """Obtiene un cursor abierto por su id, solo si pertenece al cliente indicado."""
+        session = self._sessions.get(cursor_id)
+        if session is None or not secrets.compare_digest(session.owner, owner):
+            return None
+        return session
+
+    async def fetch(self, session: CursorSession, batch_size: Optional[int] = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Obtiene el siguiente lote del cursor. Devuelve los documentos y si puede haber
+        más; un cursor agotado o que falla se cierra y se elimina del registro.
+        """
+        size = batch_size or session.batch_size
+        try:
+            async with session.lock:
+                if session.id not in self._sessions:
+                    return [], False
+                with phase("mongo"):
+                    documents, alive = await overload_guard.run("cursor_fetch", self._next_batch, session.cursor, size)
+                session.last_used = time.monotonic()
+                session.returned += len(documents)
+        except Exception:
+            # Un cursor que ha fallado (CursorNotFound, conexión perdida...) no se puede
+            # reanudar: liberarlo ya en lugar de ocupar el cupo del cliente hasta que caduque
+            await self.close(session)
+            raise
+        if not alive:
+            await self.close(session)
+        return documents, alive
+
+    @staticmethod
+    def _next_batch(cursor: Any, size: int) -> Tuple[List[Dict[str, Any]], bool]:
+        documents = []
+        for document in cursor:
+            documents.append(document)
+            if len(documents) >= size:
+                break
+        return documents, cursor.alive
+
+    async def close(self, session: CursorSession):
+        """Cierra el cursor en el servidor y lo elimina del registro."""
+        if self._sessions.pop(session.id, None) is None:
+            return
+        self.closed += 1
+        # Esperar a que termine un lote en curso: los cursores de pymongo no admiten uso concurrente
+        async with session.lock:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, session.cursor.close)
+            except Exception as e:
+                logger.warning("Error al cerrar el cursor %s: %s", session.id, e)
+
+    async def reap(self) -> int:
+        """Cierra los cursores inactivos durante más de su tiempo de expiración."""
+        now = time.monotonic()
+        expired = [s for s in self._sessions.values() if s.expired(now) and not s.lock.locked()]
+        for session in expired:
+            await self.close(session)
+        self.reaped += len(expired)
+        return len(expired)
+
+    async def run_reaper(self):
+        """Tarea en segundo plano que cierra periódicamente los cursores inactivos."""
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                reaped = await self.reap()
+                if reaped:
+                    logger.info("Cerrados %d cursores inactivos", reaped)
+            except Exception as e:
+                logger.error("Error al cerrar cursores inactivos: %s", e)
+
+    async def close_all(self):
+        """Cierra todos los cursores abiertos (al detener la API)."""
+        for session in list(self._sessions.values()):
+            await self.close(session)
+
+    def stats(self) -> Dict[str, Any]:
+        by_role: Dict[str, int] = {}
+        for session in self._sessions.values():
+            by_role[session.role] = by_role.get(session.role, 0) + 1
+        return {
+            "open": len(self._sessions),
+            "open_by_role": by_role,
+            "opened": self.opened,
+            "closed": self.closed,
+            "reaped": self.reaped,
+            "idle_timeout": self.idle_timeout,
+        }
+
+
+# Instancia global del registro de cursores
+cursor_registry = CursorRegistry(
+    idle_timeout=float(os.getenv("MONGO_API_CURSOR_IDLE_TIMEOUT", "300")),
+    max_batch_size=int(os.getenv("MONGO_API_CURSOR_MAX_BATCH_SIZE", "1000")),
+    reap_interval=float(os.getenv("MONGO_API_CURSOR_REAP_INTERVAL", "10")),
+)
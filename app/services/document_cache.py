@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from app.auth.namespaces import PatternSet
+
+logger = logging.getLogger(__name__)
+
+# Coste fijo aproximado de una entrada (clave, tupla y nodo del diccionario)
+ENTRY_OVERHEAD = 200
+
+# Operaciones del change stream que invalidan documentos concretos o colecciones
+DOCUMENT_EVENTS = ("update", "replace", "delete")
+COLLECTION_EVENTS = ("drop", "rename")
+
+
+def encode_json(data: Any) -> bytes:
+    """Codifica como lo hace la respuesta JSON de FastAPI, para servir los bytes tal cual."""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class DocumentCache:
+    """
+    Caché LRU en memoria de las respuestas de GET /api/documents/{id}, indexada por
+    (base de datos, colección, _id) y guardada ya codificada en JSON.
+
+    Coherencia:
+    - Las escrituras hechas a través de la API invalidan el documento afectado (o
+      la colección completa si la escritura es por filtro).
+    - En un replica set o un clúster fragmentado, un change stream invalida también
+      los cambios hechos directamente en MongoDB o desde otros workers.
+    - Sin change stream (servidor independiente o stream caído), las entradas
+      caducan a los 'ttl' segundos, que acotan el tiempo máximo de desfase.
+    """
+
+    def __init__(self, max_bytes: int = 0, ttl: float = 5.0, max_age: float = 600.0,
+                 collections: Optional[List[str]] = None, change_stream: str = "auto"):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_age = max_age
+        self.collections = PatternSet(collections or ["*"])
+        self.change_stream_setting = change_stream
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[bytes, float, int]]" = OrderedDict()
+        self._bytes = 0
+        # Por colección: generación (invalidación completa) y número de invalidaciones
+        self._generations: Dict[Tuple[str, str], int] = {}
+        self._writes: Dict[Tuple[str, str], int] = {}
+        # Vaciados completos y por base de datos: invalidan también las lecturas en
+        # curso de colecciones que aún no tienen contador en _writes
+        self._clears = 0
+        self._database_clears: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.change_stream_active = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def enabled_for(self, database: str, collection: str) -> bool:
+        return self.enabled and self.collections.matches(f"{database}.{collection}")
+
+    # Lectura y escritura de entradas
+    def get(self, database: str, collection: str, id: str) -> Optional[bytes]:
+        """Devuelve la respuesta cacheada o None si no está o ha caducado."""
+        key = (database, collection, id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                body, stored_at, generation = entry
+                age_limit = self.max_age if self.change_stream_active else self.ttl
+                if (generation == self._generations.get((database, collection), 0)
+                        and time.monotonic() - stored_at <= age_limit):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return body
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def read_token(self, database: str, collection: str) -> Tuple[int, int, int]:
+        """Marca el inicio de una lectura: put() la descarta si hubo invalidaciones entretanto."""
+        return self._clears, self._database_clears.get(database, 0), self._writes.get((database, collection), 0)
+
+    def put(self, database: str, collection: str, id: str, body: bytes, token: Tuple[int, int, int]):
+        """Guarda la respuesta de un documento leído desde que se obtuvo 'token'."""
+        namespace = (database, collection)
+        size = len(body) + ENTRY_OVERHEAD
+        if size > self.max_bytes // 10:
+            # Un documento no debe desplazar a buena parte de la caché
+            return
+        with self._lock:
+            if self.read_token(database, collection) != token:
+                return
+            key = (database, collection, id)
+            self._remove(key)
+            self._entries[key] = (body, time.monotonic(), self._generations.get(namespace, 0))
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0]) + ENTRY_OVERHEAD
+
+    # Invalidación
+    def invalidate(self, database: str, collection: str, id: Any = None):
+        """Invalida un documento o, sin id, todos los de la colección."""
+        if not self.enabled:
+            return
+        namespace = (database, collection)
+        with self._lock:
+            self._writes[namespace] = self._writes.get(namespace, 0) + 1
+            self.invalidations += 1
+            if id is None:
+                # Las entradas de generaciones anteriores se descartan al leerlas o desplazarlas
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            else:
+                self._remove((database, collection, str(id)))
+
+    def invalidate_filter(self, database: str, collection: str, filter: Optional[Dict[str, Any]]):
+        """Invalida según el filtro de una escritura: el documento si es por _id, si no la colección."""
+        if not self.enabled:
+            return
+        if filter and len(filter) == 1 and isinstance(filter.get("_id"), (ObjectId, str)):
+            self.invalidate(database, collection, filter["_id"])
+        else:
+            self.invalidate(database, collection)
+
+    def invalidate_output(self, database: str, pipeline: List[Dict[str, Any]]):
+        """Invalida la colección de destino de una agregación con $out o $merge."""
+        if not self.enabled or not pipeline:
+            return
+        stage = pipeline[-1] if isinstance(pipeline[-1], dict) else {}
+        target = stage.get("$out", (stage.get("$merge") or {}))
+        if isinstance(target, dict) and "$merge" in stage:
+            target = target.get("into")
+        if isinstance(target, str):
+            self.invalidate(database, target)
+        elif isinstance(target, dict) and target.get("coll"):
+            self.invalidate(target.get("db", database), target["coll"])
+
+    def invalidate_database(self, database: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._database_clears[database] = self._database_clears.get(database, 0) + 1
+            namespaces = {key[:2] for key in self._entries if key[0] == database}
+        for namespace in namespaces:
+            self.invalidate(*namespace)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._clears += 1
+
+    # Change stream
+    def start(self, client: MongoClient):
+        """
+        Inicia la invalidación por change stream si el despliegue lo admite (replica set
+        o mongos) y MONGO_API_DOC_CACHE_CHANGE_STREAM no lo desactiva. Lanza PyMongoError
+        si no se puede comprobar el tipo de despliegue, para que se reintente.
+        """
+        if not self.enabled or self.change_stream_setting == "off" or self._watcher is not None:
+            return
+        hello = client.admin.command("hello")
+        if "setName" not in hello and hello.get("msg") != "isdbgrid":
+            logger.info("Caché de documentos sin change stream (servidor independiente): caducidad de %ss", self.ttl)
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(client,), name="document-cache-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+        self.change_stream_active = False
+
+    def _watch(self, client: MongoClient):
+        pipeline = [
+            {"$match": {"operationType": {"$in": list(DOCUMENT_EVENTS + COLLECTION_EVENTS) + ["dropDatabase", "invalidate"]}}},
+            {"$project": {"operationType": 1, "ns": 1, "documentKey": 1}},
+        ]
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                # pymongo reanuda por sí mismo el stream tras errores transitorios
+                with client.watch(pipeline, max_await_time_ms=1000) as stream:
+                    # Lo cacheado antes de abrir el stream pudo cambiar sin que se viera
+                    self.clear()
+                    self.change_stream_active = True
+                    backoff = 1.0
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self._apply_change(change)
+            except PyMongoError as e:
+                logger.warning("Change stream de la caché de documentos interrumpido: %s", e)
+            # Sin garantía de haber visto todos los cambios: vaciar y caducar por TTL hasta reabrirlo
+            self.change_stream_active = False
+            self.clear()
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _apply_change(self, change: Dict[str, Any]):
+        operation = change.get("operationType")
+        ns = change.get("ns") or {}
+        database, collection = ns.get("db"), ns.get("coll")
+        if operation in DOCUMENT_EVENTS:
+            self.invalidate(database, collection, (change.get("documentKey") or {}).get("_id"))
+        elif operation in COLLECTION_EVENTS:
+            self.invalidate(database, collection)
+        elif operation == "dropDatabase":
+            self.invalidate_database(database)
+        elif operation == "invalidate":
+            self.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "mode": "change_stream" if self.change_stream_active else "ttl",
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+# Instancia global de la caché de documentos (desactivada si MONGO_API_DOC_CACHE_MB es 0)
+document_cache = DocumentCache(
+    max_bytes=int(float(os.getenv("MONGO_API_DOC_CACHE_MB", "0")) * 1024 * 1024),
+    ttl=float(os.getenv("MONGO_API_DOC_CACHE_TTL", "5")),
+    max_age=float(os.getenv("MONGO_API_DOC_CACHE_MAX_AGE", "600")),
+    collections=[name.strip() for name in os.getenv("MONGO_API_DOC_CACHE_COLLECTIONS", "*").split(",") if name.strip()],
+    change_stream=os.getenv("MONGO_API_DOC_CACHE_CHANGE_STREAM", "auto").lower(),
+)
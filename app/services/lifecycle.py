@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from app.config.database import get_client, close_client
+from app.config.settings import env_list
+from app.auth.auth import api_key_store
+from app.auth.role_manager import role_manager
+from app.services.metadata_cache import metadata_cache
+from app.services.write_batcher import insert_batcher
+from app.services.cursor_sessions import cursor_registry
+from app.services.document_cache import document_cache
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+OK = "ok"
+
+
+class ServiceState:
+    """
+    Estado de arranque del proceso, consultado por /healthz y /readyz.
+
+    El arranque solo carga la configuración y crea el cliente (sin esperar a
+    MongoDB), de modo que la API empieza a aceptar conexiones enseguida. La
+    comprobación de MongoDB y el precalentamiento se hacen en segundo plano, y
+    el proceso no se declara listo hasta que terminan.
+    """
+
+    def __init__(self, prefetch: List[str], check_interval: float = 2.0, check_timeout: float = 2.0):
+        self.prefetch = prefetch
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.started_at: Optional[float] = None
+        self.checks: Dict[str, str] = {"roles": PENDING, "api_keys": PENDING, "mongodb": PENDING, "warmup": PENDING}
+        self.background: List[asyncio.Task] = []
+        self._last_ping = 0.0
+        self._ping_task: Optional[asyncio.Task] = None
+
+    # Arranque y parada
+    async def startup(self):
+        self.started_at = time.time()
+        loop = asyncio.get_running_loop()
+        self.checks["roles"] = await self._run_check(loop, lambda: role_manager.load(strict=True))
+        get_client()
+        if api_key_store.source.startswith("mongodb:"):
+            # Con MongoDB caído, la carga esperaría a la selección de servidor: no bloquea el arranque
+            self.start_background(self._load_api_keys())
+        else:
+            self.checks["api_keys"] = await self._run_check(loop, self._refresh_api_keys)
+        self.start_background(self._warmup())
+        self.start_background(cursor_registry.run_reaper())
+
+    async def shutdown(self):
+        for task in self.background:
+            task.cancel()
+        await asyncio.gather(*self.background, return_exceptions=True)
+        self.background = []
+        await insert_batcher.flush_all()
+        await cursor_registry.close_all()
+        await asyncio.get_running_loop().run_in_executor(None, document_cache.stop)
+        close_client()
+
+    def start_background(self, coroutine) -> asyncio.Task:
+        """Lanza una tarea que vive mientras la API esté en marcha y se cancela al detenerla."""
+        task = asyncio.ensure_future(coroutine)
+        self.background.append(task)
+        return task
+
+    @staticmethod
+    def _refresh_api_keys():
+        api_key_store.refresh(force=True, strict=True)
+
+    async def _load_api_keys(self):
+        """Carga las claves de API desde MongoDB, reintentándolo hasta que lo consiga."""
+        loop = asyncio.get_running_loop()
+        while True:
+            self.checks["api_keys"] = await self._run_check(loop, self._refresh_api_keys)
+            if self.checks["api_keys"] == OK:
+                return
+            await asyncio.sleep(self.check_interval)
+
+    async def _run_check(self, loop, function) -> str:
+        try:
+            await loop.run_in_executor(None, function)
+            return OK
+        except Exception as e:
+            logger.error("Error en el arranque: %s", e)
+            return f"error: {e}"
+
+    # Precalentamiento
+    async def _warmup(self):
+        """
+        Conecta con MongoDB (llenando el pool hasta MONGO_MIN_POOL_SIZE), inicia la
+        invalidación de la caché de documentos y precarga metadatos. Mientras MongoDB
+        no responda se reintenta cada 'check_interval' segundos y el precalentamiento
+        figura como fallido: sin él, la caché no vería las escrituras de otros procesos.
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.ping(force=True)
+            if self.checks["mongodb"] == OK:
+                try:
+                    await loop.run_in_executor(None, document_cache.start, get_client())
+                    break
+                except Exception as e:
+                    logger.warning("No se pudo iniciar la invalidación de la caché de documentos: %s", e)
+                    self.checks["warmup"] = f"error: {e}"
+            else:
+                self.checks["warmup"] = "error: MongoDB no disponible"
+            await asyncio.sleep(self.check_interval)
+        for target in self.prefetch:
+            try:
+                await self._prefetch(target)
+            except Exception as e:
+                logger.warning("No se pudieron precargar los metadatos de '%s': %s", target, e)
+        self.checks["warmup"] = OK
+        logger.info("Precalentamiento completado en %.1f ms", (time.perf_counter() - started) * 1000.0)
+
+    async def _prefetch(self, target: str):
+        """Precarga en la caché de metadatos las colecciones de 'base' o los índices de 'base.coleccion'."""
+        # Import diferido: app.main importa este módulo
+        from app.main import parse_json
+        client = get_client()
+        database, _, collection = target.partition(".")
+        if collection:
+            coll = client[database][collection]
+            await metadata_cache.get(("indexes", database, collection),
+                                     lambda: parse_json(list(coll.list_indexes())))
+        else:
+            await metadata_cache.get(("collections", database), client[database].list_collection_names)
+
+    # Comprobaciones
+    async def ping(self, force: bool = False):
+        """
+        Comprueba la conexión con MongoDB. El resultado se reutiliza durante
+        'check_interval' segundos y las comprobaciones concurrentes comparten el ping.
+        """
+        if not force and time.monotonic() - self._last_ping < self.check_interval:
+            return
+        if self._ping_task is None:
+            self._ping_task = asyncio.ensure_future(self._ping())
+        task = self._ping_task
+        try:
+            await asyncio.shield(task)
+        finally:
+            if self._ping_task is task and task.done():
+                self._ping_task = None
+
+    async def _ping(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(
+                loop.run_in_executor(None, lambda: get_client().admin.command("ping")),
+                timeout=self.check_timeout,
+            )
+            self.checks["mongodb"] = OK
+        except asyncio.TimeoutError:
+            self.checks["mongodb"] = "error: sin respuesta de MongoDB"
+        except Exception as e:
+            self.checks["mongodb"] = f"error: {e}"
+        self._last_ping = time.monotonic()
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "uptime_seconds": round(time.time() - self.started_at, 1) if self.started_at else 0.0,
+        }
+
+    async def readiness(self) -> Dict[str, Any]:
+        """Estado de preparación: listo cuando todas las comprobaciones están en 'ok'."""
+        if self.checks["warmup"] == OK:
+            await self.ping()
+        ready = all(value == OK for value in self.checks.values())
+        return {"status": "ready" if ready else "not_ready", "checks": dict(self.checks)}
+
+
+# Estado global del proceso
+service_state = ServiceState(
+    prefetch=env_list("MONGO_API_WARMUP_PREFETCH"),
+    check_interval=float(os.getenv("MONGO_API_READY_CHECK_INTERVAL", "2")),
+    check_timeout=float(os.getenv("MONGO_API_READY_CHECK_TIMEOUT", "2")),
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Ciclo de vida de la API: inicializa el proceso al arrancar y lo libera al detenerse."""
+    await service_state.startup()
+    try:
+        yield
+    finally:
+        await service_state.shutdown()
@@ -0,0 +1,160 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+from app.services.overload import overload_guard
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    """Valor cacheado junto con el momento en que se obtuvo."""
+    __slots__ = ("value", "fetched_at", "refreshing")
+
+    def __init__(self, value: Any, fetched_at: float):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.refreshing = False
+
+
+class MetadataCache:
+    """
+    Caché de metadatos (bases de datos, colecciones, estadísticas e índices) con
+    TTL corto y refresco en segundo plano (stale-while-revalidate).
+
+    - Dentro de 'ttl' se devuelve el valor cacheado.
+    - Entre 'ttl' y 'ttl + stale_ttl' se devuelve el valor cacheado y se lanza un
+      refresco en segundo plano.
+    - Pasado ese tiempo, o si no hay valor, se carga y las peticiones concurrentes
+      a la misma clave esperan a una única carga.
+
+    Los loaders son funciones síncronas (pymongo) y se ejecutan en el pool de hilos.
+    Las claves son tuplas cuyo segundo y tercer elemento son la base de datos y la colección.
+    """
+
+    def __init__(self, ttl: float = 5.0, stale_ttl: float = 30.0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: Dict[Tuple, CacheEntry] = {}
+        self._pending: Dict[Tuple, asyncio.Future] = {}
+        self._background: set = set()
+
+    async def get(self, key: Tuple, loader: Callable[[], Any]) -> Any:
+        """Obtiene el valor de la clave, cargándolo con 'loader' si es necesario."""
+        if self.ttl <= 0:
+            return await self._run(loader)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry.fetched_at
+            if age < self.ttl:
+                return entry.value
+            if age < self.ttl + self.stale_ttl:
+                if not entry.refreshing:
+                    entry.refreshing = True
+                    task = asyncio.ensure_future(self._load(key, loader))
+                    self._background.add(task)
+                    task.add_done_callback(self._background_done)
+                return entry.value
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        return await self._load(key, loader)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Error al refrescar metadatos en segundo plano: %s", task.exception())
+
+    async def _run(self, loader: Callable[[], Any]) -> Any:
+        return await overload_guard.run("metadata", loader)
+
+    async def _load(self, key: Tuple, loader: Callable[[], Any]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await self._run(loader)
+        except Exception as e:
+            future.set_exception(e)
+            # Evitar el aviso de excepción no recuperada si nadie más esperaba
+            future.exception()
+            raise
+        else:
+            # Una invalidación de la clave durante la carga la retira de _pending: el
+            # valor puede ser anterior al cambio y no se guarda (sí se devuelve a
+            # quienes ya esperaban)
+            if self._pending.get(key) is future:
+                self._entries[key] = CacheEntry(value, time.monotonic())
+            future.set_result(value)
+            return value
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refreshing = False
+
+    def invalidate(self, database: Optional[str] = None, collection: Optional[str] = None):
+        """
+        Invalida las entradas afectadas por un cambio en la base de datos o colección.
+        Sin argumentos vacía la caché completa. La lista de bases de datos siempre se
+        invalida, ya que crear o eliminar colecciones puede crear o eliminar bases de datos.
+        """
+        if database is None:
+            self._entries.clear()
+            self._pending.clear()
+            return
+        for entries in (self._entries, self._pending):
+            for key in [key for key in entries if self._affected(key, database, collection)]:
+                del entries[key]
+
+    @staticmethod
+    def _affected(key: Tuple, database: str, collection: Optional[str]) -> bool:
+        if key[0] == "databases":
+            return True
+        if len(key) > 1 and key[1] == database:
+            return collection is None or len(key) == 2 or collection in key[2:]
+        return False
+
+
+def collection_stats(db: Database, collections: List[str]) -> Dict[str, Any]:
+    """
+    Obtiene las estadísticas de almacenamiento de varias colecciones con una sola
+    agregación $collStats, encadenando el resto de colecciones con $unionWith
+    (MongoDB 4.4+). En versiones anteriores se hace una agregación por colección.
+    """
+    stage = {"$collStats": {"storageStats": {}}}
+    try:
+        pipeline = [stage] + [
+            {"$unionWith": {"coll": name, "pipeline": [stage]}} for name in collections[1:]
+        ]
+        results = list(db[collections[0]].aggregate(pipeline))
+    except OperationFailure as e:
+        if len(collections) == 1 or "unionWith" not in str(e):
+            raise
+        results = [doc for name in collections for doc in db[name].aggregate([stage])]
+
+    stats = {}
+    for doc in results:
+        name = doc["ns"].split(".", 1)[1]
+        storage = doc.get("storageStats", {})
+        storage["ns"] = doc["ns"]
+        if "shard" in doc:
+            # En clústeres fragmentados hay un documento por shard
+            stats.setdefault(name, {"ns": doc["ns"], "shards": {}})["shards"][doc["shard"]] = storage
+        else:
+            stats[name] = storage
+    return stats
+
+
+# Instancia global de la caché de metadatos
+metadata_cache = MetadataCache(
+    ttl=float(os.getenv("MONGO_API_METADATA_TTL", "5")),
+    stale_ttl=float(os.getenv("MONGO_API_METADATA_STALE_TTL", "30")),
+)
@@ -0,0 +1,106 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from app.services.query_shape import QueryPlan
+
+logger = logging.getLogger("app.slow_queries")
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    """Percentil por el método del rango más cercano sobre una lista ordenada."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ShapeStats:
+    """Estadísticas de latencia acumuladas para una forma de consulta."""
+    __slots__ = ("operation", "shape", "count", "total_ms", "max_ms", "slow_count", "samples")
+
+    def __init__(self, operation: str, shape: Any, sample_size: int):
+        self.operation = operation
+        self.shape = shape
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow_count = 0
+        self.samples = deque(maxlen=sample_size)
+
+    def to_dict(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        return {
+            "operation": self.operation,
+            "shape": self.shape,
+            "count": self.count,
+            "slow_count": self.slow_count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": round(_percentile(ordered, 0.50), 3),
+            "p95_ms": round(_percentile(ordered, 0.95), 3),
+            "p99_ms": round(_percentile(ordered, 0.99), 3),
+        }
+
+
+class QueryMetrics:
+    """
+    Métricas de latencia por forma de consulta y registro de consultas lentas.
+    Las muestras se guardan en una ventana deslizante por forma para calcular percentiles.
+    """
+
+    def __init__(self, slow_query_ms: float = 100.0, max_shapes: int = 1000, sample_size: int = 512):
+        self.slow_query_ms = slow_query_ms
+        self.max_shapes = max_shapes
+        self.sample_size = sample_size
+        self._shapes: "OrderedDict[str, ShapeStats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, plan: QueryPlan, elapsed_ms: float, database: str, collection: str):
+        """Registra la duración de una consulta ejecutada con el plan indicado."""
+        with self._lock:
+            stats = self._shapes.get(plan.shape_id)
+            if stats is None:
+                stats = ShapeStats(plan.operation, plan.shape, self.sample_size)
+                self._shapes[plan.shape_id] = stats
+                if len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.samples.append(elapsed_ms)
+            slow = elapsed_ms >= self.slow_query_ms
+            if slow:
+                stats.slow_count += 1
+
+        if slow:
+            # La forma no contiene valores literales, por lo que es seguro registrarla
+            logger.warning(
+                "Consulta lenta shape=%s op=%s ns=%s.%s duracion=%.1fms forma=%s",
+                plan.shape_id, plan.operation, database, collection, elapsed_ms, plan.shape
+            )
+
+    @contextmanager
+    def track(self, plan: QueryPlan, database: str, collection: str):
+        """Mide el bloque de código como una ejecución de la forma indicada."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(plan, (time.perf_counter() - start) * 1000.0, database, collection)
+
+    def snapshot(self, shape_id: Optional[str] = None) -> Dict[str, Any]:
+        """Devuelve las estadísticas de todas las formas, o de una sola."""
+        with self._lock:
+            if shape_id is not None:
+                stats = self._shapes.get(shape_id)
+                return {shape_id: stats.to_dict()} if stats else {}
+            return {key: stats.to_dict() for key, stats in self._shapes.items()}
+
+
+# Instancia global de métricas de consultas
+query_metrics = QueryMetrics(slow_query_ms=float(os.getenv("MONGO_API_SLOW_QUERY_MS", "100")))
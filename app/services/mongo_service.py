@@ -1,23 +1,62 @@
 from typing import List, Dict, Any, Optional, Union, TypeVar, Generic
 from bson import ObjectId
 from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+from pymongo.command_cursor import CommandCursor
 from pymongo.results import InsertOneResult, UpdateResult, DeleteResult
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, WriteConcern
+from pymongo.errors import BulkWriteError
+
+from app.services.profiling import timed_methods
+from app.services.write_batcher import insert_batcher
+from app.services.document_cache import document_cache
+from app.services.timeseries import prepare_documents
+from app.services.rollups import rollup_registry
+from app.services.overload import overload_guard, guarded_methods
 
 T = TypeVar('T')
 
+@timed_methods("mongo")
+@guarded_methods(overload_guard)
 class MongoService(Generic[T]):
     def __init__(self, collection: Collection):
         self.collection = collection
 
+    def _invalidate(self, id: Any = None, filter: Dict[str, Any] = None):
+        """Invalida en la caché de documentos lo que una escritura haya podido cambiar."""
+        database, name = self.collection.database.name, self.collection.name
+        if filter is not None:
+            document_cache.invalidate_filter(database, name, filter)
+        else:
+            document_cache.invalidate(database, name, id)
+
     # CREATE
-    async def insert_one(self, document: Dict[str, Any]) -> InsertOneResult:
+    async def insert_one(self, document: Dict[str, Any], write_concern: WriteConcern = None) -> InsertOneResult:
         """Inserta un documento en la colección."""
-        return self.collection.insert_one(document)
+        collection = self.collection
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        await prepare_documents(self.collection, [document])
+        result = collection.insert_one(document)
+        await rollup_registry.apply(self.collection, [document])
+        return result
+
+    async def insert_one_batched(self, document: Dict[str, Any], write_concern: WriteConcern = None) -> ObjectId:
+        """Inserta un documento agrupándolo con otras inserciones concurrentes. Devuelve su _id."""
+        await prepare_documents(self.collection, [document])
+        return await insert_batcher.insert(self.collection, document, write_concern)
 
     async def insert_many(self, documents: List[Dict[str, Any]]) -> List[ObjectId]:
         """Inserta múltiples documentos en la colección."""
-        result = self.collection.insert_many(documents)
+        await prepare_documents(self.collection, documents)
+        try:
+            result = self.collection.insert_many(documents)
+        except BulkWriteError as e:
+            # Inserción ordenada: se insertaron los documentos anteriores al primer error
+            errors = e.details.get("writeErrors") or []
+            await rollup_registry.apply(self.collection, documents[:errors[0]["index"]] if errors else [])
+            raise
+        await rollup_registry.apply(self.collection, documents)
         return result.inserted_ids
 
     # READ
@@ -50,6 +89,19 @@ class MongoService(Generic[T]):
             
         return list(cursor)
 
+    async def open_find_cursor(self,
+                               filter: Dict[str, Any] = None,
+                               projection: Dict[str, Any] = None,
+                               sort: List[tuple] = None,
+                               skip: int = 0,
+                               limit: int = 0,
+                               batch_size: int = 100) -> Cursor:
+        """Abre un cursor de búsqueda para leerlo por lotes (sin consumirlo)."""
+        cursor = self.collection.find(filter or {}, projection, skip=skip, limit=limit, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor
+
     async def count_documents(self, filter: Dict[str, Any] = None) -> int:
         """Cuenta el número de documentos que coinciden con el filtro."""
         return self.collection.count_documents(filter or {})
@@ -60,7 +112,10 @@ class MongoService(Generic[T]):
                         update: Dict[str, Any], 
                         upsert: bool = False) -> UpdateResult:
         """Actualiza un documento que coincida con el filtro."""
-        return self.collection.update_one(filter, update, upsert=upsert)
+        try:
+            return self.collection.update_one(filter, update, upsert=upsert)
+        finally:
+            self._invalidate(filter=filter)
 
     async def update_by_id(self, 
                           id: Union[str, ObjectId], 
@@ -69,34 +124,60 @@ class MongoService(Generic[T]):
         """Actualiza un documento por su ID."""
         if isinstance(id, str):
             id = ObjectId(id)
-        return self.collection.update_one({"_id": id}, update, upsert=upsert)
+        try:
+            return self.collection.update_one({"_id": id}, update, upsert=upsert)
+        finally:
+            self._invalidate(id)
 
     async def update_many(self, 
                          filter: Dict[str, Any], 
                          update: Dict[str, Any], 
                          upsert: bool = False) -> UpdateResult:
         """Actualiza múltiples documentos que coincidan con el filtro."""
-        return self.collection.update_many(filter, update, upsert=upsert)
+        try:
+            return self.collection.update_many(filter, update, upsert=upsert)
+        finally:
+            self._invalidate()
 
     # DELETE
     async def delete_one(self, filter: Dict[str, Any]) -> DeleteResult:
         """Elimina un documento que coincida con el filtro."""
-        return self.collection.delete_one(filter)
+        try:
+            return self.collection.delete_one(filter)
+        finally:
+            self._invalidate(filter=filter)
 
     async def delete_by_id(self, id: Union[str, ObjectId]) -> DeleteResult:
         """Elimina un documento por su ID."""
         if isinstance(id, str):
             id = ObjectId(id)
-        return self.collection.delete_one({"_id": id})
+        try:
+            return self.collection.delete_one({"_id": id})
+        finally:
+            self._invalidate(id)
 
     async def delete_many(self, filter: Dict[str, Any]) -> DeleteResult:
         """Elimina múltiples documentos que coincidan con el filtro."""
-        return self.collection.delete_many(filter)
+        try:
+            return self.collection.delete_many(filter)
+        finally:
+            self._invalidate()
 
     # AGGREGATE
-    async def aggregate(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Ejecuta una operación de agregación en la colección."""
-        return list(self.collection.aggregate(pipeline))
+    async def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        """Ejecuta una operación de agregación en la colección (kwargs: maxTimeMS, allowDiskUse...)."""
+        try:
+            return list(self.collection.aggregate(pipeline, **kwargs))
+        finally:
+            document_cache.invalidate_output(self.collection.database.name, pipeline)
+
+    async def open_aggregate_cursor(self, pipeline: List[Dict[str, Any]], batch_size: int = 100, **kwargs) -> CommandCursor:
+        """Ejecuta una agregación y devuelve su cursor para leerlo por lotes."""
+        try:
+            return self.collection.aggregate(pipeline, batchSize=batch_size, **kwargs)
+        finally:
+            # $out y $merge escriben al ejecutar el comando aggregate, antes del primer lote
+            document_cache.invalidate_output(self.collection.database.name, pipeline)
 
     # INDEXES
     async def create_index(self, keys: Union[str, List[tuple]], unique: bool = False, **kwargs) -> str:
@@ -114,7 +195,10 @@ class MongoService(Generic[T]):
     # BULK OPERATIONS
     async def bulk_write(self, operations: List[Any], ordered: bool = True) -> Dict[str, Any]:
         """Ejecuta operaciones de escritura masiva."""
-        return self.collection.bulk_write(operations, ordered=ordered)
+        try:
+            return self.collection.bulk_write(operations, ordered=ordered)
+        finally:
+            self._invalidate()
 
     # DISTINCT
     async def distinct(self, field: str, filter: Dict[str, Any] = None) -> List[Any]:
@@ -130,11 +214,17 @@ class MongoService(Generic[T]):
         """Encuentra un documento y lo actualiza."""
         from pymongo import ReturnDocument
         return_doc = ReturnDocument.AFTER if return_document else ReturnDocument.BEFORE
-        return self.collection.find_one_and_update(filter, update, return_document=return_doc, **kwargs)
+        try:
+            return self.collection.find_one_and_update(filter, update, return_document=return_doc, **kwargs)
+        finally:
+            self._invalidate(filter=filter)
 
     async def find_one_and_delete(self, filter: Dict[str, Any], **kwargs) -> Optional[Dict[str, Any]]:
         """Encuentra un documento y lo elimina."""
-        return self.collection.find_one_and_delete(filter, **kwargs)
+        try:
+            return self.collection.find_one_and_delete(filter, **kwargs)
+        finally:
+            self._invalidate(filter=filter)
 
     async def find_one_and_replace(self, 
                                   filter: Dict[str, Any], 
@@ -144,4 +234,7 @@ class MongoService(Generic[T]):
         """Encuentra un documento y lo reemplaza."""
         from pymongo import ReturnDocument
         return_doc = ReturnDocument.AFTER if return_document else ReturnDocument.BEFORE
-        return self.collection.find_one_and_replace(filter, replacement, return_document=return_doc, **kwargs) 
\ No newline at end of file
+        try:
+            return self.collection.find_one_and_replace(filter, replacement, return_document=return_doc, **kwargs)
+        finally:
+            self._invalidate(filter=filter) 
\ No newline at end of file
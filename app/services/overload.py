@@ -0,0 +1,386 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
+
+from app.config.settings import env_flag
+
+logger = logging.getLogger(__name__)
+
+# Control de carga frente a MongoDB (límite de concurrencia adaptativo y circuit breaker)
+OVERLOAD_PROTECTION = env_flag("MONGO_API_OVERLOAD_PROTECTION", default=True)
+
+# Límite de peticiones simultáneas que trabajan con MongoDB (AIMD)
+CONCURRENCY_INITIAL = int(os.getenv("MONGO_API_CONCURRENCY_INITIAL", "32"))
+CONCURRENCY_MIN = int(os.getenv("MONGO_API_CONCURRENCY_MIN", "4"))
+CONCURRENCY_MAX = int(os.getenv("MONGO_API_CONCURRENCY_MAX", "256"))
+CONCURRENCY_TOLERANCE = float(os.getenv("MONGO_API_CONCURRENCY_TOLERANCE", "2.0"))
+CONCURRENCY_MIN_LATENCY_MS = float(os.getenv("MONGO_API_CONCURRENCY_MIN_LATENCY_MS", "20"))
+CONCURRENCY_BACKOFF = float(os.getenv("MONGO_API_CONCURRENCY_BACKOFF", "0.9"))
+
+# Circuit breaker
+BREAKER_WINDOW = int(os.getenv("MONGO_API_BREAKER_WINDOW", "10"))
+BREAKER_MIN_CALLS = int(os.getenv("MONGO_API_BREAKER_MIN_CALLS", "20"))
+BREAKER_FAILURE_RATIO = float(os.getenv("MONGO_API_BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_SLOW_CALL_MS = float(os.getenv("MONGO_API_BREAKER_SLOW_CALL_MS", "5000"))
+BREAKER_OPEN_SECONDS = float(os.getenv("MONGO_API_BREAKER_OPEN_SECONDS", "5"))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("MONGO_API_BREAKER_MAX_OPEN_SECONDS", "60"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("MONGO_API_BREAKER_HALF_OPEN_PROBES", "3"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class Overloaded(Exception):
+    """La petición se rechaza para no añadir más carga a MongoDB."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """
+    Errores que indican que MongoDB no da abasto o no está disponible: fallos de
+    conexión, selección de servidor (elecciones) y timeouts del cliente o de write
+    concern. Un maxTimeMS superado depende de la consulta y no cuenta.
+    """
+    if isinstance(error, ExecutionTimeout):
+        return False
+    return isinstance(error, ConnectionFailure) or bool(getattr(error, "timeout", False))
+
+
+class _Baseline:
+    """
+    Latencia de referencia de una clase de operación: mínimo móvil que baja al
+    instante y sube despacio, de modo que una degradación sostenida acaba siendo
+    la nueva referencia en lugar de reducir el límite para siempre.
+    """
+    __slots__ = ("value", "samples")
+
+    def __init__(self):
+        self.value = 0.0
+        self.samples = 0
+
+    def update(self, latency_ms: float):
+        self.samples += 1
+        if self.samples == 1 or latency_ms < self.value:
+            self.value = latency_ms
+        else:
+            self.value += (latency_ms - self.value) * 0.01
+
+
+class AdaptiveLimiter:
+    """
+    Límite de concurrencia AIMD guiado por el gradiente de latencia: cada operación
+    se compara con la latencia de referencia de su clase (find_many, aggregate...).
+    El límite crece en 1/límite por operación normal mientras se está usando y se
+    multiplica por 'backoff' cuando una operación tarda más de 'tolerance' veces su
+    referencia (y más de 'min_latency_ms') o falla por sobrecarga. Así una
+    agregación de varios segundos no frena las lecturas rápidas si no ha empeorado.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, tolerance: float,
+                 min_latency_ms: float, backoff: float, warmup_samples: int = 20):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.tolerance = tolerance
+        self.min_latency_ms = min_latency_ms
+        self.backoff = backoff
+        self.warmup_samples = warmup_samples
+        self.in_flight = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._baselines: Dict[str, _Baseline] = {}
+        self._last_decrease = 0.0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def _slow(self, operation: str, latency_ms: float) -> bool:
+        baseline = self._baselines.get(operation)
+        if baseline is None:
+            baseline = self._baselines[operation] = _Baseline()
+        slow = (baseline.samples >= self.warmup_samples and latency_ms > self.min_latency_ms
+                and latency_ms > baseline.value * self.tolerance)
+        baseline.update(latency_ms)
+        return slow
+
+    def on_sample(self, operation: str, latency_ms: Optional[float], overloaded: bool, now: float):
+        """
+        Ajusta el límite con una operación terminada. 'latency_ms' es None para las
+        operaciones cuya duración no indica nada de MongoDB (acotadas por maxTimeMS).
+        """
+        slow = latency_ms is not None and self._slow(operation, latency_ms)
+        if overloaded or slow:
+            # Como mucho una reducción por ventana (lo que tarda la operación lenta):
+            # una ráfaga de respuestas lentas de la misma carga no desploma el límite
+            if now - self._last_decrease >= (latency_ms or 0.0) / 1000.0:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+                self.decreases += 1
+        elif latency_ms is not None and self.in_flight * 2 >= self.limit:
+            # Solo crece si el límite actual se está aprovechando
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "tolerance": self.tolerance,
+            "baseline_ms": {operation: round(baseline.value, 3) for operation, baseline in self._baselines.items()},
+            "rejected": self.rejected,
+            "decreases": self.decreases,
+        }
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker sobre la proporción de fallos de los últimos 'window' segundos.
+    Abierto rechaza todo durante 'open_seconds'; después deja pasar unas pocas
+    peticiones de prueba (semiabierto): si 'half_open_probes' operaciones seguidas
+    funcionan se cierra y, si alguna falla, se vuelve a abrir con el doble de tiempo (hasta 'max_open_seconds').
+    """
+
+    def __init__(self, window: int, min_calls: int, failure_ratio: float, slow_call_ms: float,
+                 open_seconds: float, max_open_seconds: float, half_open_probes: int):
+        self.window = max(1, window)
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_ms = slow_call_ms
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max(open_seconds, max_open_seconds)
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._buckets: deque = deque()  # [segundo, llamadas, fallos]
+        self._open_until = 0.0
+        self._current_open_seconds = open_seconds
+        self._probes = 0
+        self._probe_successes = 0
+        self._half_open_round = 0
+
+    def _window_counts(self, now: float):
+        while self._buckets and self._buckets[0][0] <= int(now) - self.window:
+            self._buckets.popleft()
+        return sum(bucket[1] for bucket in self._buckets), sum(bucket[2] for bucket in self._buckets)
+
+    def allow(self, now: float) -> Optional[int]:
+        """
+        Admite una petición. Si es una petición de prueba del estado semiabierto
+        devuelve la ronda de pruebas con la que liberarla (release_probe); si no, None.
+
+        Raises:
+            Overloaded: Si el circuito está abierto o no quedan pruebas disponibles
+        """
+        if self.state == OPEN:
+            if now < self._open_until:
+                self.rejected += 1
+                raise Overloaded("MongoDB no está disponible (circuito abierto)", self._open_until - now)
+            self.state = HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+            self._half_open_round += 1
+            logger.info("Circuit breaker semiabierto: probando MongoDB")
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                raise Overloaded("MongoDB se está recuperando (circuito semiabierto)", 1)
+            self._probes += 1
+            return self._half_open_round
+        return None
+
+    def release_probe(self, probe_round: int):
+        # Las pruebas de una ronda anterior no liberan plazas de la actual
+        if self.state == HALF_OPEN and probe_round == self._half_open_round and self._probes > 0:
+            self._probes -= 1
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened += 1
+        self._open_until = now + self._current_open_seconds
+        self._buckets.clear()
+        logger.warning("Circuit breaker abierto durante %.1fs: MongoDB falla o responde demasiado lento",
+                       self._current_open_seconds)
+
+    def on_sample(self, latency_ms: Optional[float], failed: bool, now: float):
+        failed = failed or (latency_ms is not None and self.slow_call_ms > 0 and latency_ms > self.slow_call_ms)
+        if self.state == HALF_OPEN:
+            if failed:
+                self._current_open_seconds = min(self.max_open_seconds, self._current_open_seconds * 2)
+                self._open(now)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes < self.half_open_probes:
+                    return
+                self.state = CLOSED
+                self._current_open_seconds = self.open_seconds
+                logger.info("Circuit breaker cerrado: MongoDB responde con normalidad")
+            return
+        if self.state == OPEN:
+            return
+        second = int(now)
+        if self._buckets and self._buckets[-1][0] == second:
+            bucket = self._buckets[-1]
+        else:
+            bucket = [second, 0, 0]
+            self._buckets.append(bucket)
+        bucket[1] += 1
+        bucket[2] += 1 if failed else 0
+        calls, failures = self._window_counts(now)
+        if calls >= self.min_calls and failures >= calls * self.failure_ratio:
+            self._open(now)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        calls, failures = self._window_counts(now)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "window_failures": failures,
+            "open_for_s": round(max(0.0, self._open_until - now), 3) if self.state == OPEN else 0.0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class Admission:
+    """Reserva de una petición admitida; se libera al terminar la petición."""
+    __slots__ = ("guard", "probe", "released")
+
+    def __init__(self, guard: Optional["OverloadGuard"], probe: Optional[int]):
+        self.guard = guard
+        self.probe = probe
+        self.released = False
+
+    def release(self):
+        if self.released or self.guard is None:
+            return
+        self.released = True
+        self.guard.limiter.release()
+        if self.probe is not None:
+            self.guard.breaker.release_probe(self.probe)
+
+
+class OverloadGuard:
+    """
+    Protección de MongoDB ante sobrecarga: la admisión de peticiones la hace una
+    dependencia de los routers y las operaciones de MongoService (y las llamadas
+    a pymongo que se ejecutan con run()) informan de su latencia y de sus errores.
+    Todo ocurre en el bucle de eventos del proceso, por lo que el estado no
+    necesita bloqueos; desde otros hilos se informa con record_threadsafe().
+    """
+
+    def __init__(self, enabled: bool = OVERLOAD_PROTECTION):
+        self.enabled = enabled
+        self.limiter = AdaptiveLimiter(CONCURRENCY_INITIAL, CONCURRENCY_MIN, CONCURRENCY_MAX,
+                                       CONCURRENCY_TOLERANCE, CONCURRENCY_MIN_LATENCY_MS,
+                                       CONCURRENCY_BACKOFF)
+        self.breaker = CircuitBreaker(BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATIO,
+                                      BREAKER_SLOW_CALL_MS, BREAKER_OPEN_SECONDS,
+                                      BREAKER_MAX_OPEN_SECONDS, BREAKER_HALF_OPEN_PROBES)
+        self.samples = 0
+        self.failures = 0
+
+    def admit(self) -> Admission:
+        """
+        Admite una petición o lanza Overloaded con el tiempo tras el que conviene reintentar.
+        """
+        if not self.enabled:
+            return Admission(None, None)
+        probe = self.breaker.allow(time.monotonic())
+        if not self.limiter.try_acquire():
+            if probe is not None:
+                self.breaker.release_probe(probe)
+            raise Overloaded("Demasiadas operaciones simultáneas contra MongoDB", 1)
+        return Admission(self, probe)
+
+    def record(self, operation: str, latency: float, error: Optional[BaseException] = None,
+               bounded: bool = False):
+        """
+        Registra el resultado de una operación contra MongoDB (latencia en segundos).
+        Con 'bounded' (operaciones con maxTimeMS) solo cuentan los errores: su
+        duración depende de la consulta, no del estado de MongoDB.
+        """
+        if not self.enabled:
+            return
+        failed = error is not None and is_overload_error(error)
+        latency_ms = None if bounded else latency * 1000.0
+        now = time.monotonic()
+        self.samples += 1
+        self.failures += 1 if failed else 0
+        self.limiter.on_sample(operation, latency_ms, failed, now)
+        self.breaker.on_sample(latency_ms, failed, now)
+
+    def record_threadsafe(self, loop: asyncio.AbstractEventLoop, operation: str, latency: float,
+                          error: Optional[BaseException] = None):
+        """Registra desde un hilo del pool una operación contra MongoDB."""
+        if self.enabled:
+            loop.call_soon_threadsafe(self.record, operation, latency, error)
+
+    async def run(self, operation: str, function: Callable[..., Any], *args, executor=None) -> Any:
+        """
+        Ejecuta en el pool de hilos una llamada bloqueante a pymongo que no pasa por
+        MongoService e informa de su latencia y de sus errores.
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(executor, function, *args)
+        except Exception as e:
+            self.record(operation, time.perf_counter() - started, e)
+            raise
+        self.record(operation, time.perf_counter() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "samples": self.samples,
+            "failures": self.failures,
+            "concurrency": self.limiter.stats(),
+            "breaker": self.breaker.stats(time.monotonic()),
+        }
+
+
+def guarded_methods(guard: "OverloadGuard"):
+    """Decorador de clase que informa al guard de la latencia y los errores de sus métodos asíncronos públicos."""
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not asyncio.iscoroutinefunction(method):
+                continue
+
+            def make_wrapper(method):
+                @functools.wraps(method)
+                async def wrapper(*args, **kwargs):
+                    bounded = kwargs.get("maxTimeMS") is not None
+                    started = time.perf_counter()
+                    try:
+                        result = await method(*args, **kwargs)
+                    except Exception as e:
+                        guard.record(method.__name__, time.perf_counter() - started, e, bounded)
+                        raise
+                    guard.record(method.__name__, time.perf_counter() - started, None, bounded)
+                    return result
+                return wrapper
+
+            setattr(cls, name, make_wrapper(method))
+        return cls
+    return decorate
+
+
+# Instancia global
+overload_guard = OverloadGuard()
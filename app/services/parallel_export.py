@@ -0,0 +1,213 @@
+import os
+import base64
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from bson import json_util
+from pymongo.collection import Collection
+
+from app.services.overload import overload_guard
+
+logger = logging.getLogger(__name__)
+
+# Métodos de cálculo de los límites de las particiones
+PARTITION_METHODS = ("sample", "bucketAuto")
+
+# Documentos de muestra por partición al estimar los límites con $sample
+SAMPLES_PER_PARTITION = 20
+
+# Configuración de la exportación
+EXPORT_WORKERS = int(os.getenv("MONGO_API_EXPORT_WORKERS", "4"))
+EXPORT_MAX_WORKERS = int(os.getenv("MONGO_API_EXPORT_MAX_WORKERS", "16"))
+# Rangos que se recorren a la vez en todo el proceso, sumando todas las exportaciones
+EXPORT_THREADS = int(os.getenv("MONGO_API_EXPORT_THREADS", "16"))
+
+# Pool de hilos compartido por las exportaciones; el semáforo reparte sus hilos
+# (y, con ellos, los cursores y las conexiones del pool de MongoDB)
+_executor = ThreadPoolExecutor(max_workers=max(1, EXPORT_THREADS), thread_name_prefix="export")
+_export_slots = asyncio.Semaphore(max(1, EXPORT_THREADS))
+
+
+def compute_boundaries(collection: Collection, partitions: int, method: str = "sample") -> List[Any]:
+    """
+    Calcula los valores de _id que dividen la colección en 'partitions' rangos de
+    tamaño similar (partitions - 1 límites, ordenados).
+
+    - sample: toma una muestra aleatoria con $sample y usa sus cuantiles. Es barato
+      (MongoDB usa un cursor aleatorio) y suficientemente equilibrado.
+    - bucketAuto: recorre todos los _id con $bucketAuto. Es exacto pero lee la
+      colección completa, por lo que conviene en colecciones pequeñas o medianas.
+    """
+    if partitions <= 1:
+        return []
+    if method == "bucketAuto":
+        buckets = list(collection.aggregate(
+            [{"$bucketAuto": {"groupBy": "$_id", "buckets": partitions}}], allowDiskUse=True
+        ))
+        boundaries = [bucket["_id"]["min"] for bucket in buckets[1:]]
+    else:
+        size = partitions * SAMPLES_PER_PARTITION
+        samples = [doc["_id"] for doc in collection.aggregate([
+            {"$sample": {"size": size}},
+            {"$project": {"_id": 1}},
+            {"$sort": {"_id": 1}},
+        ], allowDiskUse=True)]
+        if len(samples) < partitions:
+            return []
+        step = len(samples) / partitions
+        boundaries = [samples[int(step * i)] for i in range(1, partitions)]
+
+    # Los operadores de rango solo comparan valores del mismo tipo BSON: con _id de
+    # tipos mezclados no se puede particionar por rangos
+    unique = []
+    for value in boundaries:
+        if type(value) is not type(boundaries[0]):
+            return []
+        if not unique or value != unique[-1]:
+            unique.append(value)
+    return unique
+
+
+def partition_filters(boundaries: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Convierte los límites en filtros de _id disjuntos que cubren toda la colección.
+    El primer rango usa $not para incluir también los _id de otros tipos BSON, que
+    $lt no alcanzaría.
+    """
+    if not boundaries:
+        return [{}]
+    filters = [{"_id": {"$not": {"$gte": boundaries[0]}}}]
+    for low, high in zip(boundaries, boundaries[1:]):
+        filters.append({"_id": {"$gte": low, "$lt": high}})
+    filters.append({"_id": {"$gte": boundaries[-1]}})
+    return filters
+
+
+def combine_filters(filter: Optional[Dict[str, Any]], range_filter: Dict[str, Any]) -> Dict[str, Any]:
+    if not filter:
+        return range_filter
+    if not range_filter:
+        return filter
+    return {"$and": [filter, range_filter]}
+
+
+def encode_partition(spec: Dict[str, Any]) -> str:
+    """Codifica la definición de una partición (en JSON extendido) para usarla en una URL."""
+    raw = json_util.dumps(spec, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_partition(token: str) -> Dict[str, Any]:
+    """Decodifica una partición generada con encode_partition. Lanza ValueError si no es válida."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        spec = json_util.loads(raw.decode("utf-8"))
+    except Exception:
+        raise ValueError("Partición inválida")
+    if not isinstance(spec, dict) or not isinstance(spec.get("filter", {}), dict):
+        raise ValueError("Partición inválida")
+    return spec
+
+
+class _Cancelled(Exception):
+    pass
+
+
+async def stream_ndjson(collection: Collection, filters: List[Dict[str, Any]],
+                        projection: Optional[Dict[str, Any]] = None, workers: int = 4,
+                        batch_size: int = 1000, queue_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    Recorre los filtros (rangos) en paralelo con hasta 'workers' hilos del pool
+    compartido, cada uno con su propio cursor, y mezcla los resultados en un único
+    flujo NDJSON (un documento en JSON extendido por línea, sin orden garantizado
+    entre rangos). Entre todas las exportaciones no se recorren más de
+    EXPORT_THREADS rangos a la vez; el resto espera su turno.
+
+    La cola entre los hilos y el flujo está acotada: si el cliente lee más despacio
+    que MongoDB, los hilos esperan. Si el cliente se desconecta, los hilos se detienen.
+    Un error en un rango termina el flujo con una línea {"$error": "..."}.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or workers * 2)
+    stop = threading.Event()
+    errors: List[Exception] = []
+    done = object()
+
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                if stop.is_set():
+                    future.cancel()
+                    raise _Cancelled()
+
+    def scan(range_filter: Dict[str, Any]):
+        # La latencia de cada lote (sin la espera al cliente) llega al control de sobrecarga
+        started = time.perf_counter()
+        try:
+            cursor = collection.find(range_filter, projection, batch_size=batch_size)
+            try:
+                lines = []
+                for document in cursor:
+                    lines.append(json_util.dumps(document))
+                    if len(lines) >= batch_size:
+                        overload_guard.record_threadsafe(loop, "export_scan", time.perf_counter() - started)
+                        put(("\n".join(lines) + "\n").encode("utf-8"))
+                        lines = []
+                        started = time.perf_counter()
+                    if stop.is_set():
+                        raise _Cancelled()
+                if lines:
+                    overload_guard.record_threadsafe(loop, "export_scan", time.perf_counter() - started)
+                    put(("\n".join(lines) + "\n").encode("utf-8"))
+            finally:
+                cursor.close()
+        except _Cancelled:
+            pass
+        except Exception as e:
+            overload_guard.record_threadsafe(loop, "export_scan", time.perf_counter() - started, e)
+            errors.append(e)
+            stop.set()
+            logger.error("Error en la exportación del rango %s: %s", range_filter, e)
+
+    local_slots = asyncio.Semaphore(max(1, workers))
+    scanning = set()
+
+    async def run_partition(range_filter: Dict[str, Any]):
+        async with local_slots, _export_slots:
+            if stop.is_set():
+                return
+            scanning.add(asyncio.current_task())
+            await loop.run_in_executor(_executor, scan, range_filter)
+
+    tasks = [asyncio.ensure_future(run_partition(range_filter)) for range_filter in filters]
+    finished = asyncio.ensure_future(asyncio.gather(*tasks, return_exceptions=True))
+    finished.add_done_callback(lambda _: queue.put_nowait(done) if not queue.full() else None)
+    try:
+        while True:
+            if finished.done() and queue.empty():
+                break
+            item = await queue.get()
+            if item is done or errors:
+                break
+            yield item
+        if errors:
+            yield (json_util.dumps({"$error": str(errors[0])}) + "\n").encode("utf-8")
+    finally:
+        stop.set()
+        # Los rangos que aún esperan turno no llegan a empezar; los que están en un
+        # hilo terminan por su cuenta (no se puede cancelar un hilo)
+        for task in tasks:
+            if task not in scanning:
+                task.cancel()
+        # Vaciar la cola para desbloquear los hilos que esperan para publicar
+        while not finished.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
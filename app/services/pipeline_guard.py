@@ -0,0 +1,250 @@
+import os
+import time
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pymongo.collection import Collection
+
+from app.auth.role_manager import role_manager
+from app.services.metadata_cache import metadata_cache
+from app.services.profiling import phase
+from app.services.overload import overload_guard
+from app.services.query_shape import QueryPlan
+
+logger = logging.getLogger(__name__)
+
+# Etapas que escriben en otra colección (siempre la última del pipeline)
+WRITE_STAGES = ("$out", "$merge")
+
+# Etapas que leen otra colección: campo de la colección y campo que debe estar indexado
+JOIN_STAGES = {"$lookup": ("from", "foreignField"), "$graphLookup": ("from", "connectToField")}
+
+
+class PipelineRejected(Exception):
+    """El pipeline no cumple la política de agregación del rol."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AggregationPolicy:
+    """Política de agregación de un rol (sección 'aggregation_policy' de roles.yaml)."""
+    __slots__ = ("denied_stages", "max_time_ms", "max_results", "allow_disk_use", "max_scan_docs")
+
+    def __init__(self, denied_stages: Optional[List[str]] = None, max_time_ms: Optional[int] = None,
+                 max_results: Optional[int] = None, allow_disk_use: Optional[bool] = None,
+                 max_scan_docs: Optional[int] = None):
+        self.denied_stages = frozenset(denied_stages or ())
+        self.max_time_ms = max_time_ms
+        self.max_results = max_results
+        self.allow_disk_use = allow_disk_use
+        self.max_scan_docs = max_scan_docs
+
+
+def iter_stages(pipeline: List[Dict[str, Any]]) -> Iterator[Tuple[str, Any]]:
+    """Recorre las etapas del pipeline, incluidas las de los sub-pipelines ($lookup, $unionWith, $facet)."""
+    for stage in pipeline:
+        if not isinstance(stage, dict):
+            continue
+        for operator, body in stage.items():
+            yield operator, body
+            if operator in ("$lookup", "$unionWith") and isinstance(body, dict):
+                yield from iter_stages(body.get("pipeline") or [])
+            elif operator == "$facet" and isinstance(body, dict):
+                for branch in body.values():
+                    if isinstance(branch, list):
+                        yield from iter_stages(branch)
+
+
+def _namespace(target: Any, database: str, collection_key: str = "coll") -> Optional[Tuple[str, str]]:
+    if isinstance(target, str):
+        return database, target
+    if isinstance(target, dict) and isinstance(target.get(collection_key), str):
+        return target.get("db") or database, target[collection_key]
+    return None
+
+
+def stage_namespaces(operator: str, body: Any, database: str) -> List[Tuple[str, str]]:
+    """
+    Colecciones (base de datos, colección) que lee o escribe una etapa: $lookup y
+    $graphLookup ('from'), $unionWith, $out y $merge ('into'), en forma de texto o
+    de {db, coll}.
+    """
+    if operator in JOIN_STAGES and isinstance(body, dict):
+        target = _namespace(body.get("from"), database)
+    elif operator in ("$unionWith", "$out"):
+        target = _namespace(body, database)
+    elif operator == "$merge":
+        target = _namespace(body.get("into") if isinstance(body, dict) else body, database)
+    else:
+        target = None
+    return [target] if target else []
+
+
+def writes_output(pipeline: List[Dict[str, Any]]) -> bool:
+    return bool(pipeline) and isinstance(pipeline[-1], dict) and next(iter(pipeline[-1]), None) in WRITE_STAGES
+
+
+def _has_collscan(plan: Any, inside_winning: bool = False) -> bool:
+    """Busca una etapa COLLSCAN dentro de los planes ganadores de la salida de explain."""
+    if isinstance(plan, dict):
+        if inside_winning and plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(value, inside_winning or key == "winningPlan")
+                   for key, value in plan.items() if key != "rejectedPlans")
+    if isinstance(plan, list):
+        return any(_has_collscan(item, inside_winning) for item in plan)
+    return False
+
+
+class PipelineGuard:
+    """
+    Analiza los pipelines de agregación antes de ejecutarlos según la política del rol:
+
+    - Rechaza las etapas prohibidas para el rol (por ejemplo $out y $merge), también
+      dentro de sub-pipelines.
+    - Si la colección supera 'max_scan_docs' documentos, ejecuta un explain para
+      rechazar los pipelines que la recorrerían completa (COLLSCAN), y rechaza los
+      $lookup y $graphLookup sobre colecciones grandes sin índice en el campo de unión.
+    - Añade maxTimeMS, allowDiskUse y un $limit final según la política.
+
+    El resultado del explain se guarda por colección en el plan de la forma de
+    consulta durante 'explain_ttl' segundos, de modo que solo se repite al cambiar
+    la forma o al caducar.
+    """
+
+    def __init__(self, explain_ttl: float = 60.0):
+        self.explain_ttl = explain_ttl
+        self._policies: Dict[str, AggregationPolicy] = {}
+        self._config_ref = None
+        self.explains = 0
+        self.rejected = 0
+
+    def policy_for(self, role: str) -> AggregationPolicy:
+        """Política del rol. Se recalcula si cambia la configuración de roles."""
+        if self._config_ref is not role_manager.config:
+            self._policies = {}
+            self._config_ref = role_manager.config
+        policy = self._policies.get(role)
+        if policy is None:
+            policy_config = (role_manager.config.get("aggregation_policy") or {}).get(role) or {}
+            policy = AggregationPolicy(**policy_config)
+            self._policies[role] = policy
+        return policy
+
+    async def prepare(self, plan: QueryPlan, pipeline: List[Dict[str, Any]], collection: Collection,
+                      role: str, allowed: Optional[Callable[[str, str], bool]] = None
+                      ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Valida el pipeline y devuelve el pipeline a ejecutar y las opciones de aggregate.
+        'allowed(base, colección)' indica si la petición puede usar cada colección que
+        leen o escriben las etapas ($lookup, $unionWith, $out, $merge...).
+
+        Raises:
+            PipelineRejected: Si el pipeline no cumple la política del rol
+        """
+        policy = self.policy_for(role)
+        try:
+            database = collection.database.name
+            for operator, body in iter_stages(pipeline):
+                if operator in policy.denied_stages:
+                    raise PipelineRejected(f"La etapa {operator} no está permitida para el rol {role}", 403)
+                if allowed is None:
+                    continue
+                for target_database, target_collection in stage_namespaces(operator, body, database):
+                    if not allowed(target_database, target_collection):
+                        raise PipelineRejected(
+                            f"La etapa {operator} usa {target_database}.{target_collection}, "
+                            f"fuera del ámbito permitido", 403
+                        )
+            if policy.max_scan_docs is not None:
+                await self._check_cost(plan, pipeline, collection, policy.max_scan_docs)
+        except PipelineRejected:
+            self.rejected += 1
+            raise
+
+        options: Dict[str, Any] = {}
+        if policy.max_time_ms:
+            options["maxTimeMS"] = policy.max_time_ms
+        if policy.allow_disk_use is not None:
+            options["allowDiskUse"] = policy.allow_disk_use
+        if policy.max_results and not writes_output(pipeline):
+            last = pipeline[-1] if pipeline else {}
+            limit = last.get("$limit") if isinstance(last, dict) else None
+            if not isinstance(limit, int) or limit > policy.max_results:
+                pipeline = pipeline + [{"$limit": policy.max_results}]
+        return pipeline, options
+
+    # Coste
+    async def _check_cost(self, plan: QueryPlan, pipeline: List[Dict[str, Any]], collection: Collection,
+                          max_scan_docs: int):
+        documents = await self._document_count(collection)
+        if documents > max_scan_docs and await self._collscan(plan, pipeline, collection):
+            raise PipelineRejected(
+                f"El pipeline recorrería completa la colección '{collection.name}' (~{documents} documentos) "
+                f"sin usar un índice. Empieza el pipeline con un $match sobre campos indexados."
+            )
+        for operator, body in iter_stages(pipeline):
+            if operator not in JOIN_STAGES or not isinstance(body, dict):
+                continue
+            source_field, key_field = JOIN_STAGES[operator]
+            source, field = body.get(source_field), body.get(key_field)
+            if not isinstance(source, str) or not isinstance(field, str):
+                continue
+            foreign = collection.database[source]
+            foreign_documents = await self._document_count(foreign)
+            if foreign_documents > max_scan_docs and not await self._indexed(foreign, field):
+                raise PipelineRejected(
+                    f"{operator} sobre la colección '{source}' (~{foreign_documents} documentos) "
+                    f"necesita un índice en '{field}'"
+                )
+
+    async def _document_count(self, collection: Collection) -> int:
+        database = collection.database.name
+        return await metadata_cache.get(("document_count", database, collection.name),
+                                        collection.estimated_document_count)
+
+    async def _indexed(self, collection: Collection, field: str) -> bool:
+        """Comprueba si algún índice de la colección empieza por el campo (válido para igualdad)."""
+        if field == "_id":
+            return True
+        # Import diferido: app.main importa los routers que usan este módulo
+        from app.main import parse_json
+        indexes = await metadata_cache.get(("indexes", collection.database.name, collection.name),
+                                           lambda: parse_json(list(collection.list_indexes())))
+        for index in indexes:
+            keys = list((index.get("key") or {}).items())
+            if keys and keys[0][0] == field and keys[0][1] != "text":
+                return True
+        return False
+
+    async def _collscan(self, plan: QueryPlan, pipeline: List[Dict[str, Any]], collection: Collection) -> bool:
+        """Indica si el plan ganador del pipeline recorre la colección completa."""
+        verdicts = plan.extras.setdefault("collscan", {})
+        namespace = (collection.database.name, collection.name)
+        cached = verdicts.get(namespace)
+        now = time.monotonic()
+        if cached is not None and now - cached[1] < self.explain_ttl:
+            return cached[0]
+        try:
+            with phase("mongo"):
+                explain = await overload_guard.run("explain", lambda: collection.database.command(
+                    "explain", {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}},
+                    verbosity="queryPlanner",
+                ))
+            collscan = _has_collscan(explain)
+        except Exception as e:
+            # Sin explain no se bloquea el pipeline: maxTimeMS sigue acotando su coste
+            logger.warning("No se pudo obtener el plan del pipeline %s: %s", plan.shape_id, e)
+            collscan = False
+        self.explains += 1
+        verdicts[namespace] = (collscan, now)
+        return collscan
+
+    def stats(self) -> Dict[str, Any]:
+        return {"explains": self.explains, "rejected": self.rejected}
+
+
+# Instancia global del analizador de pipelines
+pipeline_guard = PipelineGuard(explain_ttl=float(os.getenv("MONGO_API_PIPELINE_EXPLAIN_TTL", "60")))
@@ -0,0 +1,277 @@
+import os
+import time
+import random
+import logging
+import functools
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger("app.timing")
+
+# Cabeceras que activan la instrumentación (solo tienen efecto para administradores)
+TIMING_HEADER = b"x-debug-timing"
+PROFILE_HEADER = b"x-debug-profile"
+
+# Orden en que se informan las fases en Server-Timing
+PHASES = ("auth", "validation", "mongo", "parse", "handler", "serialization", "total")
+
+
+class RequestTimer:
+    """
+    Tiempos por fase de una petición instrumentada.
+
+    Las fases 'auth', 'mongo' y 'parse' se acumulan desde sus puntos de medida;
+    'validation', 'handler' y 'serialization' se derivan de las marcas que deja
+    TimedRoute alrededor del endpoint.
+    """
+    __slots__ = ("start", "phases", "marks", "requested", "sampled", "expose", "profile_requested", "profiler")
+
+    def __init__(self, requested: bool, sampled: bool, profile_requested: bool):
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.marks: Dict[str, float] = {}
+        self.requested = requested
+        self.sampled = sampled
+        self.expose = False
+        self.profile_requested = profile_requested
+        self.profiler = None
+
+    def add(self, phase: str, elapsed: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+
+    def mark(self, name: str):
+        self.marks[name] = time.perf_counter()
+
+    def breakdown(self) -> Dict[str, float]:
+        """Calcula los tiempos de todas las fases en milisegundos."""
+        phases = dict(self.phases)
+        marks = self.marks
+        if "handler_start" in marks and "endpoint_start" in marks:
+            phases["validation"] = marks["endpoint_start"] - marks["handler_start"] - phases.get("auth", 0.0)
+        if "endpoint_start" in marks and "endpoint_end" in marks:
+            phases["handler"] = (marks["endpoint_end"] - marks["endpoint_start"]
+                                 - phases.get("mongo", 0.0) - phases.get("parse", 0.0))
+        if "endpoint_end" in marks and "handler_end" in marks:
+            phases["serialization"] = marks["handler_end"] - marks["endpoint_end"]
+        phases["total"] = time.perf_counter() - self.start
+        return {name: max(0.0, phases[name]) * 1000.0 for name in PHASES if name in phases}
+
+    def header_value(self, breakdown: Dict[str, float]) -> str:
+        return ", ".join(f"{name};dur={value:.3f}" for name, value in breakdown.items())
+
+
+_current_timer: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+
+
+def current_timer() -> Optional[RequestTimer]:
+    """Devuelve el temporizador de la petición en curso, si está instrumentada."""
+    return _current_timer.get()
+
+
+class phase:
+    """
+    Mide un bloque de código como parte de una fase. Sin petición instrumentada
+    solo cuesta una lectura de la variable de contexto.
+    """
+    __slots__ = ("name", "timer", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.timer = _current_timer.get()
+        if self.timer is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timer is not None:
+            self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def timed_methods(phase_name: str):
+    """Decorador de clase que mide todos sus métodos asíncronos públicos como la fase indicada."""
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not asyncio.iscoroutinefunction(method):
+                continue
+
+            def make_wrapper(method):
+                @functools.wraps(method)
+                async def wrapper(*args, **kwargs):
+                    timer = _current_timer.get()
+                    if timer is None:
+                        return await method(*args, **kwargs)
+                    started = time.perf_counter()
+                    try:
+                        return await method(*args, **kwargs)
+                    finally:
+                        timer.add(phase_name, time.perf_counter() - started)
+                return wrapper
+
+            setattr(cls, name, make_wrapper(method))
+        return cls
+    return decorate
+
+
+def authorize_timing(is_admin: bool):
+    """
+    Llamada desde la autenticación: habilita la cabecera Server-Timing y el
+    perfilado solo si quien los pide es administrador.
+    """
+    timer = _current_timer.get()
+    if timer is None or not is_admin:
+        return
+    timer.expose = timer.requested
+    if timer.profile_requested and timer.profiler is None:
+        timer.profiler = RequestProfiler.start()
+
+
+class RequestProfiler:
+    """
+    Perfilador de una petición. Usa pyinstrument (perfilador por muestreo) si está
+    instalado; si no, cProfile. El volcado se guarda en MONGO_API_PROFILE_DIR.
+    """
+
+    def __init__(self, backend: str, profiler: Any):
+        self.backend = backend
+        self.profiler = profiler
+
+    @classmethod
+    def start(cls) -> "RequestProfiler":
+        try:
+            from pyinstrument import Profiler
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+            return cls("pyinstrument", profiler)
+        except ImportError:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return cls("cprofile", profiler)
+
+    def stop_and_dump(self, label: str) -> str:
+        """Detiene el perfilador y guarda el volcado. Devuelve el nombre del archivo."""
+        directory = os.getenv("MONGO_API_PROFILE_DIR", "/tmp/mongo-api-profiles")
+        os.makedirs(directory, exist_ok=True)
+        safe_label = "".join(c if c.isalnum() else "_" for c in label).strip("_")[:80]
+        base = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{random.randrange(1 << 16):04x}-{safe_label}"
+        if self.backend == "pyinstrument":
+            self.profiler.stop()
+            filename = base + ".html"
+            with open(os.path.join(directory, filename), "w") as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.disable()
+            filename = base + ".prof"
+            self.profiler.dump_stats(os.path.join(directory, filename))
+        return filename
+
+
+class TimingMiddleware:
+    """
+    Middleware ASGI que instrumenta las peticiones que llevan la cabecera
+    X-Debug-Timing (o X-Debug-Profile) o que caen en la tasa de muestreo
+    MONGO_API_TIMING_SAMPLE_RATE. El resto de peticiones pasa sin coste adicional.
+
+    - Para administradores, añade la cabecera Server-Timing a la respuesta.
+    - Con X-Debug-Profile, guarda un volcado del perfilador de la petición e
+      indica su nombre en la cabecera X-Profile-Dump.
+    - Las peticiones muestreadas se registran en el logger 'app.timing'.
+    """
+
+    def __init__(self, app, sample_rate: Optional[float] = None):
+        self.app = app
+        self.sample_rate = (sample_rate if sample_rate is not None
+                            else float(os.getenv("MONGO_API_TIMING_SAMPLE_RATE", "0")))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        requested = profile_requested = False
+        for name, _ in scope["headers"]:
+            if name == TIMING_HEADER:
+                requested = True
+            elif name == PROFILE_HEADER:
+                requested = profile_requested = True
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not requested and not sampled:
+            return await self.app(scope, receive, send)
+
+        timer = RequestTimer(requested, sampled, profile_requested)
+        token = _current_timer.set(timer)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                breakdown = timer.breakdown()
+                headers = list(message.get("headers", []))
+                if timer.profiler is not None:
+                    filename = timer.profiler.stop_and_dump(f"{scope['method']}-{scope['path']}")
+                    timer.profiler = None
+                    headers.append((b"x-profile-dump", filename.encode("latin-1")))
+                if timer.expose:
+                    headers.append((b"server-timing", timer.header_value(breakdown).encode("latin-1")))
+                if timer.sampled:
+                    logger.info("Tiempos %s %s %s", scope["method"], scope["path"],
+                                " ".join(f"{name}={value:.2f}ms" for name, value in breakdown.items()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if timer.profiler is not None:
+                # La respuesta no llegó a enviarse: detener el perfilador igualmente
+                timer.profiler.stop_and_dump(f"{scope['method']}-{scope['path']}")
+            _current_timer.reset(token)
+
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    """Envuelve un endpoint asíncrono para marcar su inicio y su fin."""
+    if getattr(endpoint, "_timed", False) or not asyncio.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        timer = _current_timer.get()
+        if timer is None:
+            return await endpoint(*args, **kwargs)
+        timer.mark("endpoint_start")
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timer.mark("endpoint_end")
+
+    wrapper._timed = True
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    Ruta que marca el inicio y el fin del manejador completo (lectura y validación
+    del cuerpo, dependencias, endpoint y serialización) y del endpoint, para poder
+    separar las fases de validación y serialización.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timer = _current_timer.get()
+            if timer is None:
+                return await handler(request)
+            timer.mark("handler_start")
+            try:
+                return await handler(request)
+            finally:
+                timer.mark("handler_end")
+
+        return timed_handler
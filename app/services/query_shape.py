@@ -0,0 +1,213 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Marcador que sustituye a los valores literales dentro de una forma
+PLACEHOLDER = "?"
+
+# Operadores cuyo argumento es una lista de valores literales
+_LITERAL_LIST_OPERATORS = {"$in", "$nin", "$all"}
+
+# Operadores lógicos cuyo argumento es una lista de sub-filtros
+_LOGICAL_OPERATORS = {"$and", "$or", "$nor"}
+
+
+class QueryShapeError(ValueError):
+    """Error de validación de una consulta (filtro, orden o pipeline)."""
+
+
+def normalize_shape(value: Any) -> Any:
+    """
+    Convierte un filtro o pipeline en su forma canónica.
+
+    Los nombres de campo y los operadores se conservan, mientras que los valores
+    literales se sustituyen por PLACEHOLDER. Las cadenas que empiezan por '$' son
+    referencias a campos o variables y también se conservan.
+    """
+    if isinstance(value, dict):
+        shape = {}
+        for key, item in value.items():
+            if key in _LITERAL_LIST_OPERATORS:
+                shape[key] = PLACEHOLDER
+            else:
+                shape[key] = normalize_shape(item)
+        return shape
+    if isinstance(value, list):
+        items = [normalize_shape(item) for item in value]
+        # Una lista solo de literales se parametriza completa
+        if all(item == PLACEHOLDER for item in items):
+            return PLACEHOLDER
+        return items
+    if isinstance(value, str) and value.startswith("$"):
+        return value
+    return PLACEHOLDER
+
+
+def shape_id(operation: str, shape: Any) -> str:
+    """Calcula un identificador corto y estable para una forma de consulta."""
+    canonical = json.dumps([operation, shape], separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class QueryPlan:
+    """
+    Resultado del preprocesamiento de una forma de consulta.
+
+    Se calcula una sola vez por forma y se reutiliza en todas las peticiones
+    con la misma forma.
+    """
+    __slots__ = ("shape_id", "operation", "shape", "sort", "wrap_update", "error", "extras")
+
+    def __init__(self, shape_id: str, operation: str, shape: Any):
+        self.shape_id = shape_id
+        self.operation = operation
+        self.shape = shape
+        self.sort: Optional[List[Tuple[str, int]]] = None
+        self.wrap_update = False
+        self.error: Optional[str] = None
+        # Espacio para que otros componentes guarden resultados por forma
+        self.extras: Dict[str, Any] = {}
+
+    def raise_if_invalid(self):
+        """Lanza QueryShapeError si la forma no superó la validación."""
+        if self.error is not None:
+            raise QueryShapeError(self.error)
+
+
+def _validate_filter(filter: Any, path: str = "filter"):
+    """Validación estructural ligera de un filtro de MongoDB."""
+    if not isinstance(filter, dict):
+        raise QueryShapeError(f"'{path}' debe ser un objeto")
+    for key, value in filter.items():
+        if key in _LOGICAL_OPERATORS:
+            if not isinstance(value, list) or not value:
+                raise QueryShapeError(f"'{path}.{key}' debe ser una lista no vacía de filtros")
+            for index, item in enumerate(value):
+                _validate_filter(item, f"{path}.{key}[{index}]")
+
+
+def _convert_sort(sort: List[Dict[str, Any]]) -> List[Tuple[str, int]]:
+    """Convierte el orden recibido ([{field, order}]) al formato de tuplas de pymongo."""
+    sort_tuples = []
+    for index, item in enumerate(sort):
+        if not isinstance(item, dict) or "field" not in item or "order" not in item:
+            raise QueryShapeError(f"'sort[{index}]' debe tener las claves 'field' y 'order'")
+        if item["order"] not in (1, -1):
+            raise QueryShapeError(f"'sort[{index}].order' debe ser 1 o -1")
+        sort_tuples.append((item["field"], item["order"]))
+    return sort_tuples
+
+
+def _validate_pipeline(pipeline: Any):
+    """Comprueba que el pipeline sea una lista de etapas con un único operador."""
+    if not isinstance(pipeline, list):
+        raise QueryShapeError("'pipeline' debe ser una lista de etapas")
+    for index, stage in enumerate(pipeline):
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise QueryShapeError(f"La etapa {index} del pipeline debe tener exactamente un operador")
+        operator = next(iter(stage))
+        if not operator.startswith("$"):
+            raise QueryShapeError(f"La etapa {index} del pipeline no es un operador válido: '{operator}'")
+
+
+class QueryPlanCache:
+    """
+    Caché LRU de planes indexada por forma de consulta.
+
+    Guarda, para cada forma, la validación y las conversiones ya realizadas
+    (orden a tuplas, envoltura en '$set', etc.) para no repetirlas.
+    """
+
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self._plans: "OrderedDict[str, QueryPlan]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_or_build(self, operation: str, shape: Any, builder) -> QueryPlan:
+        key = shape_id(operation, shape)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = QueryPlan(key, operation, shape)
+        try:
+            builder(plan)
+        except QueryShapeError as e:
+            plan.error = str(e)
+
+        with self._lock:
+            self._plans[key] = plan
+            if len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+        return plan
+
+    def plan_find(self,
+                  filter: Optional[Dict[str, Any]],
+                  projection: Optional[Dict[str, Any]] = None,
+                  sort: Optional[List[Dict[str, Any]]] = None) -> QueryPlan:
+        """Obtiene el plan de una búsqueda. El orden y la proyección forman parte de la forma."""
+        shape = {
+            "filter": normalize_shape(filter or {}),
+            "projection": list(projection.keys()) if isinstance(projection, dict) else None,
+            "sort": sort,
+        }
+
+        def build(plan: QueryPlan):
+            _validate_filter(filter or {})
+            if sort:
+                plan.sort = _convert_sort(sort)
+
+        plan = self._get_or_build("find", shape, build)
+        plan.raise_if_invalid()
+        return plan
+
+    def plan_count(self, filter: Optional[Dict[str, Any]]) -> QueryPlan:
+        """Obtiene el plan de un conteo de documentos."""
+        plan = self._get_or_build("count", normalize_shape(filter or {}),
+                                  lambda plan: _validate_filter(filter or {}))
+        plan.raise_if_invalid()
+        return plan
+
+    def plan_aggregate(self, pipeline: List[Dict[str, Any]]) -> QueryPlan:
+        """Obtiene el plan de un pipeline de agregación."""
+        shape = normalize_shape(pipeline) if isinstance(pipeline, list) else PLACEHOLDER
+        plan = self._get_or_build("aggregate", shape, lambda plan: _validate_pipeline(pipeline))
+        plan.raise_if_invalid()
+        return plan
+
+    def plan_update(self, filter: Optional[Dict[str, Any]], update: Dict[str, Any]) -> QueryPlan:
+        """
+        Obtiene el plan de una actualización. Decide una sola vez por forma si el
+        documento de actualización debe envolverse en '$set'.
+        """
+        shape = {"filter": normalize_shape(filter or {}), "update": normalize_shape(update)}
+
+        def build(plan: QueryPlan):
+            _validate_filter(filter or {})
+            plan.wrap_update = not any(key.startswith('$') for key in update.keys())
+
+        plan = self._get_or_build("update", shape, build)
+        plan.raise_if_invalid()
+        return plan
+
+    def prepare_update(self, plan: QueryPlan, update: Dict[str, Any]) -> Dict[str, Any]:
+        """Aplica al documento de actualización la conversión decidida en el plan."""
+        return {'$set': update} if plan.wrap_update else update
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve estadísticas de uso de la caché."""
+        with self._lock:
+            return {"size": len(self._plans), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses}
+
+
+# Instancia global de la caché de planes
+query_plan_cache = QueryPlanCache()
@@ -0,0 +1,216 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+
+from app.config.settings import env_flag
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Validación estricta por defecto de los cuerpos leídos en crudo (se puede pedir por petición con ?strict=true)
+STRICT_BODY_VALIDATION = env_flag("MONGO_API_STRICT_BODY")
+
+# Profundidad máxima de anidamiento que admite MongoDB en un documento
+MAX_NESTING_DEPTH = 100
+
+# Campos requeridos por cada tipo de operación de /api/bulk
+BULK_OPERATION_FIELDS = {
+    "insert": ("document",),
+    "update_one": ("filter", "update"),
+    "update_many": ("filter", "update"),
+    "replace_one": ("filter", "replacement"),
+    "delete_one": ("filter",),
+    "delete_many": ("filter",),
+}
+
+# Esquemas para documentar en OpenAPI los endpoints que leen el cuerpo en crudo
+NAMESPACE_SCHEMA = {
+    "type": "object",
+    "required": ["database", "collection"],
+    "properties": {"database": {"type": "string"}, "collection": {"type": "string"}},
+}
+
+INSERT_MANY_SCHEMA = {
+    "type": "object",
+    "required": ["mongo_request", "documents"],
+    "properties": {
+        "mongo_request": NAMESPACE_SCHEMA,
+        "documents": {"type": "array", "items": {"type": "object"}},
+    },
+}
+
+BULK_SCHEMA = {
+    "type": "object",
+    "required": ["request", "operations"],
+    "properties": {
+        "request": NAMESPACE_SCHEMA,
+        "operations": {"type": "array", "items": {
+            "type": "object",
+            "required": ["type"],
+            "properties": {
+                "type": {"type": "string", "enum": list(BULK_OPERATION_FIELDS)},
+                "document": {"type": "object"},
+                "filter": {"type": "object"},
+                "update": {"oneOf": [{"type": "object"}, {"type": "array", "items": {"type": "object"}}]},
+                "replacement": {"type": "object"},
+                "upsert": {"type": "boolean"},
+            },
+        }},
+        "ordered": {"type": "boolean", "default": True},
+    },
+}
+
+
+def openapi_body(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Bloque 'openapi_extra' que documenta el cuerpo JSON de un endpoint que lo lee en crudo."""
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+
+class BodyError(ValueError):
+    """El cuerpo de la petición no tiene la estructura esperada."""
+
+
+def loads(raw) -> Any:
+    """Decodifica JSON con orjson si está instalado y con json si no."""
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+    except ValueError as e:
+        raise BodyError(f"JSON inválido: {e}")
+
+
+async def read_json_object(request: Request) -> Dict[str, Any]:
+    """
+    Lee el cuerpo de la petición y lo decodifica directamente en los dict/list que
+    se pasan a pymongo, sin el modelo de Pydantic. Los fragmentos se acumulan en un
+    único buffer que se libera tras decodificar.
+    """
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer += chunk
+    if not buffer:
+        raise BodyError("El cuerpo de la petición está vacío")
+    data = loads(buffer)
+    del buffer
+    if not isinstance(data, dict):
+        raise BodyError("El cuerpo de la petición debe ser un objeto JSON")
+    return data
+
+
+def strict_mode(strict: Optional[bool]) -> bool:
+    """Validación estricta si la petición la pide (?strict=true) o, si no indica nada, según la configuración."""
+    return STRICT_BODY_VALIDATION if strict is None else strict
+
+
+def get_namespace(data: Dict[str, Any], key: str):
+    """Obtiene la base de datos y la colección del cuerpo como MongoRequest."""
+    from app.main import MongoRequest
+
+    value = data.get(key)
+    if not isinstance(value, dict) or not isinstance(value.get("database"), str) \
+            or not isinstance(value.get("collection"), str):
+        raise BodyError(f"'{key}' debe ser un objeto con 'database' y 'collection' de tipo texto")
+    return MongoRequest(database=value["database"], collection=value["collection"])
+
+
+def get_objects(data: Dict[str, Any], key: str) -> List[Dict[str, Any]]:
+    """Obtiene una lista de objetos del cuerpo comprobando solo el primer nivel."""
+    value = data.get(key)
+    if not isinstance(value, list):
+        raise BodyError(f"'{key}' debe ser una lista")
+    for position, item in enumerate(value):
+        if not isinstance(item, dict):
+            raise BodyError(f"'{key}[{position}]' debe ser un objeto")
+    return value
+
+
+def _check_nesting(value: Any, path: str):
+    # Recorrido iterativo para no depender del límite de recursión de Python
+    stack = [(value, 1)]
+    while stack:
+        current, depth = stack.pop()
+        if depth > MAX_NESTING_DEPTH:
+            raise BodyError(f"'{path}' supera {MAX_NESTING_DEPTH} niveles de anidamiento")
+        if isinstance(current, dict):
+            for key, item in current.items():
+                if "\x00" in key:
+                    raise BodyError(f"'{path}' contiene un nombre de campo con el carácter nulo")
+                if isinstance(item, (dict, list)):
+                    stack.append((item, depth + 1))
+        elif isinstance(current, list):
+            stack.extend((item, depth + 1) for item in current if isinstance(item, (dict, list)))
+
+
+def check_document(document: Dict[str, Any], path: str):
+    """Validación estricta de un documento a insertar o reemplazar."""
+    for key in document:
+        if key.startswith("$"):
+            raise BodyError(f"'{path}' no puede tener campos que empiecen por '$' ({key})")
+    if isinstance(document.get("_id"), list):
+        raise BodyError(f"'{path}._id' no puede ser una lista")
+    _check_nesting(document, path)
+
+
+def _check_update(update: Any, path: str):
+    stages = update if isinstance(update, list) else [update]
+    for stage in stages:
+        if not isinstance(stage, dict) or not stage or not all(key.startswith("$") for key in stage):
+            raise BodyError(f"'{path}' debe contener solo operadores de actualización o etapas de pipeline")
+    _check_nesting(update, path)
+
+
+def check_documents(documents: List[Dict[str, Any]], key: str):
+    """Validación estricta de la lista de documentos de una inserción."""
+    for position, document in enumerate(documents):
+        check_document(document, f"{key}[{position}]")
+
+
+def build_bulk_operations(operations: List[Dict[str, Any]], strict: bool) -> list:
+    """
+    Convierte las operaciones JSON de /api/bulk en operaciones de pymongo.
+    Comprueba el tipo y los campos requeridos de cada operación y, en modo
+    estricto, también su contenido.
+    """
+    result = []
+    for position, op in enumerate(operations):
+        path = f"operations[{position}]"
+        op_type = op.get("type")
+        fields = BULK_OPERATION_FIELDS.get(op_type)
+        if fields is None:
+            raise BodyError(f"Tipo de operación desconocido: {op_type}")
+        for field in fields:
+            value = op.get(field)
+            if field == "update" and isinstance(value, list):
+                continue
+            if not isinstance(value, dict):
+                raise BodyError(f"'{path}.{field}' debe ser un objeto")
+        upsert = op.get("upsert", False)
+        if not isinstance(upsert, bool):
+            raise BodyError(f"'{path}.upsert' debe ser booleano")
+        if strict:
+            if "document" in fields:
+                check_document(op["document"], f"{path}.document")
+            if "replacement" in fields:
+                check_document(op["replacement"], f"{path}.replacement")
+            if "update" in fields:
+                _check_update(op["update"], f"{path}.update")
+            _check_nesting(op.get("filter") or {}, f"{path}.filter")
+
+        if op_type == "insert":
+            result.append(InsertOne(op["document"]))
+        elif op_type == "update_one":
+            result.append(UpdateOne(op["filter"], op["update"], upsert=upsert))
+        elif op_type == "update_many":
+            result.append(UpdateMany(op["filter"], op["update"], upsert=upsert))
+        elif op_type == "replace_one":
+            result.append(ReplaceOne(op["filter"], op["replacement"], upsert=upsert))
+        elif op_type == "delete_one":
+            result.append(DeleteOne(op["filter"]))
+        else:
+            result.append(DeleteMany(op["filter"]))
+    return result
@@ -0,0 +1,341 @@
+import os
+import asyncio
+import logging
+from numbers import Number
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
+from pymongo import ASCENDING, UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from app.services.metadata_cache import MetadataCache, metadata_cache
+from app.services.profiling import phase
+from app.services.overload import overload_guard
+from app.services.timeseries import INTERVALS, to_datetime, truncate, get_path
+
+logger = logging.getLogger(__name__)
+
+
+def _key(path: str) -> str:
+    """Nombre de campo en el documento de rollup para una ruta con puntos."""
+    return path.replace(".", "_")
+
+
+def _number(value: Any) -> bool:
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+class RollupDefinition:
+    """
+    Definición de un rollup: pre-agregados por intervalo de tiempo (count, y
+    sum/min/max de cada campo) de una colección, agrupados opcionalmente por campos.
+    """
+    __slots__ = ("name", "collection", "time_field", "intervals", "group_by", "fields")
+
+    def __init__(self, name: str, collection: str, time_field: str, intervals: List[str],
+                 group_by: Optional[List[str]] = None, fields: Optional[List[str]] = None):
+        self.name = name
+        self.collection = collection
+        self.time_field = time_field
+        self.intervals = list(intervals)
+        self.group_by = list(group_by or [])
+        self.fields = list(fields or [])
+
+    @property
+    def target(self) -> str:
+        """Colección donde se guardan los pre-agregados."""
+        return f"{self.collection}.rollup.{self.name}"
+
+    def validate(self):
+        """Lanza ValueError si la definición no es válida."""
+        if not self.name or not self.name.replace("_", "").replace("-", "").isalnum():
+            raise ValueError("El nombre del rollup solo puede contener letras, números, '_' y '-'")
+        if not self.time_field:
+            raise ValueError("Falta 'time_field'")
+        if not self.intervals:
+            raise ValueError("Indica al menos un intervalo")
+        unknown = [interval for interval in self.intervals if interval not in INTERVALS]
+        if unknown:
+            raise ValueError(f"Intervalos no soportados: {', '.join(unknown)} (admitidos: {', '.join(INTERVALS)})")
+        keys = [_key(path) for path in self.group_by]
+        if len(set(keys)) != len(keys) or len({_key(path) for path in self.fields}) != len(self.fields):
+            raise ValueError("Los campos de 'group_by' y 'fields' no pueden repetirse")
+        for path in self.group_by + self.fields + [self.time_field]:
+            if not path or path.startswith("$") or ".." in path:
+                raise ValueError(f"Campo inválido: '{path}'")
+
+    def group_of(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        return {_key(path): get_path(document, path) for path in self.group_by}
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            "_id": f"{self.collection}.{self.name}",
+            "name": self.name,
+            "collection": self.collection,
+            "time_field": self.time_field,
+            "intervals": self.intervals,
+            "group_by": self.group_by,
+            "fields": self.fields,
+        }
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "RollupDefinition":
+        return cls(document["name"], document["collection"], document["time_field"],
+                   document.get("intervals") or [], document.get("group_by"), document.get("fields"))
+
+
+class _Accumulator:
+    """Pre-agregado de un intervalo y un grupo acumulado en memoria antes de escribirlo."""
+    __slots__ = ("interval", "start", "group", "count", "fields")
+
+    def __init__(self, interval: str, start, group: Dict[str, Any]):
+        self.interval = interval
+        self.start = start
+        self.group = group
+        self.count = 0
+        self.fields: Dict[str, List[float]] = {}
+
+    def add(self, values: Dict[str, Any]):
+        self.count += 1
+        for name, value in values.items():
+            stats = self.fields.get(name)
+            if stats is None:
+                self.fields[name] = [1, value, value, value]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                stats[2] = min(stats[2], value)
+                stats[3] = max(stats[3], value)
+
+    def update(self) -> UpdateOne:
+        increments: Dict[str, Any] = {"count": self.count}
+        minimums: Dict[str, Any] = {}
+        maximums: Dict[str, Any] = {}
+        for name, (count, total, low, high) in self.fields.items():
+            increments[f"fields.{name}.count"] = count
+            increments[f"fields.{name}.sum"] = total
+            minimums[f"fields.{name}.min"] = low
+            maximums[f"fields.{name}.max"] = high
+        update: Dict[str, Any] = {"$inc": increments}
+        if minimums:
+            update["$min"] = minimums
+            update["$max"] = maximums
+        return UpdateOne({"interval": self.interval, "group": self.group, "start": self.start}, update, upsert=True)
+
+
+class RollupRegistry:
+    """
+    Mantiene los rollups de las colecciones: al insertar documentos a través de la
+    API se actualizan de forma incremental ($inc, $min y $max con upsert) los
+    pre-agregados de cada intervalo, agrupando antes en memoria los documentos del
+    mismo lote que caen en el mismo intervalo.
+
+    Las definiciones se guardan en la colección MONGO_API_ROLLUP_DEFINITIONS de cada
+    base de datos y se leen todas las de la base de datos a la vez, con una caché
+    propia sin periodo de gracia: una definición nueva llega a los demás workers en
+    'definitions_ttl' segundos como mucho.
+    """
+
+    def __init__(self, definitions_collection: str = "_rollups", definitions_ttl: float = 2.0):
+        self.definitions_collection = definitions_collection
+        self.definitions_ttl = definitions_ttl
+        self._cache = MetadataCache(ttl=definitions_ttl, stale_ttl=0.0)
+        self.updates = 0
+        self.errors = 0
+
+    def _definitions(self, collection: Collection) -> Collection:
+        return collection.database[self.definitions_collection]
+
+    async def _by_collection(self, database: Database) -> Dict[str, List[RollupDefinition]]:
+        store = database[self.definitions_collection]
+
+        def load():
+            by_collection: Dict[str, List[RollupDefinition]] = {}
+            for document in store.find({}):
+                definition = RollupDefinition.from_document(document)
+                by_collection.setdefault(definition.collection, []).append(definition)
+            return by_collection
+
+        return await self._cache.get(("rollups", database.name), load)
+
+    async def definitions(self, collection: Collection) -> List[RollupDefinition]:
+        """Rollups definidos sobre la colección."""
+        if collection.name == self.definitions_collection or ".rollup." in collection.name:
+            return []
+        return (await self._by_collection(collection.database)).get(collection.name, [])
+
+    async def wait_propagation(self):
+        """Espera a que todos los workers hayan releído las definiciones tras un cambio."""
+        await asyncio.sleep(self.definitions_ttl)
+
+    async def get(self, collection: Collection, name: str) -> Optional[RollupDefinition]:
+        for definition in await self.definitions(collection):
+            if definition.name == name:
+                return definition
+        return None
+
+    # Definición
+    def define(self, collection: Collection, definition: RollupDefinition):
+        """Guarda la definición y crea el índice único de la colección de pre-agregados."""
+        definition.validate()
+        target = collection.database[definition.target]
+        document = definition.to_document()
+        previous = self._definitions(collection).find_one({"_id": document["_id"]})
+        if previous is not None and previous != document:
+            # Los pre-agregados de la definición anterior ya no son válidos
+            target.drop()
+        target.create_index([("interval", ASCENDING), ("group", ASCENDING), ("start", ASCENDING)], unique=True)
+        self._definitions(collection).replace_one({"_id": document["_id"]}, document, upsert=True)
+        self._cache.invalidate(collection.database.name)
+        metadata_cache.invalidate(collection.database.name, collection.name)
+
+    def remove(self, collection: Collection, definition: RollupDefinition):
+        """Elimina la definición y sus pre-agregados."""
+        self._definitions(collection).delete_one({"_id": definition.to_document()["_id"]})
+        collection.database[definition.target].drop()
+        self._cache.invalidate(collection.database.name)
+        metadata_cache.invalidate(collection.database.name, collection.name)
+
+    # Actualización incremental
+    async def apply(self, collection: Collection, documents: List[Dict[str, Any]]):
+        """
+        Actualiza los rollups de la colección con los documentos recién insertados.
+        Los errores se registran sin propagarse: la inserción ya se ha realizado y el
+        rollup puede recalcularse con rebuild().
+        """
+        if not documents:
+            return
+        try:
+            definitions = await self.definitions(collection)
+        except Exception as e:
+            logger.error("No se pudieron leer los rollups de %s: %s", collection.full_name, e)
+            self.errors += 1
+            return
+        for definition in definitions:
+            target = collection.database[definition.target]
+            try:
+                operations = self._operations(definition, documents)
+                if not operations:
+                    continue
+                with phase("mongo"):
+                    await overload_guard.run(
+                        "rollup_update", lambda: target.bulk_write(operations, ordered=False)
+                    )
+                self.updates += len(operations)
+            except Exception as e:
+                logger.error("Error al actualizar el rollup %s: %s", definition.target, e)
+                self.errors += 1
+
+    def _operations(self, definition: RollupDefinition, documents: List[Dict[str, Any]]) -> List[UpdateOne]:
+        accumulators: Dict[Tuple, _Accumulator] = {}
+        for document in documents:
+            moment = to_datetime(get_path(document, definition.time_field))
+            if moment is None:
+                continue
+            group = definition.group_of(document)
+            group_key = json_util.dumps(group)
+            values = {}
+            for path in definition.fields:
+                value = get_path(document, path)
+                if _number(value):
+                    values[_key(path)] = value
+            for interval in definition.intervals:
+                start = truncate(moment, interval)
+                key = (interval, start, group_key)
+                accumulator = accumulators.get(key)
+                if accumulator is None:
+                    accumulator = accumulators[key] = _Accumulator(interval, start, group)
+                accumulator.add(values)
+        return [accumulator.update() for accumulator in accumulators.values()]
+
+    # Recálculo completo
+    def rebuild(self, collection: Collection, definition: RollupDefinition) -> Dict[str, int]:
+        """
+        Recalcula los pre-agregados desde los documentos de la colección con $group y
+        $merge (útil al definir un rollup sobre datos existentes o tras escrituras
+        que no pasan por las inserciones de la API). Las inserciones simultáneas al
+        recálculo pueden perderse, por lo que conviene hacerlo sin carga de escritura.
+        """
+        target = collection.database[definition.target]
+        target.delete_many({})
+        # Mismas conversiones que to_datetime; los valores que no son fechas se descartan
+        time = {"$convert": {"input": f"${definition.time_field}", "to": "date", "onError": None, "onNull": None}}
+        group_id = {f"g{index}": f"${path}" for index, path in enumerate(definition.group_by)}
+        accumulators: Dict[str, Any] = {"count": {"$sum": 1}}
+        fields: Dict[str, Any] = {}
+        for index, path in enumerate(definition.fields):
+            number = {"$cond": [{"$isNumber": f"${path}"}, f"${path}", None]}
+            accumulators[f"f{index}_count"] = {"$sum": {"$cond": [{"$isNumber": f"${path}"}, 1, 0]}}
+            accumulators[f"f{index}_sum"] = {"$sum": number}
+            accumulators[f"f{index}_min"] = {"$min": number}
+            accumulators[f"f{index}_max"] = {"$max": number}
+            fields[_key(path)] = {
+                stat: f"$f{index}_{stat}" for stat in ("count", "sum", "min", "max")
+            }
+        # $ifNull conserva los campos de agrupación ausentes como null, igual que apply()
+        group = {_key(path): {"$ifNull": [f"$_id.g{index}", None]} for index, path in enumerate(definition.group_by)}
+        groups = 0
+        for interval in definition.intervals:
+            pipeline = [
+                {"$set": {"_rollup_time": time}},
+                {"$match": {"_rollup_time": {"$ne": None}}},
+                {"$group": {"_id": {"start": {"$dateTrunc": {"date": "$_rollup_time", "unit": interval}}, **group_id},
+                            **accumulators}},
+                {"$project": {
+                    "_id": 0,
+                    "interval": {"$literal": interval},
+                    "group": group or {"$literal": {}},
+                    "start": "$_id.start",
+                    "count": 1,
+                    "fields": fields or {"$literal": {}},
+                }},
+                {"$merge": {"into": definition.target, "on": ["interval", "group", "start"],
+                            "whenMatched": "replace", "whenNotMatched": "insert"}},
+            ]
+            collection.aggregate(pipeline, allowDiskUse=True)
+            groups += target.count_documents({"interval": interval})
+        return {"groups": groups}
+
+    # Consulta
+    def query(self, collection: Collection, definition: RollupDefinition, interval: str, start=None, end=None,
+              group: Optional[Dict[str, Any]] = None, limit: int = 0) -> List[Dict[str, Any]]:
+        """Lee los pre-agregados de un intervalo en el rango [start, end), ordenados por inicio."""
+        filter: Dict[str, Any] = {"interval": interval}
+        if group is not None:
+            filter["group"] = {_key(path): group.get(path) for path in definition.group_by}
+        if start is not None or end is not None:
+            filter["start"] = {}
+            if start is not None:
+                filter["start"]["$gte"] = start
+            if end is not None:
+                filter["start"]["$lt"] = end
+        cursor = collection.database[definition.target].find(filter, {"_id": 0}).sort("start", ASCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        names = {_key(path): path for path in definition.group_by}
+        fields = {_key(path): path for path in definition.fields}
+        series = []
+        for document in cursor:
+            stats = {}
+            for key, values in (document.get("fields") or {}).items():
+                values = dict(values)
+                values["avg"] = values["sum"] / values["count"] if values.get("count") else None
+                stats[fields.get(key, key)] = values
+            series.append({
+                "start": document["start"],
+                "group": {names.get(key, key): value for key, value in (document.get("group") or {}).items()},
+                "count": document.get("count", 0),
+                "fields": stats,
+            })
+        return series
+
+    def stats(self) -> Dict[str, Any]:
+        return {"updates": self.updates, "errors": self.errors}
+
+
+# Instancia global de los rollups
+rollup_registry = RollupRegistry(
+    os.getenv("MONGO_API_ROLLUP_DEFINITIONS", "_rollups"),
+    definitions_ttl=float(os.getenv("MONGO_API_ROLLUP_DEFINITIONS_TTL", "2")),
+)
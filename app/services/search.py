@@ -0,0 +1,182 @@
+import re
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
+
+# Modos de búsqueda
+SEARCH_MODES = ("text", "prefix")
+
+# Campo auxiliar con la clave de orden de cada resultado (para la paginación)
+SORT_KEY = "_search_key"
+
+# Campo con la relevancia de los resultados de la búsqueda de texto
+SCORE_FIELD = "_score"
+
+# Opciones de collation que se pueden indicar en una consulta
+_COLLATION_OPTIONS = ("locale", "caseLevel", "caseFirst", "strength", "numericOrdering",
+                      "alternate", "maxVariable", "normalization", "backwards")
+
+# U+FFFF tiene el mayor peso primario en la collation de ICU: "abc" <= x <= "abc\uffff"
+# cubre todo lo que empieza por "abc"
+_COLLATION_MAX = "\uffff"
+
+
+class SearchIndexMissing(Exception):
+    """La colección no tiene un índice adecuado para la búsqueda."""
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Codifica la posición del último resultado (clave de orden y _id) para la siguiente página."""
+    raw = json_util.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> List[Any]:
+    """Decodifica un cursor generado con encode_cursor. Lanza ValueError si no es válido."""
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8"))
+    except Exception:
+        raise ValueError("Cursor de búsqueda inválido")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Cursor de búsqueda inválido")
+    return values
+
+
+def find_text_index(indexes: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Devuelve el índice de texto de la colección (solo puede haber uno)."""
+    for index in indexes:
+        if (index.get("key") or {}).get("_fts") == "text":
+            return index
+    return None
+
+
+def find_prefix_index(indexes: List[Dict[str, Any]], field: str) -> Optional[Dict[str, Any]]:
+    """
+    Elige el índice para buscar por prefijo en 'field': uno que empiece por el campo,
+    preferiblemente con collation (búsqueda sin distinguir mayúsculas ni acentos) y
+    con la menor 'strength'.
+    """
+    candidates = []
+    for index in indexes:
+        keys = list((index.get("key") or {}).items())
+        if not keys or keys[0][0] != field or keys[0][1] not in (1, -1):
+            continue
+        collation = index.get("collation") or {}
+        strength = collation.get("strength", 3) if collation.get("locale", "simple") != "simple" else 4
+        candidates.append((strength, index))
+    if not candidates:
+        return None
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def query_collation(index: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Collation de la consulta para que pueda usar el índice (debe coincidir con la suya)."""
+    collation = index.get("collation") or {}
+    if collation.get("locale", "simple") == "simple":
+        return None
+    return {key: value for key, value in collation.items() if key in _COLLATION_OPTIONS}
+
+
+def select_index(mode: str, indexes: List[Dict[str, Any]], field: Optional[str]) -> Dict[str, Any]:
+    """
+    Elige el índice que usará la búsqueda.
+
+    Raises:
+        SearchIndexMissing: Si la colección no tiene un índice adecuado
+    """
+    if mode == "text":
+        index = find_text_index(indexes)
+        if index is None:
+            raise SearchIndexMissing(
+                "La colección no tiene un índice de texto. Créalo con POST /api/indexes y "
+                "keys [{\"field\": \"<campo>\", \"order\": \"text\"}]"
+            )
+        return index
+    index = find_prefix_index(indexes, field)
+    if index is None:
+        raise SearchIndexMissing(
+            f"No hay ningún índice que empiece por '{field}'. Créalo con POST /api/indexes "
+            f"(con 'collation' para no distinguir mayúsculas ni acentos)"
+        )
+    return index
+
+
+def _projection_stage(projection: Optional[Dict[str, Any]], keep: List[str]) -> List[Dict[str, Any]]:
+    if not projection:
+        return []
+    # En una proyección de inclusión se conservan también los campos de la paginación
+    if any(value not in (0, False) for key, value in projection.items() if key != "_id"):
+        projection = {**projection, **{field: 1 for field in keep}, "_id": 1}
+    else:
+        # Los campos de la paginación no pueden excluirse
+        projection = {key: value for key, value in projection.items() if key != "_id" and key not in keep}
+    return [{"$project": projection}] if projection else []
+
+
+def text_pipeline(query: str, filter: Optional[Dict[str, Any]], language: Optional[str],
+                  projection: Optional[Dict[str, Any]], after: Optional[List[Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    Búsqueda con el índice de texto ordenada por relevancia (y _id para desempatar).
+    La paginación continúa tras la relevancia y el _id del último resultado.
+    """
+    text: Dict[str, Any] = {"$search": query}
+    if language:
+        text["$language"] = language
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": {"$text": text, **(filter or {})}},
+        {"$set": {SCORE_FIELD: {"$meta": "textScore"}}},
+    ]
+    if after is not None:
+        score, last_id = after
+        pipeline.append({"$match": {"$or": [
+            {SCORE_FIELD: {"$lt": score}},
+            {SCORE_FIELD: score, "_id": {"$gt": last_id}},
+        ]}})
+    pipeline.append({"$sort": {SCORE_FIELD: -1, "_id": 1}})
+    pipeline.append({"$limit": limit + 1})
+    pipeline.extend(_projection_stage(projection, [SCORE_FIELD]))
+    return pipeline
+
+
+def prefix_pipeline(field: str, query: str, index: Dict[str, Any], filter: Optional[Dict[str, Any]],
+                    projection: Optional[Dict[str, Any]], after: Optional[List[Any]],
+                    limit: int) -> List[Dict[str, Any]]:
+    """
+    Búsqueda por prefijo sobre el índice del campo, ordenada por el campo y el _id.
+
+    Con un índice con collation la condición es un rango ("abc" <= x <= "abc\\uffff")
+    que, con la misma collation, no distingue mayúsculas (ni acentos con strength 1).
+    Sin collation se usa una expresión regular anclada, que distingue mayúsculas.
+    """
+    if query_collation(index) is not None:
+        condition: Dict[str, Any] = {"$gte": query, "$lte": query + _COLLATION_MAX}
+    else:
+        condition = {"$regex": "^" + re.escape(query)}
+    conditions = [{field: condition}]
+    if filter:
+        conditions.append(filter)
+    if after is not None:
+        value, last_id = after
+        conditions.append({"$or": [{field: {"$gt": value}}, {field: value, "_id": {"$gt": last_id}}]})
+    return [
+        {"$match": conditions[0] if len(conditions) == 1 else {"$and": conditions}},
+        {"$sort": {field: 1, "_id": 1}},
+        {"$limit": limit + 1},
+        {"$set": {SORT_KEY: f"${field}"}},
+        *_projection_stage(projection, [SORT_KEY]),
+    ]
+
+
+def page(documents: List[Dict[str, Any]], limit: int, key_field: str, remove_key: bool) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Separa el resultado extra pedido para saber si hay más y calcula el cursor de la siguiente página."""
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    next_cursor = None
+    if has_more and documents:
+        last = documents[-1]
+        next_cursor = encode_cursor([last.get(key_field), last["_id"]])
+    if remove_key:
+        for document in documents:
+            document.pop(key_field, None)
+    return documents, next_cursor
@@ -0,0 +1,97 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bson import json_util
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from app.services.metadata_cache import metadata_cache
+
+logger = logging.getLogger(__name__)
+
+# Intervalos de agregación admitidos y su duración en milisegundos
+INTERVALS = {"minute": 60_000, "hour": 3_600_000, "day": 86_400_000}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_datetime(value: Any) -> Optional[datetime]:
+    """
+    Convierte una marca de tiempo recibida en JSON a datetime (UTC). Admite
+    fechas ISO 8601, JSON extendido ({"$date": ...}) y números en milisegundos
+    desde epoch, igual que $toDate. Devuelve None si el valor no es una fecha.
+    """
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value / 1000.0, tz=timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            # NaN, infinito o fuera del rango de fechas
+            return None
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    if isinstance(value, dict) and "$date" in value:
+        try:
+            return to_datetime(json_util.loads(json_util.dumps(value)))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def truncate(moment: datetime, interval: str) -> datetime:
+    """Inicio (UTC) del intervalo que contiene 'moment', como $dateTrunc."""
+    millis = int((moment - _EPOCH).total_seconds() * 1000)
+    size = INTERVALS[interval]
+    return datetime.fromtimestamp((millis - millis % size) / 1000.0, tz=timezone.utc)
+
+
+def get_path(document: Dict[str, Any], path: str) -> Any:
+    """Obtiene el valor de un campo con notación de puntos (None si no existe)."""
+    value: Any = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+async def timeseries_fields(database: Database) -> Dict[str, str]:
+    """
+    Campo de tiempo de cada colección time-series de la base de datos, vía la caché
+    de metadatos: una consulta por base de datos, no por colección insertada.
+    """
+    def load():
+        try:
+            return {
+                info["name"]: ((info.get("options") or {}).get("timeseries") or {}).get("timeField")
+                for info in database.list_collections(filter={"type": "timeseries"})
+            }
+        except Exception as e:
+            # Sin permiso de listCollections se tratan como colecciones normales
+            logger.warning("No se pudieron leer las colecciones time-series de %s: %s", database.name, e)
+            return {}
+
+    return await metadata_cache.get(("timeseries", database.name), load)
+
+
+async def prepare_documents(collection: Collection, documents: List[Dict[str, Any]]):
+    """
+    En las colecciones time-series, convierte el campo de tiempo de los documentos
+    a fecha BSON, ya que JSON no tiene tipo fecha y MongoDB rechaza otros valores.
+    """
+    time_field = (await timeseries_fields(collection.database)).get(collection.name)
+    if not time_field:
+        return
+    for document in documents:
+        value = document.get(time_field)
+        moment = to_datetime(value)
+        if moment is not None and moment is not value:
+            document[time_field] = moment
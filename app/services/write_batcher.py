@@ -0,0 +1,164 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import WriteConcern
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, ConfigurationError, DuplicateKeyError, WriteError, WriteConcernError
+
+from app.auth.namespaces import PatternSet
+from app.services.rollups import rollup_registry
+
+logger = logging.getLogger(__name__)
+
+
+def build_write_concern(options: Optional[Dict[str, Any]]) -> Optional[WriteConcern]:
+    """
+    Construye un WriteConcern a partir de las opciones recibidas en la petición
+    (w, j, wtimeout). Lanza ValueError si las opciones no son válidas.
+    """
+    if not options:
+        return None
+    unknown = set(options) - {"w", "j", "wtimeout"}
+    if unknown:
+        raise ValueError(f"Opciones de write concern no soportadas: {', '.join(sorted(unknown))}")
+    try:
+        return WriteConcern(**options)
+    except (TypeError, ValueError, ConfigurationError) as e:
+        # ConfigurationError: combinaciones no válidas, como w=0 con j=True
+        raise ValueError(f"Write concern inválido: {e}")
+
+
+class _PendingBatch:
+    """Documentos acumulados para una colección y un write concern."""
+    __slots__ = ("collection", "documents", "futures", "timer")
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        self.documents: List[Dict[str, Any]] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class InsertBatcher:
+    """
+    Agrupa inserciones individuales concurrentes sobre la misma colección en un
+    único insert_many no ordenado (group commit).
+
+    Un lote se envía cuando pasa la ventana 'window_ms' desde su primer documento o
+    cuando alcanza 'max_docs'. Cada llamante recibe su propio _id o su propio error.
+    Solo se aplica a las colecciones que coinciden con los patrones 'base.coleccion'
+    configurados en MONGO_API_INSERT_BATCH_COLLECTIONS.
+    """
+
+    def __init__(self, collections: Optional[List[str]] = None, window_ms: float = 2.0, max_docs: int = 500):
+        self.collections = PatternSet(collections)
+        self.window = window_ms / 1000.0
+        self.max_docs = max_docs
+        self._pending: Dict[Tuple, _PendingBatch] = {}
+        self._inflight: set = set()
+        self.batches = 0
+        self.documents = 0
+
+    def enabled_for(self, database: str, collection: str) -> bool:
+        """Indica si las inserciones en la colección deben agruparse."""
+        return bool(self.collections) and self.collections.matches(f"{database}.{collection}")
+
+    async def insert(self, collection: Collection, document: Dict[str, Any],
+                     write_concern: Optional[WriteConcern] = None) -> Any:
+        """Encola el documento en el lote de su colección y espera su resultado (el _id insertado)."""
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        key = (collection.full_name, tuple(sorted(collection.write_concern.document.items())))
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _PendingBatch(collection)
+            self._pending[key] = batch
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.documents.append(document)
+        batch.futures.append(future)
+        if len(batch.documents) >= self.max_docs:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: Tuple):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._write(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _write(self, batch: _PendingBatch):
+        self.batches += 1
+        self.documents += len(batch.documents)
+        loop = asyncio.get_running_loop()
+        errors: Dict[int, Exception] = {}
+        failure: Optional[Exception] = None
+        concern_failure: Optional[Exception] = None
+        try:
+            await loop.run_in_executor(
+                None, lambda: batch.collection.insert_many(batch.documents, ordered=False)
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                error_class = DuplicateKeyError if error.get("code") == 11000 else WriteError
+                errors[error["index"]] = error_class(error.get("errmsg"), error.get("code"), error)
+            # Los documentos se escribieron pero sin el write concern pedido: como en
+            # insert_one, el resto de peticiones reciben el error en lugar del _id
+            concern_errors = e.details.get("writeConcernErrors") or []
+            if concern_errors:
+                concern_error = concern_errors[0]
+                concern_failure = WriteConcernError(concern_error.get("errmsg"), concern_error.get("code"), concern_error)
+        except Exception as e:
+            failure = e
+
+        try:
+            if failure is None:
+                await rollup_registry.apply(
+                    batch.collection, [document for index, document in enumerate(batch.documents) if index not in errors]
+                )
+        finally:
+            # Los documentos ya están escritos: cada petición recibe su resultado pase lo que pase
+            # insert_many asigna el _id de cada documento antes de enviarlo
+            for index, (document, future) in enumerate(zip(batch.documents, batch.futures)):
+                if future.done():
+                    continue
+                if failure is not None:
+                    future.set_exception(failure)
+                elif index in errors:
+                    future.set_exception(errors[index])
+                elif concern_failure is not None:
+                    future.set_exception(concern_failure)
+                else:
+                    future.set_result(document["_id"])
+
+    async def flush_all(self):
+        """Envía todos los lotes pendientes y espera a que terminen (al detener la API)."""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_docs": self.max_docs,
+            "batches": self.batches,
+            "documents": self.documents,
+            "avg_batch_size": round(self.documents / self.batches, 2) if self.batches else 0.0,
+            "pending_batches": len(self._pending),
+        }
+
+
+# Instancia global del agrupador de inserciones
+insert_batcher = InsertBatcher(
+    collections=[name.strip() for name in os.getenv("MONGO_API_INSERT_BATCH_COLLECTIONS", "").split(",") if name.strip()],
+    window_ms=float(os.getenv("MONGO_API_INSERT_BATCH_WINDOW_MS", "2")),
+    max_docs=int(os.getenv("MONGO_API_INSERT_BATCH_MAX_DOCS", "500")),
+)
@@ -0,0 +1,138 @@
+"""
+Procesos auxiliares de los benchmarks: mongod local, servidor de la API y
+medición de memoria residente (RSS).
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+# Credenciales del usuario que se crea en el mongod temporal
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+
+# Clave de API con la que el benchmark se autentica (rol de administrador, sin límites de tasa)
+BENCH_API_KEY = "benchmark-api-key"
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    """Obtiene un puerto TCP libre en la interfaz local."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    """Espera a que haya un proceso escuchando en el puerto indicado."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nada escucha en el puerto {port} tras {timeout}s")
+
+
+def wait_for_ready(base_url: str, timeout: float = 30.0):
+    """Espera a que la API responda 200 en /readyz (arranque y precalentamiento terminados)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/readyz", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"La API no está lista en {base_url} tras {timeout}s")
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Memoria residente de un proceso (psutil si está disponible, si no /proc)."""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+@contextmanager
+def local_mongod(mongod_path: Optional[str] = None) -> Iterator[Dict[str, str]]:
+    """
+    Arranca un mongod temporal con un directorio de datos desechable y crea el
+    usuario del benchmark. Devuelve las variables de entorno de conexión para la API.
+    """
+    binary = mongod_path or shutil.which("mongod")
+    if binary is None:
+        raise RuntimeError("No se encontró 'mongod'. Usa --mongod-path, --mongo-uri o --backend mongomock")
+    dbpath = tempfile.mkdtemp(prefix="mongo-api-bench-")
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        from pymongo import MongoClient
+        client = MongoClient("127.0.0.1", port)
+        client.admin.command("createUser", BENCH_USER, pwd=BENCH_PASSWORD, roles=["root"])
+        client.close()
+        yield {
+            "MONGO_HOST": "127.0.0.1",
+            "MONGO_PORT": str(port),
+            "MONGO_USERNAME": BENCH_USER,
+            "MONGO_PASSWORD": BENCH_PASSWORD,
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+@contextmanager
+def api_server(backend: str, mongo_env: Dict[str, str], extra_env: Optional[Dict[str, str]] = None) -> Iterator[subprocess.Popen]:
+    """Arranca la API en un proceso aparte y espera a que esté lista."""
+    port = free_port()
+    env = dict(os.environ)
+    env.update(mongo_env)
+    env.update(extra_env or {})
+    env["MONGO_API_KEY"] = BENCH_API_KEY
+    env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.server", "--port", str(port), "--backend", backend],
+        cwd=ROOT_DIR, env=env,
+    )
+    process.base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_port(port)
+        wait_for_ready(process.base_url)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,67 @@
+"""
+Compara dos resultados de benchmarks/run.py (por ejemplo, de dos commits).
+
+Uso:
+    python -m benchmarks.compare base.json candidato.json [--threshold 5]
+
+Muestra, por escenario, el valor base, el candidato y la variación porcentual
+de throughput, latencias y memoria. Las variaciones que superan el umbral se
+marcan como mejora (+) o empeoramiento (-).
+"""
+import argparse
+import json
+import sys
+
+# Métrica -> True si un valor mayor es mejor
+METRICS = {
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "rss_peak_mb": False,
+    "rss_growth_mb": False,
+    "request_peak_max_mb": False,
+    "response_kb": False,
+}
+
+
+def compare(base: dict, candidate: dict, threshold: float) -> int:
+    """Imprime la comparación y devuelve el número de empeoramientos por encima del umbral."""
+    regressions = 0
+    print(f"base:      {base['meta'].get('git_revision')} {base['meta'].get('label', '')}")
+    print(f"candidato: {candidate['meta'].get('git_revision')} {candidate['meta'].get('label', '')}")
+    print(f"{'escenario':12s} {'métrica':15s} {'base':>12s} {'candidato':>12s} {'cambio':>9s}")
+    for name, base_result in base["scenarios"].items():
+        candidate_result = candidate["scenarios"].get(name)
+        if candidate_result is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base_result.get(metric), candidate_result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100.0
+            improved = change > 0 if higher_is_better else change < 0
+            mark = ""
+            if abs(change) >= threshold:
+                mark = "+" if improved else "-"
+                regressions += 0 if improved else 1
+            print(f"{name:12s} {metric:15s} {old:>12.2f} {new:>12.2f} {change:>+8.1f}% {mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=5.0, help="Variación porcentual significativa")
+    args = parser.parse_args(argv)
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    regressions = compare(base, candidate, args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
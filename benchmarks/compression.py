@@ -0,0 +1,82 @@
+"""
+Micro-benchmark de la compresión de respuestas: ancho de banda frente a CPU.
+
+Genera respuestas de find representativas (documentos flat, nested y wide,
+serializados como los devuelve la API) y mide, para cada codificación disponible
+con el nivel que usa CompressionMiddleware:
+- tamaño comprimido y proporción frente al original
+- tiempo de compresión por respuesta y rendimiento en MB/s
+- tiempo de descompresión por respuesta (coste en el cliente)
+
+Uso:
+    python -m benchmarks.compression [--documents 100 1000] [--shapes flat nested wide]
+"""
+import argparse
+import json
+import random
+import time
+
+from bson import json_util
+
+from app.services.compression import COMPRESSORS, _decompressor
+from benchmarks.run import make_document
+
+
+def best_time(function, repeat: int) -> float:
+    """Mejor tiempo de 'repeat' ejecuciones, en segundos."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compress(encoding: str, payload: bytes) -> bytes:
+    factory, level = COMPRESSORS[encoding]
+    compressor = factory(level)
+    return compressor.compress(payload) + compressor.finish()
+
+
+def measure(payload: bytes, repeat: int) -> dict:
+    results = {}
+    for encoding in COMPRESSORS:
+        compressed = compress(encoding, payload)
+        compress_s = best_time(lambda: compress(encoding, payload), repeat)
+        decompress_s = best_time(lambda: _decompressor(encoding).decompress(compressed, len(payload)), repeat)
+        results[encoding] = {
+            "bytes": len(compressed),
+            "ratio": round(len(payload) / len(compressed), 2),
+            "compress_ms": round(compress_s * 1000.0, 3),
+            "compress_mb_s": round(len(payload) / compress_s / 1e6, 1),
+            "decompress_ms": round(decompress_s * 1000.0, 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--shapes", nargs="+", default=["flat", "nested", "wide"])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    report = {}
+    print(f"{'respuesta':18s} {'codif.':6s} {'bytes':>10s} {'ratio':>6s} {'comp ms':>8s} {'MB/s':>7s} {'desc ms':>8s}")
+    for shape in args.shapes:
+        for count in args.documents:
+            documents = [make_document(i, shape, rng) for i in range(count)]
+            payload = json.dumps(json.loads(json_util.dumps(documents))).encode("utf-8")
+            label = f"{shape}x{count}"
+            results = measure(payload, args.repeat)
+            report[label] = {"identity_bytes": len(payload), "encodings": results}
+            print(f"{label:18s} {'-':6s} {len(payload):>10d}")
+            for encoding, result in results.items():
+                print(f"{'':18s} {encoding:6s} {result['bytes']:>10d} {result['ratio']:>6.2f} "
+                      f"{result['compress_ms']:>8.3f} {result['compress_mb_s']:>7.1f} {result['decompress_ms']:>8.3f}")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
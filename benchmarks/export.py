@@ -0,0 +1,90 @@
+"""
+Benchmark de la exportación paralela (POST /api/export).
+
+Arranca la API como benchmarks.run, siembra la colección y mide el tiempo total
+de exportarla completa en NDJSON con distinto número de workers, para comprobar
+cómo escala con la concurrencia. Con --backend mongomock solo se miden las rutas
+de CPU (mongomock no libera el GIL); la escalabilidad real requiere mongod.
+
+Uso:
+    python -m benchmarks.export --documents 200000 --workers 1 2 4 8 --output export.json
+"""
+import argparse
+import asyncio
+import json
+import time
+from contextlib import nullcontext
+from typing import Any, Dict
+
+import httpx
+
+from benchmarks.backends import BENCH_API_KEY, api_server, local_mongod
+from benchmarks.run import COLLECTION, DATABASE, git_revision, seed
+
+
+async def export_once(client: httpx.AsyncClient, workers: int, method: str) -> Dict[str, Any]:
+    """Descarga la exportación completa y devuelve tiempo, documentos y bytes."""
+    body = {"mongo_request": {"database": DATABASE, "collection": COLLECTION},
+            "workers": workers, "method": method}
+    documents = size = 0
+    start = time.perf_counter()
+    async with client.stream("POST", "/api/export", json=body) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            documents += chunk.count(b"\n")
+            size += len(chunk)
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 3),
+        "documents": documents,
+        "docs_per_s": round(documents / elapsed, 1),
+        "mb": round(size / 1e6, 2),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    mongo = local_mongod(args.mongod_path) if args.backend == "mongod" else nullcontext({})
+    with mongo as mongo_env, api_server("mongomock" if args.backend == "mongomock" else "mongod",
+                                        mongo_env, {}) as server:
+        headers = {"Authorization": f"Bearer {BENCH_API_KEY}", "Accept-Encoding": "identity"}
+        async with httpx.AsyncClient(base_url=server.base_url, headers=headers, timeout=args.timeout) as client:
+            await seed(client, args.documents, args.shape, 1000)
+            results = {}
+            for workers in args.workers:
+                runs = [await export_once(client, workers, args.method) for _ in range(args.repeat)]
+                best = min(runs, key=lambda result: result["seconds"])
+                results[str(workers)] = best
+                print(f"workers {workers:3d}  {best['seconds']:>8.2f} s  {best['docs_per_s']:>12.1f} docs/s  "
+                      f"{best['documents']} docs  {best['mb']} MB")
+    return {
+        "meta": {
+            "git_revision": git_revision(),
+            "backend": args.backend,
+            "documents": args.documents,
+            "shape": args.shape,
+            "method": args.method,
+        },
+        "workers": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["mongod", "mongomock", "external"], default="mongod")
+    parser.add_argument("--mongod-path", default=None)
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--shape", choices=["flat", "nested", "wide"], default="flat")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--method", choices=["sample", "bucketAuto"], default="sample")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por número de workers (se toma la mejor)")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
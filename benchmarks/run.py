@@ -0,0 +1,336 @@
+"""
+Benchmark de carga de la API a través de HTTP real.
+
+Arranca la API en un proceso aparte contra un mongod temporal (o contra
+mongomock para medir solo las rutas de CPU, o contra el MongoDB configurado en
+.env), siembra una colección con documentos de tamaño y forma configurables y
+lanza peticiones concurrentes sobre cada escenario. Escribe un JSON con
+throughput, latencias p50/p95/p99, bytes por respuesta y memoria residente del
+servidor que puede compararse entre commits con benchmarks/compare.py. Con
+--trace-memory mide además el pico de memoria de cada petición en el servidor.
+
+Uso:
+    python -m benchmarks.run --backend mongomock --documents 5000 --concurrency 16 \\
+        --duration 10 --output resultados.json
+
+Requiere httpx (y mongomock para --backend mongomock): pip install -r benchmarks/requirements.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import httpx
+
+from benchmarks.backends import BENCH_API_KEY, ROOT_DIR, api_server, local_mongod, rss_bytes
+
+DATABASE = "benchmark"
+COLLECTION = "documents"
+WRITE_COLLECTION = "writes"
+GROUPS = 100
+
+SCENARIOS = ["find", "get_by_id", "count", "aggregate", "insert_one", "insert_many", "insert_many_large", "bulk"]
+
+
+# Generación de documentos
+def make_document(index: int, shape: str, rng: random.Random) -> Dict[str, Any]:
+    """Genera un documento con la forma indicada: flat, nested o wide."""
+    document = {
+        "seq": index,
+        "group": index % GROUPS,
+        "value": rng.random() * 1000,
+        "name": f"item-{index}",
+        "active": index % 3 != 0,
+    }
+    if shape == "nested":
+        document["meta"] = {
+            "tags": [f"tag-{rng.randrange(20)}" for _ in range(5)],
+            "location": {"lat": rng.uniform(-90, 90), "lon": rng.uniform(-180, 180)},
+            "history": [{"at": i, "value": rng.random()} for i in range(5)],
+        }
+    elif shape == "wide":
+        for field in range(100):
+            document[f"field_{field}"] = rng.random() if field % 2 else f"valor-{field}"
+    return document
+
+
+# Escenarios
+class Scenario:
+    """Define cómo construir una petición de un escenario."""
+
+    def __init__(self, name: str, build: Callable[[random.Random], Dict[str, Any]]):
+        self.name = name
+        self.build = build
+
+
+def build_scenarios(ids: List[str], shape: str, batch_size: int, large_batch_size: int) -> Dict[str, Scenario]:
+    namespace = {"database": DATABASE, "collection": COLLECTION}
+    write_namespace = {"database": DATABASE, "collection": WRITE_COLLECTION}
+    counter = {"seq": 10 ** 9}
+
+    def next_batch(rng: random.Random, size: int = batch_size) -> List[Dict[str, Any]]:
+        counter["seq"] += size
+        return [make_document(counter["seq"] + i, shape, rng) for i in range(size)]
+
+    def next_document(rng: random.Random) -> Dict[str, Any]:
+        counter["seq"] += 1
+        return make_document(counter["seq"], shape, rng)
+
+    return {
+        "find": Scenario("find", lambda rng: {
+            "method": "POST", "url": "/api/documents/find",
+            "json": {"mongo_request": namespace, "filter": {"group": rng.randrange(GROUPS)},
+                     "sort": [{"field": "seq", "order": 1}], "limit": 50},
+        }),
+        "get_by_id": Scenario("get_by_id", lambda rng: {
+            "method": "GET", "url": f"/api/documents/{rng.choice(ids)}",
+            "params": namespace,
+        }),
+        "count": Scenario("count", lambda rng: {
+            "method": "POST", "url": "/api/documents/count",
+            "json": {"mongo_request": namespace, "filter": {"group": rng.randrange(GROUPS)}},
+        }),
+        "aggregate": Scenario("aggregate", lambda rng: {
+            "method": "POST", "url": "/api/aggregate",
+            "json": {"request": namespace, "pipeline": [
+                {"$match": {"active": True, "group": {"$lt": rng.randrange(1, GROUPS)}}},
+                {"$group": {"_id": "$group", "total": {"$sum": "$value"}, "n": {"$sum": 1}}},
+                {"$sort": {"total": -1}},
+                {"$limit": 10},
+            ]},
+        }),
+        "insert_one": Scenario("insert_one", lambda rng: {
+            "method": "POST", "url": "/api/documents",
+            "json": {"mongo_request": write_namespace, "document": next_document(rng)},
+        }),
+        "insert_many": Scenario("insert_many", lambda rng: {
+            "method": "POST", "url": "/api/documents/many",
+            "json": {"mongo_request": write_namespace, "documents": next_batch(rng)},
+        }),
+        # Cuerpos de varios MB: su pico de memoria por petición se mide con --trace-memory --concurrency 1
+        "insert_many_large": Scenario("insert_many_large", lambda rng: {
+            "method": "POST", "url": "/api/documents/many",
+            "json": {"mongo_request": write_namespace, "documents": next_batch(rng, large_batch_size)},
+        }),
+        "bulk": Scenario("bulk", lambda rng: {
+            "method": "POST", "url": "/api/bulk",
+            "json": {"request": write_namespace, "ordered": False, "operations": [
+                {"type": "insert", "document": document} for document in next_batch(rng)[: batch_size // 2]
+            ] + [
+                {"type": "update_one", "filter": {"group": rng.randrange(GROUPS)}, "update": {"$inc": {"value": 1}}}
+                for _ in range(batch_size // 4)
+            ] + [
+                {"type": "delete_one", "filter": {"group": rng.randrange(GROUPS)}}
+                for _ in range(batch_size // 4)
+            ]},
+        }),
+    }
+
+
+# Medición
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def sample_rss(pid: int, samples: List[int], stop: asyncio.Event, interval: float = 0.05):
+    """Muestrea periódicamente la memoria residente del servidor."""
+    while not stop.is_set():
+        value = rss_bytes(pid)
+        if value is not None:
+            samples.append(value)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, concurrency: int,
+                       duration: float, server_pid: int, seed: int) -> Dict[str, Any]:
+    """Lanza 'concurrency' clientes durante 'duration' segundos y resume los resultados."""
+    latencies: List[float] = []
+    downloaded: List[int] = []
+    peaks: List[int] = []
+    errors: Dict[str, int] = {}
+    rss_samples: List[int] = []
+    stop = asyncio.Event()
+    rss_start = rss_bytes(server_pid)
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 1000 + worker_id)
+        while time.perf_counter() < deadline:
+            request = scenario.build(rng)
+            start = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                ok = response.status_code < 400
+                if not ok:
+                    errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+            except httpx.HTTPError as e:
+                ok = False
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            if ok:
+                latencies.append((time.perf_counter() - start) * 1000.0)
+                downloaded.append(response.num_bytes_downloaded)
+                if "x-bench-peak-memory" in response.headers:
+                    peaks.append(int(response.headers["x-bench-peak-memory"]))
+
+    sampler = asyncio.ensure_future(sample_rss(server_pid, rss_samples, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    ordered = sorted(latencies)
+    ordered_peaks = sorted(peaks)
+    mb = 1024 * 1024
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(ordered, 0.50), 3),
+        "p95_ms": round(percentile(ordered, 0.95), 3),
+        "p99_ms": round(percentile(ordered, 0.99), 3),
+        "max_ms": round(ordered[-1], 3) if ordered else 0.0,
+        "response_kb": round(sum(downloaded) / len(downloaded) / 1024, 2) if downloaded else 0.0,
+        "rss_start_mb": round(rss_start / mb, 2) if rss_start else None,
+        "rss_peak_mb": round(max(rss_samples) / mb, 2) if rss_samples else None,
+        "rss_end_mb": round(rss_samples[-1] / mb, 2) if rss_samples else None,
+        # Crecimiento del RSS durante el escenario: incluye lo que retiene el asignador y los datos de mongomock
+        "rss_growth_mb": round((max(rss_samples) - rss_start) / mb, 2) if rss_samples and rss_start else None,
+        # Pico de memoria de Python por petición medido en el servidor (solo con --trace-memory)
+        "request_peak_p50_mb": round(percentile(ordered_peaks, 0.50) / mb, 2) if peaks else None,
+        "request_peak_max_mb": round(ordered_peaks[-1] / mb, 2) if peaks else None,
+    }
+
+
+async def seed(client: httpx.AsyncClient, documents: int, shape: str, batch_size: int) -> List[str]:
+    """Siembra la colección a través de la propia API y devuelve los IDs insertados."""
+    rng = random.Random(42)
+    namespace = {"database": DATABASE, "collection": COLLECTION}
+    await client.request("DELETE", "/api/collections", json=namespace)
+    await client.request("DELETE", "/api/collections", json={"database": DATABASE, "collection": WRITE_COLLECTION})
+    ids: List[str] = []
+    for start in range(0, documents, batch_size):
+        batch = [make_document(i, shape, rng) for i in range(start, min(documents, start + batch_size))]
+        response = await client.post("/api/documents/many", json={"mongo_request": namespace, "documents": batch})
+        response.raise_for_status()
+        ids.extend(response.json()["inserted_ids"])
+    await client.post("/api/indexes", json={"request": namespace, "keys": "group"})
+    return ids
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "desconocido"
+
+
+async def run(args) -> Dict[str, Any]:
+    if args.backend == "mongod":
+        mongo = local_mongod(args.mongod_path)
+    else:
+        # mongomock no necesita conexión; 'external' usa el MongoDB configurado en .env
+        mongo = nullcontext({})
+
+    server_env = dict(item.split("=", 1) for item in args.env)
+    if args.trace_memory:
+        server_env["BENCH_TRACE_MEMORY"] = "1"
+    with mongo as mongo_env, api_server("mongomock" if args.backend == "mongomock" else "mongod",
+                                        mongo_env, server_env) as server:
+        headers = {"Authorization": f"Bearer {BENCH_API_KEY}"}
+        headers.update({name.strip(): value.strip() for name, value in
+                        (header.split(":", 1) for header in args.header)})
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=server.base_url, headers=headers, limits=limits,
+                                     timeout=args.timeout) as client:
+            ids = await seed(client, args.documents, args.shape, args.batch_size)
+            scenarios = build_scenarios(ids, args.shape, args.batch_size, args.large_batch_size)
+            results = {}
+            for name in args.scenarios:
+                if args.warmup > 0:
+                    await run_scenario(client, scenarios[name], args.concurrency, args.warmup, server.pid, args.seed)
+                results[name] = await run_scenario(client, scenarios[name], args.concurrency,
+                                                   args.duration, server.pid, args.seed)
+                print(f"{name:17s} {results[name]['throughput_rps']:>10.1f} req/s  "
+                      f"p50 {results[name]['p50_ms']:>8.2f} ms  p95 {results[name]['p95_ms']:>8.2f} ms  "
+                      f"p99 {results[name]['p99_ms']:>8.2f} ms  rss {results[name]['rss_peak_mb']} MB")
+
+    return {
+        "meta": {
+            "label": args.label,
+            "git_revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "documents": args.documents,
+            "shape": args.shape,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "batch_size": args.batch_size,
+            "large_batch_size": args.large_batch_size,
+            "headers": args.header,
+            "trace_memory": args.trace_memory,
+            "server_env": args.env,
+        },
+        "scenarios": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["mongod", "mongomock", "external"], default="mongod",
+                        help="mongod temporal, mongomock (solo CPU) o el MongoDB configurado en .env")
+    parser.add_argument("--mongod-path", default=None, help="Ruta del binario mongod")
+    parser.add_argument("--documents", type=int, default=10000, help="Documentos a sembrar")
+    parser.add_argument("--shape", choices=["flat", "nested", "wide"], default="flat")
+    parser.add_argument("--batch-size", type=int, default=100, help="Documentos por lote en siembra e inserciones")
+    parser.add_argument("--large-batch-size", type=int, default=5000,
+                        help="Documentos por petición en el escenario insert_many_large")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos por escenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Segundos de calentamiento por escenario")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--header", action="append", default=[],
+                        help="Cabecera adicional 'Nombre: valor' (p. ej. 'Accept-Encoding: gzip')")
+    parser.add_argument("--env", action="append", default=[],
+                        help="Variable de entorno del servidor 'NOMBRE=valor' "
+                             "(p. ej. 'MONGO_API_INSERT_BATCH_COLLECTIONS=benchmark.writes')")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Mide con tracemalloc el pico de memoria de cada petición en el servidor "
+                             "(exacto con --concurrency 1; ralentiza el servidor)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="", help="Etiqueta libre para identificar la ejecución")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Resultados guardados en {os.path.abspath(args.output)}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
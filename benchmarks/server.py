@@ -0,0 +1,138 @@
+"""
+Lanzador de la API para los benchmarks.
+
+Arranca la aplicación con uvicorn en un proceso aparte. Con --backend mongomock
+sustituye el cliente de MongoDB por mongomock antes de importar la aplicación,
+lo que permite medir las rutas de CPU (validación, serialización, permisos)
+sin un servidor MongoDB.
+
+Con las variables BENCH_FAULT_* se inyectan fallos en las operaciones de las
+colecciones (latencia añadida y errores de conexión) durante una ventana de
+tiempo, para observar el límite de concurrencia y el circuit breaker:
+
+    BENCH_FAULT_DELAY_MS=800      latencia añadida a cada operación
+    BENCH_FAULT_ERROR_RATE=0.5    proporción de operaciones que fallan con AutoReconnect
+    BENCH_FAULT_START=20          segundos desde el arranque hasta el primer fallo
+    BENCH_FAULT_DURATION=10       segundos que dura cada ventana (0 = hasta el final)
+    BENCH_FAULT_PERIOD=0          segundos entre ventanas (0 = una sola ventana)
+
+Con BENCH_TRACE_MEMORY=1 cada respuesta incluye la cabecera X-Bench-Peak-Memory
+con el pico de memoria asignada por Python (tracemalloc) durante la petición, en
+bytes. El pico es del proceso: solo es el de cada petición con una petición a la
+vez (--concurrency 1). tracemalloc ralentiza el servidor, así que las latencias
+de esa ejecución no son comparables.
+
+Uso:
+    python -m benchmarks.server --port 28100 [--backend mongomock]
+"""
+import argparse
+import functools
+import os
+import random
+import time
+import tracemalloc
+
+# Operaciones de las colecciones en las que se inyectan fallos
+FAULT_METHODS = ["find", "find_one", "insert_one", "insert_many", "update_one", "update_many",
+                 "replace_one", "delete_one", "delete_many", "count_documents", "aggregate",
+                 "bulk_write", "distinct", "find_one_and_update", "find_one_and_delete",
+                 "find_one_and_replace"]
+
+
+def install_faults(collection_class):
+    """Envuelve las operaciones de la clase de colección con la inyección de fallos configurada."""
+    delay = float(os.getenv("BENCH_FAULT_DELAY_MS", "0")) / 1000.0
+    error_rate = float(os.getenv("BENCH_FAULT_ERROR_RATE", "0"))
+    if delay <= 0 and error_rate <= 0:
+        return
+    start = float(os.getenv("BENCH_FAULT_START", "0"))
+    duration = float(os.getenv("BENCH_FAULT_DURATION", "0"))
+    period = float(os.getenv("BENCH_FAULT_PERIOD", "0"))
+    booted = time.monotonic()
+
+    def active() -> bool:
+        elapsed = time.monotonic() - booted - start
+        if elapsed < 0:
+            return False
+        if period > 0:
+            elapsed %= period
+        return duration <= 0 or elapsed < duration
+
+    from pymongo.errors import AutoReconnect
+
+    def wrap(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if active():
+                if delay > 0:
+                    time.sleep(delay)
+                if random.random() < error_rate:
+                    raise AutoReconnect("fallo inyectado por el benchmark")
+            return method(*args, **kwargs)
+        return wrapper
+
+    for name in FAULT_METHODS:
+        method = getattr(collection_class, name, None)
+        if method is not None:
+            setattr(collection_class, name, wrap(method))
+
+
+class PeakMemoryMiddleware:
+    """Middleware ASGI que mide con tracemalloc el pico de memoria de cada petición HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+        async def send_with_peak(message):
+            # La respuesta ya está construida al enviar su inicio (JSON de las rutas)
+            if message["type"] == "http.response.start":
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-bench-peak-memory", str(peak).encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_peak)
+
+
+def create_app():
+    """Aplicación con la medición de memoria por petición (BENCH_TRACE_MEMORY=1)."""
+    from app.main import app
+
+    tracemalloc.start()
+    return PeakMemoryMiddleware(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=28100)
+    parser.add_argument("--backend", choices=["mongod", "mongomock"], default="mongod")
+    args = parser.parse_args()
+
+    if args.backend == "mongomock":
+        import mongomock
+        import pymongo
+        # Debe hacerse antes de importar app.config.database
+        pymongo.MongoClient = mongomock.MongoClient
+        install_faults(mongomock.collection.Collection)
+    else:
+        import pymongo.collection
+        install_faults(pymongo.collection.Collection)
+
+    import uvicorn
+    if os.getenv("BENCH_TRACE_MEMORY") == "1":
+        uvicorn.run("benchmarks.server:create_app", factory=True, host=args.host, port=args.port,
+                    log_level="warning", access_log=False)
+    else:
+        uvicorn.run("app.main:app", host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()